@@ -0,0 +1,496 @@
+import threading
+import time
+from collections import deque
+import numpy as np
+
+# Rates a device is tried at, in order, after the preferred one
+DEVICE_RATES = (48000, 44100, 96000, 32000, 16000)
+
+# Streaming linear-interpolation resampler for devices that can't deliver the mix
+# rate. The last input sample and the fractional read position carry over between
+# blocks, so chunk boundaries don't click.
+class LinearResampler:
+    def __init__(self, source_rate, target_rate, channels):
+        self.step = source_rate / target_rate
+        # Read position relative to self.last, which is index 0 of the next block
+        self.position = 0.0
+        self.last = np.zeros((1, channels), dtype=np.float32)
+
+    def process(self, data):
+        x = np.concatenate([self.last, data])
+        count = max(0, int(np.ceil((len(x) - 1 - self.position) / self.step)))
+        positions = self.position + np.arange(count) * self.step
+        index = positions.astype(np.int64)
+        frac = (positions - index).astype(np.float32)[:, None]
+        out = x[index] * (1 - frac) + x[np.minimum(index + 1, len(x) - 1)] * frac
+
+        self.position += count * self.step - len(data)
+        self.last = x[-1:]
+        return out
+
+# Peak limiter: gain drops at once when a block would clip and recovers slowly,
+# ramped across each block so gain changes never step. A final clip catches the
+# start of a block while the ramp is still coming down.
+class Limiter:
+    def __init__(self, ceiling=0.98, release_per_block=0.02):
+        self.ceiling = ceiling
+        self.release_per_block = release_per_block
+        self.gain = 1.0
+
+    def process(self, block):
+        peak = float(np.abs(block).max()) if len(block) else 0.0
+        target = min(1.0, self.ceiling / peak) if peak > 0 else 1.0
+        new_gain = target if target < self.gain else min(target, self.gain + self.release_per_block)
+        if new_gain != 1.0 or self.gain != 1.0:
+            block *= np.linspace(self.gain, new_gain, len(block), dtype=np.float32)[:, None]
+        self.gain = new_gain
+        np.clip(block, -1.0, 1.0, out=block)
+        return block
+
+# Fixed-size frames x channels float32 ring, allocated once. Writing never
+# blocks or allocates: when full, the oldest frames are overwritten and counted.
+class AudioRing:
+    def __init__(self, capacity, channels):
+        self.buffer = np.zeros((capacity, channels), dtype=np.float32)
+        self.capacity = capacity
+        self.start = 0
+        self.size = 0
+
+    def write(self, data):
+        # Returns how many frames were overwritten to make room
+        return self._write(data, len(data))
+
+    def write_silence(self, n):
+        return self._write(None, n)
+
+    def _write(self, data, n):
+        overwritten = max(0, self.size + n - self.capacity)
+        dropped = min(overwritten, self.size)
+        self.start = (self.start + dropped) % self.capacity
+        self.size -= dropped
+        if n > self.capacity:
+            # Even the start of the new data doesn't fit
+            if data is not None:
+                data = data[n - self.capacity:]
+            n = self.capacity
+        end = (self.start + self.size) % self.capacity
+        first = min(n, self.capacity - end)
+        if data is None:
+            self.buffer[end:end + first] = 0
+            self.buffer[:n - first] = 0
+        else:
+            self.buffer[end:end + first] = data[:first]
+            self.buffer[:n - first] = data[first:n]
+        self.size += n
+        return overwritten
+
+    def discard_newest(self, n):
+        # Forgets up to n of the most recent frames; returns the count
+        count = min(n, self.size)
+        self.size -= count
+        return count
+
+    def read_into(self, out):
+        # Moves up to len(out) of the oldest frames into out; returns the count
+        count = min(len(out), self.size)
+        first = min(count, self.capacity - self.start)
+        out[:first] = self.buffer[self.start:self.start + first]
+        out[first:count] = self.buffer[:count - first]
+        self.start = (self.start + count) % self.capacity
+        self.size -= count
+        return count
+
+# One capture device read on its own thread into a preallocated ring the mixer
+# drains on another, so a stalled mixer, encoder or disk never holds up the
+# device read: the ring overwrites its oldest max_latency seconds instead.
+# The device is opened at the first of device_rate, sample_rate and DEVICE_RATES
+# it accepts, with block_size frames per read, and resampled to the mix rate.
+# Chunks are placed on the mix timeline by their capture time: the first one is
+# aligned against the mixer's start, and later gaps or bursts bigger than
+# realign_threshold (a stalled or dropped device) are padded or trimmed. Smaller
+# errors are drift between the device's sample clock and the monotonic clock the
+# video is stamped with; with drift_correction they are steered out continuously
+# by resampling slightly faster or slower (at most max_correction), closing the
+# smoothed error over correction_horizon seconds. Until the epoch is known the
+# newest max_latency seconds are held back and aligned once it is set.
+# Overruns, gaps, drops and underruns are logged with their time in events.
+# prewarm() opens the device early and reads into the void, so start() only has
+# to begin keeping what arrives.
+class AudioSource:
+    def __init__(self, mic, sample_rate, channels, block_size=1024, gain=1.0,
+                 device_rate=None, max_latency=0.5, realign_threshold=0.1,
+                 drift_correction=True, correction_horizon=10.0, max_correction=0.002,
+                 max_events=256, delivery_window=0.25):
+        self.mic = mic
+        self.sample_rate = sample_rate
+        # Preferred rates in order; device_rate is the one that opened
+        self.rate_candidates = list(dict.fromkeys(
+            [rate for rate in (device_rate, sample_rate) if rate] + list(DEVICE_RATES)
+        ))
+        self.device_rate = None
+        self.channels = channels
+        self.block_size = block_size
+        self.gain = gain
+        self.resampler = None
+        self.drift_correction = drift_correction
+        self.correction_horizon = correction_horizon
+        self.max_correction = max_correction
+        self.base_step = 1.0
+        self.max_buffered = int(max_latency * sample_rate)
+        self.realign_frames = int(realign_threshold * sample_rate)
+
+        self.lock = threading.Lock()
+        self.ring = AudioRing(self.max_buffered, channels)
+        # Frames at the head of the timeline that were overwritten in the ring;
+        # read out as silence so everything after stays in place
+        self.lost = 0
+        # Frames the mixer has taken, including silence padded for this source
+        self.consumed = 0
+        self.epoch = None
+        self.aligned = False
+        self.on_data = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        # Monotonic time the first kept chunk arrived, for start latency
+        self.first_chunk_time = None
+
+        self.chunks_recorded = 0
+        # Times the device fell behind the wall clock by more than a couple of
+        # blocks, i.e. it dropped samples while this thread was starved
+        self.overruns = 0
+        # Silence padded because the device had nothing yet, and frames dropped
+        # because it ran ahead of the mix
+        self.underrun_frames = 0
+        self.dropped_frames = 0
+        # (monotonic time, kind, frames) of each overrun, gap, drop and underrun;
+        # a run of the same kind is one event
+        self.events = deque(maxlen=max_events)
+        self.last_event_time = None
+        # Set after late or lost chunks, so the next chunk on time is realigned
+        # rather than taken for drift
+        self.discontinuity = False
+        # (time, seconds behind) of the reads that waited for the device over
+        # the last delivery_window seconds of them
+        self.behind = deque(maxlen=max(3, int(delivery_window * sample_rate / block_size)))
+        self.behind_floor = None
+        # Smoothed distance in frames between where chunks land and where their
+        # capture time says they belong (positive: audio running late), the
+        # largest it got, the rate correction applied, and realignments
+        self.sync_error = 0.0
+        self.max_sync_error = 0.0
+        self.correction = 0.0
+        self.realigns = 0
+        # (data, capture time) recorded before the epoch was set
+        self.preroll = deque()
+        self.preroll_frames = 0
+
+    @property
+    def buffered(self):
+        return self.lost + self.ring.size
+
+    def prewarm(self):
+        if not self.thread:
+            self.thread = threading.Thread(target=self._record, daemon=True)
+            self.thread.start()
+
+    @property
+    def warm(self):
+        return self.thread is not None and self.thread.is_alive() and self.on_data is None
+
+    def start(self, epoch, on_data):
+        # epoch first: the recording thread starts keeping data once on_data is set.
+        # None holds the data back until set_epoch().
+        self.epoch = epoch
+        self.on_data = on_data
+        self.prewarm()
+
+    def set_epoch(self, epoch):
+        with self.lock:
+            self.epoch = epoch
+            while self.preroll:
+                self._place(*self.preroll.popleft())
+            self.preroll_frames = 0
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def _event(self, kind, frames, when=None, merge_within=0.25):
+        when = time.monotonic() if when is None else when
+        if (self.events and self.events[-1][1] == kind
+                and when - self.last_event_time < merge_within):
+            first, _, total = self.events[-1]
+            self.events[-1] = (first, kind, total + int(frames))
+        else:
+            self.events.append((when, kind, int(frames)))
+        self.last_event_time = when
+
+    def _open(self):
+        # The first candidate rate the device accepts
+        error = None
+        for rate in self.rate_candidates:
+            try:
+                context = self.mic.recorder(samplerate=rate, channels=self.channels,
+                                            blocksize=self.block_size)
+                recorder = context.__enter__()
+            except Exception as e:
+                error = e
+                continue
+            self.device_rate = rate
+            if rate != self.sample_rate or self.drift_correction:
+                self.resampler = LinearResampler(rate, self.sample_rate, self.channels)
+                self.base_step = self.resampler.step
+            if rate != self.rate_candidates[0]:
+                print(f"{self.mic.name}: recording at {rate} Hz")
+            return context, recorder
+        raise error
+
+    def _record(self):
+        try:
+            print(f"Recording audio from: {self.mic.name}")
+            context, recorder = self._open()
+            try:
+                start = time.monotonic()
+                frames = 0
+                while not self.stop_event.is_set():
+                    asked = time.monotonic()
+                    data = recorder.record(numframes=self.block_size)
+                    now = time.monotonic()
+                    frames += len(data)
+                    on_data = self.on_data
+                    if on_data is None:
+                        # Prewarming: keep the device running, drop the data
+                        continue
+                    if self.first_chunk_time is None:
+                        self.first_chunk_time = now
+                    self.chunks_recorded += 1
+
+                    late = self._track_delivery(now, (now - start) - frames / self.device_rate, now - asked)
+                    capture_time = now - len(data) / self.device_rate
+                    data = np.asarray(data, dtype=np.float32)
+                    if self.resampler:
+                        data = self.resampler.process(data)
+                    self._push(data, capture_time, late)
+                    on_data()
+            finally:
+                context.__exit__(None, None, None)
+        except Exception as e:
+            print(f"Audio recording error ({self.mic.name}): {e}")
+
+    def _track_delivery(self, now, behind, waited):
+        # How far the reads are behind the device's own pace. Only reads that
+        # had to wait for the device count towards the floor: their data is
+        # fresh, while a read that returns at once is backlog (a burst after
+        # this thread was starved) and says little about when it was captured.
+        # A floor that stays raised over the whole window means the device
+        # dropped samples meanwhile: an overrun. Returns True for a late chunk.
+        block = self.block_size / self.device_rate
+        if waited > block / 4:
+            self.behind.append((now, behind))
+            floor = min(b for _, b in self.behind)
+            if self.behind_floor is not None and floor - self.behind_floor > 2 * block:
+                self.overruns += 1
+                self._event("overrun", (floor - self.behind_floor) * self.device_rate, self.behind[0][0])
+                self.discontinuity = True
+            self.behind_floor = floor
+        return self.behind_floor is not None and behind - self.behind_floor > block + 0.01
+
+    def _push(self, data, capture_time, late=False):
+        with self.lock:
+            if self.epoch is None:
+                self.preroll.append((data, capture_time))
+                self.preroll_frames += len(data)
+                while self.preroll_frames - len(self.preroll[0][0]) >= self.max_buffered:
+                    self.preroll_frames -= len(self.preroll.popleft()[0])
+            elif late and self.aligned:
+                # Its capture time is unknown; keep it contiguous with the last
+                # chunk and realign once chunks arrive on time again
+                self.discontinuity = True
+                self._store(data, capture_time)
+            else:
+                self._place(data, capture_time)
+
+    def _place(self, data, capture_time):
+        expected = int(round((capture_time - self.epoch) * self.sample_rate))
+        gap = expected - (self.consumed + self.buffered)
+        resync = self.discontinuity and abs(gap) > self.block_size
+        if not self.aligned or resync or abs(gap) > self.realign_frames:
+            if -gap >= len(data) + self.ring.size:
+                # Entirely before the timeline, e.g. preroll ahead of the epoch
+                return
+            if self.aligned:
+                self.realigns += 1
+                self._event("gap", gap, capture_time)
+            self.aligned = True
+            self.sync_error = 0.0
+            if gap > 0:
+                self._store(None, capture_time, gap)
+            elif gap < 0:
+                # Ahead of the timeline: what is still buffered is the older
+                # audio (a backlog delivered late), so it goes first
+                removed = self.ring.discard_newest(-gap)
+                trimmed = -gap - removed
+                self.dropped_frames += removed + trimmed
+                data = data[trimmed:]
+        elif not self.discontinuity:
+            self._correct_drift(gap)
+        self.discontinuity = False
+        if len(data):
+            self._store(data, capture_time)
+
+    def _store(self, data, capture_time, silence=0):
+        # data, or that many frames of silence. A device running fast, or a
+        # stalled mixer, must not grow memory: the oldest frames give way.
+        if data is None:
+            overwritten = self.ring.write_silence(silence)
+        else:
+            overwritten = self.ring.write(data)
+        if overwritten:
+            self.lost += overwritten
+            self.dropped_frames += overwritten
+            self._event("dropped", overwritten, capture_time)
+
+    def _correct_drift(self, gap):
+        # Capture times jitter by a few ms per chunk, so steer on a running average
+        self.sync_error += 0.05 * (gap - self.sync_error)
+        self.max_sync_error = max(self.max_sync_error, abs(self.sync_error))
+        if self.drift_correction:
+            correction = self.sync_error / (self.sample_rate * self.correction_horizon)
+            self.correction = min(max(correction, -self.max_correction), self.max_correction)
+            # Running late: produce more output per input frame
+            self.resampler.step = self.base_step / (1 + self.correction)
+
+    def read(self, n):
+        # Exactly n frames, padded with silence if the device is behind
+        out = np.zeros((n, self.channels), dtype=np.float32)
+        with self.lock:
+            skipped = min(n, self.lost)
+            self.lost -= skipped
+            filled = skipped + self.ring.read_into(out[skipped:])
+            self.consumed += n
+            self.underrun_frames += n - filled
+            if filled < n and self.on_data is not None and not self.stop_event.is_set():
+                self._event("underrun", n - filled)
+        return out
+
+# Mixes the sources block by block on its own thread and streams the result to
+# the sinks as it goes: one sink for a single mixed track, or one per source to
+# keep them as separate tracks. A block is produced once every source has it, or
+# once it is `latency` seconds overdue, in which case missing sources are silent.
+# The time from capture of each block's first sample to the sinks taking it is
+# passed to on_latency in milliseconds.
+class AudioMixer:
+    def __init__(self, sources, sinks, sample_rate, block_size=1024, latency=0.1, on_latency=None):
+        self.sources = sources
+        self.sinks = sinks
+        self.separate = len(sinks) > 1
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.latency = latency
+        self.limiters = [Limiter() for _ in sinks]
+        self.data_ready = threading.Condition()
+        self.stopping = False
+        self.thread = None
+        self.epoch = None
+        self.blocks_mixed = 0
+        self.frames_mixed = 0
+        self.on_latency = on_latency
+
+    def start(self, epoch=None, wait=False):
+        # epoch: the monotonic time of the first sample, shared with the video;
+        # now if None, unless wait is set: then mixing waits for set_epoch()
+        if epoch is None and not wait:
+            epoch = time.monotonic()
+        self.epoch = epoch
+        for source in self.sources:
+            source.start(epoch, self._notify)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def set_epoch(self, epoch):
+        for source in self.sources:
+            source.set_epoch(epoch)
+        with self.data_ready:
+            self.epoch = epoch
+            self.data_ready.notify()
+
+    def stop(self, wait=True):
+        # Sources first, so whatever they recorded last is still mixed in.
+        # Without wait it is mixed and written on the mixer's thread; join()
+        # waits for that.
+        for source in self.sources:
+            source.stop()
+        if self.epoch is None:
+            # Never set: nothing on the timeline yet
+            self.set_epoch(time.monotonic())
+        with self.data_ready:
+            self.stopping = True
+            self.data_ready.notify()
+        if wait:
+            self.join()
+
+    def join(self):
+        if self.thread:
+            self.thread.join()
+
+    def _notify(self):
+        with self.data_ready:
+            self.data_ready.notify()
+
+    def _run(self):
+        period = self.block_size / self.sample_rate
+        with self.data_ready:
+            while self.epoch is None:
+                self.data_ready.wait()
+        deadline = self.epoch + period + self.latency
+        try:
+            while True:
+                with self.data_ready:
+                    while not self.stopping and not self._block_ready():
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            break
+                        self.data_ready.wait(timeout)
+                    stopping = self.stopping
+
+                if stopping:
+                    # Drain what the sources still hold, then finish
+                    remaining = max(source.buffered for source in self.sources)
+                    if remaining <= 0:
+                        break
+                    self._write(min(self.block_size, remaining))
+                    continue
+
+                self._write(self.block_size)
+                deadline += period
+        except Exception as e:
+            print(f"Audio mixer error: {e}")
+        finally:
+            for sink in self.sinks:
+                sink.close()
+
+    def _block_ready(self):
+        return all(source.buffered >= self.block_size for source in self.sources)
+
+    def _write(self, n):
+        blocks = [source.read(n) for source in self.sources]
+        for block, source in zip(blocks, self.sources):
+            if source.gain != 1.0:
+                block *= source.gain
+
+        if self.separate:
+            outputs = blocks
+        else:
+            mix = blocks[0]
+            for block in blocks[1:]:
+                mix += block
+            outputs = [mix]
+
+        for sink, limiter, block in zip(self.sinks, self.limiters, outputs):
+            sink.write(limiter.process(block))
+        if self.on_latency:
+            captured = self.epoch + self.frames_mixed / self.sample_rate
+            self.on_latency((time.monotonic() - captured) * 1000)
+        self.blocks_mixed += 1
+        self.frames_mixed += n
@@ -0,0 +1,358 @@
+import argparse
+import functools
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import imageio_ffmpeg
+import numpy as np
+
+from recorder import (AUDIO_CODECS, AUDIO_LAYOUTS, AUDIO_MIX, AUTO_TUNE, COMPOSITE, MONITOR_LAYOUTS,
+                      PIXEL_FORMATS, ScreenRecorder)
+
+# Headless benchmark for ScreenRecorder. mss and soundcard are replaced with
+# deterministic synthetic sources, so it runs on any Linux box without a display
+# or sound server. Each case runs in a fresh subprocess so peak RSS is per case.
+
+PATTERNS = ("gradient", "static")
+
+class SyntheticShot:
+    def __init__(self, raw, width, height):
+        self.raw = raw
+        self.width = width
+        self.height = height
+
+# Stands in for mss.mss(). "gradient" scrolls a colour ramp every frame, "static"
+# returns the same desktop-like image each time. Like mss, every grab returns a
+# freshly allocated bytearray. With several monitors they sit side by side and
+# monitors[0] is their bounding box, as in mss.
+class SyntheticScreen:
+    def __init__(self, width=1920, height=1080, pattern="gradient", speed=8, count=1):
+        self.width = width
+        self.height = height
+        self.pattern = pattern
+        self.speed = speed
+        self.frame_index = 0
+        screens = [
+            {"left": i * width, "top": 0, "width": width, "height": height}
+            for i in range(count)
+        ]
+        self.monitors = [{"left": 0, "top": 0, "width": width * count, "height": height}] + screens
+        # Twice as wide so a moving window over it gives a scrolling frame
+        x = np.arange(width * 2, dtype=np.uint32)
+        y = np.arange(height, dtype=np.uint32)[:, None]
+        self.base = np.empty((height, width * 2, 4), dtype=np.uint8)
+        self.base[:, :, 0] = (x * 255 // (width * 2)).astype(np.uint8)
+        self.base[:, :, 1] = (y * 255 // height).astype(np.uint8)
+        self.base[:, :, 2] = ((x + y) % 256).astype(np.uint8)
+        self.base[:, :, 3] = 255
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def grab(self, monitor):
+        width, height = monitor["width"], monitor["height"]
+        offset = 0
+        if self.pattern == "gradient":
+            offset = (self.frame_index * self.speed) % self.width
+        self.frame_index += 1
+
+        raw = bytearray(width * height * 4)
+        frame = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4)
+        # The bounding box of several monitors is wider than the pattern
+        for x in range(0, width, self.width):
+            span = min(self.width, width - x)
+            np.copyto(frame[:, x:x + span], self.base[:height, offset:offset + span])
+        return SyntheticShot(raw, width, height)
+
+class SineRecorder:
+    def __init__(self, samplerate, channels, frequency):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.frequency = frequency
+        self.position = 0
+        self.next_time = None
+
+    def __enter__(self):
+        self.next_time = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def record(self, numframes):
+        # Deliver audio at the real-time rate, like a device would
+        self.next_time += numframes / self.samplerate
+        delay = self.next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        t = (np.arange(numframes) + self.position) / self.samplerate
+        self.position += numframes
+        tone = (0.25 * np.sin(2 * np.pi * self.frequency * t)).astype(np.float32)
+        return np.repeat(tone[:, None], self.channels, axis=1)
+
+class SineMicrophone:
+    def __init__(self, frequency=440.0, channels=2, device_id="synthetic-sine"):
+        self.id = device_id
+        self.name = f"Synthetic Sine {frequency:g} Hz"
+        self.isloopback = False
+        self.channels = channels
+        self.frequency = frequency
+
+    def recorder(self, samplerate, channels=None, blocksize=None):
+        return SineRecorder(samplerate, channels or self.channels, self.frequency)
+
+# Stands in for the soundcard module. Extra tones become extra devices
+# ("synthetic-sine-2", ...) so mixing several sources can be measured.
+class SyntheticAudioBackend:
+    def __init__(self, frequencies=(440.0,)):
+        self.microphones = [
+            SineMicrophone(f, device_id="synthetic-sine" if i == 0 else f"synthetic-sine-{i + 1}")
+            for i, f in enumerate(frequencies)
+        ]
+
+    def all_microphones(self, include_loopback=False):
+        return self.microphones
+
+def count_output_frames(filename):
+    # framecrc prints one line per packet without decoding anything
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), "-i", filename, "-map", "0:v", "-c", "copy", "-f", "framecrc", "-"]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return sum(1 for line in result.stdout.splitlines() if line and not line.startswith("#"))
+
+def run_case(case):
+    width, height = case["width"], case["height"]
+    screen = functools.partial(SyntheticScreen, width, height, case["pattern"], count=case["monitors"])
+    frequencies = [440.0 * (i + 2) / 2 for i in range(case["audio_sources"])]
+    audio = SyntheticAudioBackend(frequencies) if case["audio"] else None
+    rec = ScreenRecorder(screen_source=screen, audio_backend=audio)
+    rec.audio_recorder.block_size = case["audio_block"]
+
+    latencies = []
+    lock = threading.Lock()
+
+    def on_frame_written(capture_time, written_time):
+        with lock:
+            latencies.append(written_time - capture_time)
+
+    rec.on_frame_written = on_frame_written
+    output = case["output"]
+
+    options = dict(
+        fps=case["fps"],
+        monitor_index=0 if case["monitors"] > 1 else 1,
+        monitor_layout=case["layout"],
+        audio_device_id=[mic.id for mic in audio.microphones] if audio else None,
+        audio_layout=case["audio_layout"],
+        audio_codec=case["audio_codec"],
+        encoder_settings=AUTO_TUNE if case["auto_tune"] else None,
+        adaptive_quality=case["adaptive_quality"],
+        skip_unchanged=case["skip_unchanged"],
+        use_capture_process=case["process"],
+        frame_rate_mode=case["frame_rate_mode"],
+        pixel_format=case["pixel_format"]
+    )
+    if case["spool"]:
+        options.update(spool=case["spool"], spool_size=case["spool_mb"] * 1024 * 1024)
+    if case["prewarm"] and audio:
+        # As the GUI does once the devices are picked
+        rec.prewarm_audio(options["audio_device_id"])
+        time.sleep(0.5)
+    save_s = None
+    if case["replay"]:
+        rec.start_replay(**options)
+    else:
+        rec.start_recording(filename=output, **options)
+    started = time.monotonic()
+    time.sleep(case["duration"])
+    if case["replay"]:
+        # The whole buffer, saved while the replay keeps recording
+        save_started = time.monotonic()
+        rec.save_replay(output)
+        save_s = time.monotonic() - save_started
+    stop_started = time.monotonic()
+    rec.stop_recording()
+    finished = time.monotonic()
+
+    # Taken before running ffmpeg again to count frames
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    recorded = stop_started - started
+    frames_written = len(latencies)
+    output_frames = count_output_frames(output) if os.path.exists(output) else 0
+    lat_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    dropped = rec.frames_dropped
+    stats = rec.get_stats()
+    quality = stats["quality"]
+
+    result = dict(case)
+    result.update({
+        "frames_captured": rec.frames_captured,
+        "frames_unchanged": rec.frames_unchanged,
+        "frames_written": frames_written,
+        "output_frames": output_frames,
+        "capture_fps": rec.frames_captured / recorded,
+        "written_fps": frames_written / recorded,
+        "dropped_late": dropped["late"],
+        "dropped_queue": dropped["queue_oldest"] + dropped["queue_newest"],
+        # Frames ffmpeg repeated to hold the constant rate
+        "duplicated": max(0, output_frames - frames_written),
+        "latency_ms_p50": float(np.percentile(lat_ms, 50)),
+        "latency_ms_p95": float(np.percentile(lat_ms, 95)),
+        "latency_ms_max": float(lat_ms.max()),
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": self_usage.ru_maxrss / 1024,
+        "ffmpeg_peak_rss_mb": child_usage.ru_maxrss / 1024,
+        "finalize_s": finished - stop_started,
+        "replay_save_s": save_s,
+        "audio_underrun_frames": rec.audio_recorder.underrun_frames,
+        "audio_latency_ms_p95": stats["audio"]["latency"]["p95_ms"],
+        "audio_events": len(stats["audio"]["events"]),
+        "encoder_settings": rec.encoder_settings,
+        "quality_log": quality["log"],
+        "final_fps": quality["effective_fps"],
+        "spool_peak_mb": stats["spool"]["peak_bytes"] / 1024 / 1024 if "spool" in stats else None,
+        "yuv_ms_mean": stats["stages"]["yuv"]["mean_ms"],
+        "encode_ms_mean": stats["stages"]["encode"]["mean_ms"],
+        "first_frame_ms": stats["startup"]["first_frame_ms"],
+        "first_audio_ms": stats["startup"]["first_audio_ms"],
+    })
+    if not case["keep"] and os.path.exists(output):
+        os.remove(output)
+    return result
+
+def run_case_subprocess(case):
+    cmd = [sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
+    lines = [l for l in result.stdout.splitlines() if l.startswith("{")]
+    if result.returncode != 0 or not lines:
+        print(f"Case failed: {case}")
+        return None
+    return json.loads(lines[-1])
+
+def print_table(results):
+    columns = [
+        ("res", lambda r: f"{r['width']}x{r['height']}"),
+        ("fps", lambda r: str(r["fps"])),
+        ("pattern", lambda r: r["pattern"]),
+        ("mode", lambda r: "proc" if r["process"] else "thread"),
+        ("pix", lambda r: r["pixel_format"]),
+        ("mon", lambda r: str(r["monitors"]) if r["monitors"] == 1 else f"{r['monitors']} {r['layout']}"),
+        ("cap fps", lambda r: f"{r['capture_fps']:.1f}"),
+        ("enc fps", lambda r: f"{r['written_fps']:.1f}"),
+        ("late", lambda r: str(r["dropped_late"])),
+        ("q drop", lambda r: str(r["dropped_queue"])),
+        ("unchg", lambda r: str(r["frames_unchanged"])),
+        ("dup", lambda r: str(r["duplicated"])),
+        ("yuv ms", lambda r: f"{r['yuv_ms_mean']:.1f}" if r["pixel_format"] != "bgra" else "-"),
+        ("pipe ms", lambda r: f"{r['encode_ms_mean']:.1f}"),
+        ("lat p50", lambda r: f"{r['latency_ms_p50']:.1f}"),
+        ("lat p95", lambda r: f"{r['latency_ms_p95']:.1f}"),
+        ("rss MB", lambda r: f"{r['peak_rss_mb']:.0f}"),
+        ("ffmpeg MB", lambda r: f"{r['ffmpeg_peak_rss_mb']:.0f}"),
+        ("finalize s", lambda r: f"{r['finalize_s']:.2f}"),
+        ("aud lat", lambda r: f"{r['audio_latency_ms_p95']:.0f}" if r["audio"] else "-"),
+        ("aud ev", lambda r: str(r["audio_events"]) if r["audio"] else "-"),
+        ("start ms", lambda r: "/".join("-" if v is None else f"{v:.0f}" for v in (r["first_frame_ms"], r["first_audio_ms"]))),
+        ("save s", lambda r: "-" if r["replay_save_s"] is None else f"{r['replay_save_s']:.3f}"),
+        ("preset", lambda r: r["encoder_settings"]["preset"]),
+        ("spool MB", lambda r: "-" if r["spool_peak_mb"] is None else f"{r['spool_peak_mb']:.0f}"),
+        ("adapt", lambda r: f"{len(r['quality_log'])} -> {r['final_fps']:.0f}" if r["adaptive_quality"] else "-"),
+    ]
+    rows = [[name for name, _ in columns]]
+    for r in results:
+        rows.append([fmt(r) for _, fmt in columns])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    for row in rows:
+        print("  ".join(cell.rjust(w) for cell, w in zip(row, widths)))
+
+def parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ScreenRecorder with synthetic sources")
+    parser.add_argument("--resolutions", nargs="+", default=["1280x720", "1920x1080", "3840x2160"])
+    parser.add_argument("--fps", nargs="+", type=int, default=[30, 60])
+    parser.add_argument("--patterns", nargs="+", choices=PATTERNS, default=list(PATTERNS))
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--audio", action="store_true", help="also record a synthetic sine tone")
+    parser.add_argument("--audio-sources", type=int, default=1, help="sine devices to mix (with --audio)")
+    parser.add_argument("--audio-layout", choices=list(AUDIO_LAYOUTS), default=AUDIO_MIX)
+    parser.add_argument("--audio-codec", choices=list(AUDIO_CODECS), default="aac")
+    parser.add_argument("--audio-block", type=int, default=1024, help="frames per audio device read")
+    parser.add_argument("--process", action="store_true", help="capture in a separate process")
+    parser.add_argument("--pixel-formats", nargs="+", choices=list(PIXEL_FORMATS), default=["bgra"],
+                        help="what is sent to ffmpeg; several run each case once per format")
+    parser.add_argument("--no-skip-unchanged", action="store_true")
+    parser.add_argument("--frame-rate-mode", choices=["cfr", "vfr"], default="cfr")
+    parser.add_argument("--monitors", type=int, default=1, help="synthetic monitors, recorded as All Monitors")
+    parser.add_argument("--layout", choices=list(MONITOR_LAYOUTS), default=COMPOSITE)
+    parser.add_argument("--auto-tune", action="store_true", help="use the probed encoder profile for this machine")
+    parser.add_argument("--adaptive-quality", action="store_true", help="lower the capture rate while the encoder is behind")
+    parser.add_argument("--replay", action="store_true", help="run instant replay and time saving the buffer")
+    parser.add_argument("--spool", choices=["live", "deferred"], help="spool frames to disk before encoding")
+    parser.add_argument("--spool-mb", type=int, default=2048, help="spool file size (with --spool)")
+    parser.add_argument("--prewarm", action="store_true", help="open the audio devices before starting (with --audio)")
+    parser.add_argument("--keep", action="store_true", help="keep the recorded files")
+    parser.add_argument("--json", help="write all results to this file")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    results = []
+    for resolution in args.resolutions:
+        width, height = parse_resolution(resolution)
+        for fps in args.fps:
+            for pattern in args.patterns:
+                for pixel_format in args.pixel_formats:
+                    case = {
+                        "width": width,
+                        "height": height,
+                        "fps": fps,
+                        "pattern": pattern,
+                        "duration": args.duration,
+                        "audio": args.audio,
+                        "audio_sources": args.audio_sources,
+                        "audio_layout": args.audio_layout,
+                        "audio_codec": args.audio_codec,
+                        "audio_block": args.audio_block,
+                        "process": args.process,
+                        "pixel_format": pixel_format,
+                        "skip_unchanged": not args.no_skip_unchanged,
+                        "frame_rate_mode": args.frame_rate_mode,
+                        "monitors": args.monitors,
+                        "layout": args.layout,
+                        "auto_tune": args.auto_tune,
+                        "adaptive_quality": args.adaptive_quality,
+                        "replay": args.replay,
+                        "spool": args.spool,
+                        "spool_mb": args.spool_mb,
+                        "prewarm": args.prewarm,
+                        "keep": args.keep,
+                        "output": f"bench_{width}x{height}_{fps}_{pattern}_{pixel_format}.mp4",
+                    }
+                    print(f"Running {resolution} @ {fps} fps, {pattern}, {pixel_format}...")
+                    result = run_case_subprocess(case)
+                    if result:
+                        results.append(result)
+
+    print()
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import ctypes
+import ctypes.util
+import platform
+import numpy as np
+
+# A cursor image ready to blend: premultiplied BGR plus inverse alpha, both uint16
+# so the blend never overflows, and the hotspot offset.
+class CursorSprite:
+    def __init__(self, bgra_premultiplied, xhot, yhot):
+        self.bgr = bgra_premultiplied[:, :, :3].astype(np.uint16)
+        self.inv_alpha = 255 - bgra_premultiplied[:, :, 3:4].astype(np.uint16)
+        self.height, self.width = bgra_premultiplied.shape[:2]
+        self.xhot = xhot
+        self.yhot = yhot
+
+def render_dot_sprite(radius=5):
+    # Drawn once with PIL, then reused for every frame. PIL is only imported
+    # when the cursor is actually recorded.
+    from PIL import Image, ImageDraw
+    size = radius * 2 + 1
+    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    ImageDraw.Draw(img).ellipse((0, 0, size - 1, size - 1), fill="red", outline="white")
+    rgba = np.array(img)
+    alpha = rgba[:, :, 3:4].astype(np.uint16)
+    bgra = np.empty_like(rgba)
+    bgra[:, :, :3] = (rgba[:, :, 2::-1] * alpha // 255).astype(np.uint8)
+    bgra[:, :, 3:4] = rgba[:, :, 3:4]
+    return CursorSprite(bgra, radius, radius)
+
+def blend_sprite(frame, sprite, x, y):
+    # Alpha-blend the sprite with its top-left at (x, y), touching only the
+    # overlapping slice of the BGRA frame
+    height, width = frame.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + sprite.width, width), min(y + sprite.height, height)
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    region = frame[y0:y1, x0:x1, :3]
+    sx, sy = x0 - x, y0 - y
+    bgr = sprite.bgr[sy:sy + (y1 - y0), sx:sx + (x1 - x0)]
+    inv_alpha = sprite.inv_alpha[sy:sy + (y1 - y0), sx:sx + (x1 - x0)]
+
+    blended = region * inv_alpha
+    blended //= 255
+    blended += bgr
+    region[...] = blended
+
+class XFixesCursorImage(ctypes.Structure):
+    _fields_ = [
+        ("x", ctypes.c_short),
+        ("y", ctypes.c_short),
+        ("width", ctypes.c_ushort),
+        ("height", ctypes.c_ushort),
+        ("xhot", ctypes.c_ushort),
+        ("yhot", ctypes.c_ushort),
+        ("cursor_serial", ctypes.c_ulong),
+        ("pixels", ctypes.POINTER(ctypes.c_ulong)),
+        ("atom", ctypes.c_ulong),
+        ("name", ctypes.c_char_p),
+    ]
+
+# Pointer position (and, with XFixes, the real cursor image) from the X server.
+# Works on any X display, including Xvfb.
+class X11CursorBackend:
+    def __init__(self, display_name=None):
+        self.xlib = ctypes.cdll.LoadLibrary(ctypes.util.find_library("X11") or "libX11.so.6")
+        self.xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        self.xlib.XOpenDisplay.restype = ctypes.c_void_p
+        self.xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        self.xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        self.xlib.XQueryPointer.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong,
+            ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_ulong),
+            ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
+            ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
+            ctypes.POINTER(ctypes.c_uint)
+        ]
+        self.xlib.XQueryPointer.restype = ctypes.c_int
+        self.xlib.XFree.argtypes = [ctypes.c_void_p]
+        self.xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+
+        self.display = self.xlib.XOpenDisplay(display_name.encode() if display_name else None)
+        if not self.display:
+            raise OSError("Cannot open X display")
+        self.root = self.xlib.XDefaultRootWindow(self.display)
+
+        self.xfixes = None
+        try:
+            self.xfixes = ctypes.cdll.LoadLibrary(ctypes.util.find_library("Xfixes") or "libXfixes.so.3")
+            self.xfixes.XFixesGetCursorImage.argtypes = [ctypes.c_void_p]
+            self.xfixes.XFixesGetCursorImage.restype = ctypes.POINTER(XFixesCursorImage)
+        except OSError:
+            pass
+
+        self.cursor_serial = None
+        self.sprite = None
+
+    def poll(self):
+        if self.xfixes:
+            return self._poll_xfixes()
+        return self._query_pointer() + (None,)
+
+    def _query_pointer(self):
+        root, child = ctypes.c_ulong(), ctypes.c_ulong()
+        root_x, root_y = ctypes.c_int(), ctypes.c_int()
+        win_x, win_y = ctypes.c_int(), ctypes.c_int()
+        mask = ctypes.c_uint()
+        self.xlib.XQueryPointer(
+            self.display, self.root, ctypes.byref(root), ctypes.byref(child),
+            ctypes.byref(root_x), ctypes.byref(root_y),
+            ctypes.byref(win_x), ctypes.byref(win_y), ctypes.byref(mask)
+        )
+        return (root_x.value, root_y.value)
+
+    def _poll_xfixes(self):
+        image_ptr = self.xfixes.XFixesGetCursorImage(self.display)
+        if not image_ptr:
+            return self._query_pointer() + (None,)
+        try:
+            image = image_ptr.contents
+            # Only rebuild the sprite when the cursor shape actually changed
+            if image.cursor_serial != self.cursor_serial:
+                count = image.width * image.height
+                # Pixels are premultiplied ARGB stored in unsigned longs
+                argb = np.ctypeslib.as_array(image.pixels, shape=(count,)).astype(np.uint32)
+                bgra = argb.view(np.uint8).reshape(image.height, image.width, 4).copy()
+                self.sprite = CursorSprite(bgra, image.xhot, image.yhot)
+                self.cursor_serial = image.cursor_serial
+            return (image.x, image.y, self.sprite)
+        finally:
+            self.xlib.XFree(image_ptr)
+
+    def close(self):
+        if self.display:
+            self.xlib.XCloseDisplay(self.display)
+            self.display = None
+
+class WindowsCursorBackend:
+    def __init__(self):
+        import ctypes.wintypes
+        self.point = ctypes.wintypes.POINT()
+
+    def poll(self):
+        ctypes.windll.user32.GetCursorPos(ctypes.byref(self.point))
+        return (self.point.x, self.point.y, None)
+
+    def close(self):
+        pass
+
+# Draws the pointer onto captured BGRA frames. Uses the real cursor image when the
+# backend provides one and a prerendered dot otherwise.
+class CursorOverlay:
+    def __init__(self, display_name=None):
+        self.default_sprite = render_dot_sprite()
+        self.backend = None
+        try:
+            if platform.system() == "Windows":
+                self.backend = WindowsCursorBackend()
+            else:
+                self.backend = X11CursorBackend(display_name)
+        except Exception as e:
+            print(f"Cursor capture unavailable: {e}")
+
+    def draw(self, frame, monitor):
+        if not self.backend:
+            return
+        x, y, sprite = self.backend.poll()
+        sprite = sprite or self.default_sprite
+        blend_sprite(
+            frame,
+            sprite,
+            x - monitor["left"] - sprite.xhot,
+            y - monitor["top"] - sprite.yhot
+        )
+
+    def close(self):
+        if self.backend:
+            self.backend.close()
+            self.backend = None
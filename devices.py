@@ -0,0 +1,168 @@
+import threading
+import time
+
+def default_screen_source():
+    # mss is only imported once something is actually captured or enumerated.
+    # Module level so the capture process can unpickle it.
+    import mss
+    return mss.mss()
+
+# default_screen_source for one X display, e.g. ":99" of an Xvfb server, so
+# several can be recorded from one process. Picklable like the function.
+class DisplayScreenSource:
+    def __init__(self, display):
+        self.display = display
+
+    def __call__(self):
+        import mss
+        return mss.mss(display=self.display)
+
+# Monitors and audio devices, enumerated once and shared by the GUI and the
+# recorder instead of each asking the display and the sound server again.
+# Entries older than max_age are enumerated again on the next lookup; with
+# start_watching() a background thread does that every poll_interval seconds
+# instead, and listeners hear about any change.
+class DeviceRegistry:
+    def __init__(self, screen_source=None, audio_backend=None, max_age=5.0, poll_interval=2.0):
+        self.screen_source = screen_source or default_screen_source
+        # soundcard unless another backend is given; imported lazily since it
+        # needs a running sound server
+        self._audio_backend = audio_backend
+        self.max_age = max_age
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self._monitors = None
+        self._monitor_names = None
+        self._microphones = None
+        self._monitors_time = 0.0
+        self._microphones_time = 0.0
+        self.listeners = []
+        self.watch_thread = None
+        self.watch_stop = threading.Event()
+        self.refreshes = 0
+
+    @property
+    def audio_backend(self):
+        if self._audio_backend is None:
+            import soundcard
+            self._audio_backend = soundcard
+        return self._audio_backend
+
+    @property
+    def watching(self):
+        return self.watch_thread is not None
+
+    def _stale(self, stamp):
+        return not self.watching and time.monotonic() - stamp > self.max_age
+
+    def monitors(self):
+        # mss monitor dicts; [0] is the bounding box of all of them
+        with self.lock:
+            stale = self._monitors is None or self._stale(self._monitors_time)
+        if stale:
+            self.refresh(microphones=False)
+        return self._monitors
+
+    def monitor_names(self):
+        # A display name per mss monitor, "All Monitors" first. screeninfo is only
+        # asked for names, and matched to mss by position rather than by order.
+        monitors = self.monitors()
+        with self.lock:
+            names = self._monitor_names
+        if names is None or len(names) != len(monitors):
+            try:
+                from screeninfo import get_monitors
+                real = {(m.x, m.y, m.width, m.height): m.name for m in get_monitors()}
+            except Exception:
+                real = {}
+            names = ["All Monitors"]
+            for i, m in enumerate(monitors[1:], 1):
+                name = real.get((m["left"], m["top"], m["width"], m["height"])) or f"Monitor {i}"
+                names.append(name.replace("\\.\\", ""))
+            with self.lock:
+                self._monitor_names = names
+        return names
+
+    def microphones(self):
+        # Capture devices, loopback included
+        with self.lock:
+            stale = self._microphones is None or self._stale(self._microphones_time)
+        if stale:
+            self.refresh(monitors=False)
+        return self._microphones
+
+    def find_microphone(self, device_id):
+        for mic in self.microphones():
+            if mic.id == device_id:
+                return mic
+        # Maybe plugged in since the last enumeration
+        if self.refresh(monitors=False):
+            for mic in self._microphones:
+                if mic.id == device_id:
+                    return mic
+        return None
+
+    def _enumerate_monitors(self):
+        with self.screen_source() as sct:
+            return [dict(m) for m in sct.monitors]
+
+    def _enumerate_microphones(self):
+        try:
+            return list(self.audio_backend.all_microphones(include_loopback=True))
+        except Exception as e:
+            print(f"Error getting audio devices: {e}")
+            return []
+
+    @staticmethod
+    def _mic_key(mics):
+        return [(mic.id, mic.name) for mic in mics or []]
+
+    def refresh(self, monitors=True, microphones=True):
+        # Enumerates again; returns True (and tells listeners) if anything changed
+        changed = False
+        if monitors:
+            found = self._enumerate_monitors()
+            with self.lock:
+                if found != self._monitors:
+                    changed = self._monitors is not None or changed
+                    self._monitors = found
+                    self._monitor_names = None
+                self._monitors_time = time.monotonic()
+        if microphones:
+            found = self._enumerate_microphones()
+            with self.lock:
+                if self._mic_key(found) != self._mic_key(self._microphones):
+                    changed = self._microphones is not None or changed
+                    self._microphones = found
+                self._microphones_time = time.monotonic()
+        self.refreshes += 1
+        if changed:
+            for callback in list(self.listeners):
+                try:
+                    callback(self)
+                except Exception as e:
+                    print(f"Device listener error: {e}")
+        return changed
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def start_watching(self):
+        if self.watch_thread:
+            return
+        self.watch_stop.clear()
+        self.watch_thread = threading.Thread(target=self._watch, daemon=True)
+        self.watch_thread.start()
+
+    def stop_watching(self):
+        self.watch_stop.set()
+        if self.watch_thread:
+            self.watch_thread.join()
+            self.watch_thread = None
+
+    def _watch(self):
+        while not self.watch_stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Device refresh error: {e}")
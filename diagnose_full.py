@@ -10,21 +10,21 @@ rec = ScreenRecorder()
 devices = rec.get_audio_devices()
 print("Available Audio Devices:")
 for d in devices:
-    print(f"{d['index']}: {d['name']} ({d['rate']}Hz)")
+    print(f"{d['id']}: {d['name']} (Loopback: {d['is_loopback']})")
 
 if not devices:
     print("No audio devices found! Cannot test audio.")
     exit()
 
 # Use first device
-audio_index = devices[0]['index']
+audio_id = devices[0]['id']
 if len(devices) > 1:
-    audio_index = devices[1]['index']
+    audio_id = devices[1]['id']
 
-print(f"Selected Audio Device Index: {audio_index}")
+print(f"Selected Audio Device ID: {audio_id}")
 
 print("Starting recording (Video + Audio) for 5 seconds...")
-rec.start_recording("test_full.mp4", fps=30, audio_device_index=audio_index)
+rec.start_recording("test_full.mp4", fps=30, audio_device_id=audio_id)
 
 time.sleep(5)
 
@@ -38,9 +38,4 @@ if os.path.exists("test_full.mp4"):
 else:
     print("Failure! Output video not found.")
 
-if os.path.exists("temp_video.mp4"):
-    print(f"Temp video still exists (size: {os.path.getsize('temp_video.mp4')}) - Muxing might have failed to clean up or was skipped.")
-if os.path.exists("temp_audio.wav"):
-    print(f"Temp audio still exists (size: {os.path.getsize('temp_audio.wav')})")
-
 print(f"FFmpeg path: {imageio_ffmpeg.get_ffmpeg_exe()}")
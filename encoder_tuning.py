@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import imageio_ffmpeg
+import numpy as np
+
+from recorder import CFR, DEFAULT_ENCODER_SETTINGS, FFmpegEncoder
+
+# Finds the best libx264 settings this machine can encode in real time at a given
+# resolution and fps, by pushing synthetic frames through the same pipe and
+# muxer a recording uses. The winner is cached per CPU, so only the first
+# recording at a new size pays for the probe.
+
+# Slowest (best compression per bit) first; the first preset that keeps up wins.
+# Starts well above the ultrafast default, so a machine with headroom gets a
+# better looking file rather than only ever a faster one.
+PRESETS = ("fast", "faster", "veryfast", "superfast", "ultrafast")
+# Encoding has to beat the target fps by this much to leave room for capture
+HEADROOM = 1.25
+PROBE_SECONDS = 1.0
+
+def cache_path():
+    base = os.environ.get("SCREENREC_CACHE_DIR")
+    if not base:
+        if platform.system() == "Windows":
+            root = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+        else:
+            root = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+        base = os.path.join(root, "screenrec")
+    return os.path.join(base, "encoder_profiles.json")
+
+def cpu_name():
+    name = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    name = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return name or platform.machine()
+
+def profile_key(width, height, fps):
+    # A different CPU, core count or ffmpeg build invalidates the profile
+    machine = f"{cpu_name()} x{os.cpu_count()} ffmpeg {imageio_ffmpeg.get_ffmpeg_version()}"
+    return f"{machine} | {width}x{height}@{fps}"
+
+def load_profiles():
+    try:
+        with open(cache_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_profiles(profiles):
+    path = cache_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(tmp, path)
+
+def synthetic_frames(width, height, count, speed=8):
+    # Scrolling colour ramp, so every frame differs like busy screen content
+    x = np.arange(width * 2, dtype=np.uint32)
+    y = np.arange(height, dtype=np.uint32)[:, None]
+    base = np.empty((height, width * 2, 4), dtype=np.uint8)
+    base[:, :, 0] = (x * 255 // (width * 2)).astype(np.uint8)
+    base[:, :, 1] = (y * 255 // height).astype(np.uint8)
+    base[:, :, 2] = ((x + y) % 256).astype(np.uint8)
+    base[:, :, 3] = 255
+    frame = np.empty((height, width, 4), dtype=np.uint8)
+    for i in range(count):
+        offset = (i * speed) % width
+        np.copyto(frame, base[:, offset:offset + width])
+        yield frame
+
+def probe(width, height, fps, settings, seconds=PROBE_SECONDS):
+    # Frames per second one candidate sustains, start to finished file
+    work_dir = tempfile.mkdtemp(prefix="screenrec_tune_")
+    try:
+        encoder = FFmpegEncoder(
+            os.path.join(work_dir, "probe.mp4"), [((width, height), None)], fps,
+            frame_rate_mode=CFR, encoder_settings=settings
+        )
+        count = max(30, int(fps * seconds))
+        encoder.start()
+        start = time.monotonic()
+        for i, frame in enumerate(synthetic_frames(width, height, count)):
+            encoder.write_frame(frame, i * 1000 / fps)
+        encoder.close()
+        elapsed = time.monotonic() - start
+        if encoder.error:
+            return 0.0
+        return count / elapsed
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def tune(width, height, fps, log=print):
+    target = fps * HEADROOM
+    results = []
+
+    def measure(**overrides):
+        settings = dict(DEFAULT_ENCODER_SETTINGS, **overrides)
+        measured = probe(width, height, fps, settings)
+        results.append((settings, measured))
+        log(f"  preset {settings['preset']:<10} tune {settings['tune'] or '-':<12} "
+            f"threads {settings['threads'] or 'auto':<5} {measured:6.1f} fps")
+        return measured
+
+    # Pick the preset first with x264's own threading, then see whether
+    # zerolatency or fewer threads do better at that preset
+    preset = PRESETS[-1]
+    for candidate in PRESETS:
+        if measure(preset=candidate) >= target:
+            preset = candidate
+            break
+    measure(preset=preset, tune="zerolatency")
+    cpus = os.cpu_count() or 1
+    if cpus > 2:
+        measure(preset=preset, threads=cpus // 2)
+
+    same_preset = [r for r in results if r[0]["preset"] == preset]
+    keeping_up = [r for r in same_preset if r[1] >= target]
+    settings, measured = max(keeping_up or same_preset, key=lambda r: r[1])
+    return {
+        "settings": settings,
+        "measured_fps": round(measured, 1),
+        "keeps_up": measured >= target,
+        "probed_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+def get_profile(width, height, fps, refresh=False):
+    # Settings for FFmpegEncoder, probing only when nothing is cached
+    key = profile_key(width, height, fps)
+    entry = None if refresh else load_profiles().get(key)
+    if entry is None:
+        print(f"Tuning encoder for {width}x{height} @ {fps} fps...")
+        entry = tune(width, height, fps)
+        profiles = load_profiles()
+        profiles[key] = entry
+        save_profiles(profiles)
+    return dict(entry["settings"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Probe and cache the best encoder settings for this machine")
+    parser.add_argument("--resolution", default="1920x1080")
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--refresh", action="store_true", help="probe again even if a profile is cached")
+    parser.add_argument("--list", action="store_true", help="show the cached profiles")
+    args = parser.parse_args()
+
+    if args.list:
+        for key, entry in load_profiles().items():
+            print(f"{key}: {entry['settings']} ({entry['measured_fps']} fps)")
+        return
+
+    width, height = (int(v) for v in args.resolution.lower().split("x"))
+    settings = get_profile(width, height, args.fps, refresh=args.refresh)
+    print(f"Profile: {settings}")
+    print(f"Cached in {cache_path()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import concurrent.futures
+import threading
+import time
+
+# Background finalization of one recording, returned by stop_recording_async().
+# Behaves like a future (done, wait, result, add_done_callback) and reports
+# progress while queued frames drain and ffmpeg finishes the file.
+class FinalizeJob:
+    DRAINING = "draining"   # capture stopped, queued frames still going to the encoder
+    ENCODING = "encoding"   # ffmpeg encoding what it has buffered and closing the file
+    MUXING = "muxing"       # audio muxed in at the end (no FIFO or named pipe)
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, output_filename, encoder, queue_depth):
+        self.output_filename = output_filename
+        self.encoder = encoder
+        self._queue_depth = queue_depth
+        self.state = self.DRAINING
+        # Set once capture and audio have stopped; a new recording can start
+        # from then on while the queued frames drain and ffmpeg finishes
+        self.drained = threading.Event()
+        self.future = concurrent.futures.Future()
+        self.started = time.monotonic()
+        self.finished = None
+        self.file_size = None
+        # Final get_stats() snapshot of the recording
+        self.stats = None
+
+    def progress(self):
+        state = self.state
+        if state == self.ENCODING and self.encoder.muxing:
+            state = self.MUXING
+        if state == self.DONE:
+            percent = 100.0
+        elif state == self.MUXING:
+            percent = None
+        else:
+            percent = self.encoder.finalize_percent()
+        return {
+            "state": state,
+            "frames_queued": (self._queue_depth() or 0) if state == self.DRAINING else 0,
+            "percent": percent,
+            "file_size": self.file_size if self.file_size is not None else self._current_size(),
+            "elapsed": (self.finished or time.monotonic()) - self.started,
+        }
+
+    def _current_size(self):
+        return self.encoder.output_size()
+
+    def done(self):
+        return self.future.done()
+
+    def wait(self, timeout=None):
+        concurrent.futures.wait([self.future], timeout)
+        return self.future.done()
+
+    def result(self, timeout=None):
+        # The output filename, or the error that stopped finalization
+        return self.future.result(timeout)
+
+    def add_done_callback(self, callback):
+        self.future.add_done_callback(lambda _: callback(self))
+
+    def _finish(self, error=None):
+        self.finished = time.monotonic()
+        if error is None:
+            self.state = self.DONE
+            self.future.set_result(self.output_filename)
+        else:
+            self.state = self.FAILED
+            self.future.set_exception(error)
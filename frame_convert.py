@@ -0,0 +1,115 @@
+import concurrent.futures
+import os
+import threading
+import numpy as np
+
+_BYTE_HIGH_BITS = np.uint32(0xFEFEFEFE)
+
+def _average_packed(a, b):
+    # Per-byte floor((a + b) / 2) of packed BGRA pixels without unpacking channels
+    result = a & b
+    diff = a ^ b
+    diff &= _BYTE_HIGH_BITS
+    diff >>= 1
+    result += diff
+    return result
+
+def downscale_half(frame):
+    # 2x2 area average of a BGRA frame, done on packed uint32 pixels so it costs
+    # two vectorized passes instead of four per-channel ones. Odd edges are cropped.
+    height, width = frame.shape[0] // 2 * 2, frame.shape[1] // 2 * 2
+    pixels = np.ascontiguousarray(frame[:height, :width]).view(np.uint32).reshape(height, width)
+    rows = _average_packed(pixels[0::2], pixels[1::2])
+    out = _average_packed(rows[:, 0::2], rows[:, 1::2])
+    return out.view(np.uint8).reshape(height // 2, width // 2, 4)
+
+# BGRA to planar YUV 4:2:0 (I420) with the BT.601 limited-range integer
+# coefficients ffmpeg's own conversion uses; chroma is the average of each 2x2
+# block. Rows are split into bands run on a thread pool (numpy releases the GIL),
+# each band working in its thread's scratch buffers, and the result goes into one
+# preallocated output buffer that is reused for every frame. Odd edges are cropped.
+class YUV420Converter:
+    def __init__(self, width, height, threads=None, min_band_rows=16):
+        self.width, self.height = width // 2 * 2, height // 2 * 2
+        w, h = self.width, self.height
+        self.out = np.empty(w * h * 3 // 2, dtype=np.uint8)
+        self.y = self.out[:w * h].reshape(h, w)
+        self.u = self.out[w * h:w * h * 5 // 4].reshape(h // 2, w // 2)
+        self.v = self.out[w * h * 5 // 4:].reshape(h // 2, w // 2)
+
+        threads = threads or os.cpu_count() or 1
+        # A few bands per thread so an unlucky one doesn't hold up the frame
+        band_rows = max(min_band_rows, -(-h // (threads * 4)))
+        band_rows += band_rows % 2
+        self.band_rows = band_rows
+        self.bands = [(r, min(r + band_rows, h)) for r in range(0, h, band_rows)]
+        self.pool = None
+        if threads > 1 and len(self.bands) > 1:
+            self.pool = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix="yuv")
+        self.scratch = threading.local()
+        self.source = None
+
+    def _buffers(self):
+        buffers = getattr(self.scratch, "buffers", None)
+        if buffers is None:
+            rows, cols = self.band_rows, self.width
+            buffers = (
+                np.empty((rows, cols), dtype=np.uint16),
+                np.empty((rows, cols), dtype=np.uint16),
+                [np.empty((rows // 2, cols // 2), dtype=np.uint16) for _ in range(3)],
+                np.empty((rows // 2, cols // 2), dtype=np.int32),
+                np.empty((rows // 2, cols // 2), dtype=np.int32),
+            )
+            self.scratch.buffers = buffers
+        return buffers
+
+    def _convert_band(self, bounds):
+        r0, r1 = bounds
+        n, c0, c1 = r1 - r0, r0 // 2, r1 // 2
+        src = self.source[r0:r1, :self.width]
+        acc, tmp, sums, chroma, term = self._buffers()
+        acc, tmp = acc[:n], tmp[:n]
+        b, g, r = src[:, :, 0], src[:, :, 1], src[:, :, 2]
+
+        # Y = ((66 R + 129 G + 25 B + 128) >> 8) + 16, all of it fits in 16 bits
+        np.multiply(r, 66, out=acc, dtype=np.uint16)
+        np.multiply(g, 129, out=tmp, dtype=np.uint16)
+        acc += tmp
+        np.multiply(b, 25, out=tmp, dtype=np.uint16)
+        acc += tmp
+        acc += 128 + (16 << 8)
+        acc >>= 8
+        np.copyto(self.y[r0:r1], acc, casting="unsafe")
+
+        # 2x2 sums per channel, then the chroma rows with the / 4 folded into the shift
+        bs, gs, rs = (buffer[:n // 2] for buffer in sums)
+        for channel, total in ((b, bs), (g, gs), (r, rs)):
+            np.add(channel[0::2, 0::2], channel[0::2, 1::2], out=total, dtype=np.uint16)
+            total += channel[1::2, 0::2]
+            total += channel[1::2, 1::2]
+        chroma, term = chroma[:n // 2], term[:n // 2]
+        for plane, (kr, kg, kb) in ((self.u, (-38, -74, 112)), (self.v, (112, -94, -18))):
+            np.multiply(rs, kr, out=chroma, dtype=np.int32)
+            np.multiply(gs, kg, out=term, dtype=np.int32)
+            chroma += term
+            np.multiply(bs, kb, out=term, dtype=np.int32)
+            chroma += term
+            chroma += 512 + (128 << 10)
+            chroma >>= 10
+            np.copyto(plane[c0:c1], chroma, casting="unsafe")
+
+    def convert(self, frame):
+        # Returns the I420 buffer, valid until the next call
+        self.source = frame
+        if self.pool:
+            list(self.pool.map(self._convert_band, self.bands))
+        else:
+            for bounds in self.bands:
+                self._convert_band(bounds)
+        self.source = None
+        return self.out
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(wait=False)
+            self.pool = None
@@ -0,0 +1,124 @@
+import queue
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+# What the capture stage does when the frame queue is full
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+# Preallocated frame slots in shared memory, passed between the capture processes
+# and the writer by slot index. Each track (monitor) has its own slots and free
+# list; all of them share one ready queue of small (track, slot, timestamp, tiles)
+# tuples, which are the only thing pickled.
+class SharedFrameRing:
+    def __init__(self, ctx, slots, shapes):
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.slot_sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.offsets = []
+        total = 0
+        for slot_size in self.slot_sizes:
+            self.offsets.append(total)
+            total += slot_size * slots
+        self.shm = shared_memory.SharedMemory(create=True, size=total)
+        self.free = [ctx.Queue() for _ in self.shapes]
+        self.ready = ctx.Queue()
+        for free in self.free:
+            for slot in range(slots):
+                free.put(slot)
+        # Writer side: one end marker is expected per track
+        self.finished = 0
+        self.current_slot = None
+
+    def view(self, track, slot):
+        return np.ndarray(
+            self.shapes[track], dtype=np.uint8, buffer=self.shm.buf,
+            offset=self.offsets[track] + slot * self.slot_sizes[track]
+        )
+
+    def acquire(self, track, drop_policy, stop_event, stats):
+        # Find a free slot for the capture side, applying the drop policy when
+        # the writer still holds every slot
+        free = self.free[track]
+        try:
+            return free.get_nowait()
+        except queue.Empty:
+            pass
+
+        if drop_policy == DROP_NEWEST:
+            stats.add("queue_newest")
+            return None
+
+        if drop_policy == DROP_OLDEST:
+            # The oldest frame may belong to another monitor; its slot then goes
+            # back to that monitor and we look at our own free list again
+            while True:
+                try:
+                    item = self.ready.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Another process's end marker must reach the writer
+                    self.ready.put(None)
+                    break
+                stolen_track, slot, _, _ = item
+                stats.add("queue_oldest")
+                if stolen_track == track:
+                    return slot
+                self.free[stolen_track].put(slot)
+                try:
+                    return free.get_nowait()
+                except queue.Empty:
+                    pass
+
+        start = time.monotonic()
+        try:
+            while not stop_event.is_set():
+                try:
+                    return free.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        finally:
+            stats.add("queue_block_time", time.monotonic() - start)
+        # Stopped while every slot stayed taken: the frame never got in
+        stats.add("queue_newest")
+        return None
+
+    def put(self, slot, frame, capture_time, changed_tiles, track):
+        # The one copy in this mode: from the mss buffer into the shared slot
+        np.copyto(self.view(track, slot), frame.reshape(self.shapes[track]))
+        self.ready.put((track, slot, capture_time, changed_tiles))
+
+    def get(self, is_alive):
+        # Writer side. Returns (frame view, capture time, changed tiles, track) or
+        # None once every capture process has finished or died.
+        while True:
+            try:
+                item = self.ready.get(timeout=0.5)
+            except queue.Empty:
+                if not is_alive():
+                    return None
+                continue
+            if item is not None:
+                break
+            self.finished += 1
+            if self.finished >= len(self.shapes):
+                return None
+        track, slot, capture_time, changed_tiles = item
+        self.current_slot = (track, slot)
+        return (self.view(track, slot), capture_time, changed_tiles, track)
+
+    def release(self):
+        if self.current_slot is not None:
+            track, slot = self.current_slot
+            self.free[track].put(slot)
+            self.current_slot = None
+
+    def close(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
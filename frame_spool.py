@@ -0,0 +1,172 @@
+import mmap
+import os
+import tempfile
+import threading
+import numpy as np
+
+# Capture now, encode later: raw frames go into a preallocated, memory-mapped
+# ring file on disk, and the writer drains it at its own pace. The file is a byte
+# ring of whole frames (a frame never wraps around the end); a small index ring
+# of (offset, track, capture time) records says where each one is. Frames are
+# handed out as views straight into the mapping and their space is reused only
+# once the consumer releases them, so either side can stall and pick up where it
+# left off.
+class FrameSpool:
+    INDEX_DTYPE = np.dtype([("offset", np.int64), ("track", np.int32), ("capture_time", np.float64)])
+
+    def __init__(self, shapes, max_bytes, directory=None, defer=False, high_water=0.9):
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.frame_sizes = [int(np.prod(shape)) for shape in self.shapes]
+        if max_bytes < max(self.frame_sizes):
+            raise ValueError("Spool is smaller than one frame")
+        self.capacity = int(max_bytes)
+        # Deferred: nothing is handed out until the input ends, or the spool is
+        # high_water full and has to make room
+        self.defer = defer
+        self.high_water = high_water
+
+        fd, self.path = tempfile.mkstemp(prefix="screenrec_spool_", suffix=".raw", dir=directory)
+        self.file = os.fdopen(fd, "r+b")
+        try:
+            # Reserve the disk space up front so a full disk shows up now
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, self.capacity)
+            else:
+                self.file.truncate(self.capacity)
+            self.map = mmap.mmap(fd, self.capacity)
+        except Exception:
+            self.file.close()
+            os.remove(self.path)
+            raise
+
+        self.index = np.zeros(self.capacity // min(self.frame_sizes) + 1, dtype=self.INDEX_DTYPE)
+        self.first = 0       # oldest record in the index ring
+        self.count = 0       # records spooled and not yet released
+        self.head = 0        # where the next frame is written
+        self.tail = 0        # start of the oldest frame still in use
+        self.used = 0
+        self.reading = False
+        self.input_done = False
+        self.draining = not defer
+        self.cond = threading.Condition()
+
+        self.frames_spooled = 0
+        self.frames_full = 0
+        self.peak_used = 0
+
+    def _fit(self, size):
+        # Offset to write a frame of size bytes at, or None when there's no room
+        if self.count == 0:
+            return 0 if size <= self.capacity else None
+        if self.head > self.tail:
+            # Data in [tail, head): room after head, else wrap to the start
+            if self.head + size <= self.capacity:
+                return self.head
+            return 0 if size <= self.tail else None
+        # Wrapped: data in [tail, end) and [0, head)
+        return self.head if self.head + size <= self.tail else None
+
+    def put(self, frame, capture_time, track, block=False):
+        # Copies the frame in. Returns False if it was full, unless block is set:
+        # then it waits for the consumer to make room.
+        size = self.frame_sizes[track]
+        with self.cond:
+            offset = self._fit(size)
+            while offset is None and block:
+                self.cond.wait()
+                offset = self._fit(size)
+            if offset is None:
+                self.frames_full += 1
+                return False
+            if self.count == len(self.index):
+                self.frames_full += 1
+                return False
+
+        # Only this thread writes, and nothing reads [offset, offset + size)
+        # until the record is published below
+        view = np.frombuffer(self.map, dtype=np.uint8, count=size, offset=offset)
+        np.copyto(view, frame.reshape(-1))
+        del view
+
+        with self.cond:
+            slot = (self.first + self.count) % len(self.index)
+            self.index[slot] = (offset, track, capture_time)
+            if self.count == 0:
+                self.tail = offset
+            self.count += 1
+            self.head = offset + size
+            self.used += size
+            self.peak_used = max(self.peak_used, self.used)
+            self.frames_spooled += 1
+            if not self.draining and self.used >= self.high_water * self.capacity:
+                print("Spool nearly full, encoding now")
+                self.draining = True
+            self.cond.notify_all()
+        return True
+
+    def close_input(self):
+        with self.cond:
+            self.input_done = True
+            self.draining = True
+            self.cond.notify_all()
+
+    def get(self):
+        # Oldest frame as (view, capture time, None, track), or None once the
+        # input is closed and everything was handed out. The view stays valid
+        # until release().
+        with self.cond:
+            if self.reading:
+                raise RuntimeError("release() the previous frame first")
+            while not (self.draining and self.count) and not (self.input_done and not self.count):
+                self.cond.wait()
+            if self.count == 0:
+                return None
+            record = self.index[self.first]
+            self.reading = True
+        offset, track, capture_time = int(record["offset"]), int(record["track"]), float(record["capture_time"])
+        view = np.ndarray(self.shapes[track], dtype=np.uint8, buffer=self.map, offset=offset)
+        return (view, capture_time, None, track)
+
+    def release(self):
+        with self.cond:
+            if not self.reading:
+                return
+            record = self.index[self.first]
+            size = self.frame_sizes[int(record["track"])]
+            self.first = (self.first + 1) % len(self.index)
+            self.count -= 1
+            self.used -= size
+            self.reading = False
+            if self.count == 0:
+                self.head = self.tail = 0
+            else:
+                self.tail = int(self.index[self.first]["offset"])
+            self.cond.notify_all()
+
+    def depth(self):
+        return self.count
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "capacity_bytes": self.capacity,
+            "used_bytes": self.used,
+            "peak_bytes": self.peak_used,
+            "frames": self.count,
+            "frames_spooled": self.frames_spooled,
+            "frames_full": self.frames_full,
+            "deferred": self.defer,
+            "draining": self.draining,
+        }
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            # A view is still alive somewhere; the mapping goes with it
+            pass
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
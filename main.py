@@ -1,9 +1,12 @@
+import time
+
+# Taken before the heavy imports, for the launch to first frame time
+LAUNCH_TIME = time.monotonic()
+
 import customtkinter as ctk
 import threading
-import time
 import os
 
-from screeninfo import get_monitors
 from recorder import ScreenRecorder
 
 ctk.set_appearance_mode("Dark")
@@ -15,14 +18,25 @@ class ScreenRecorderApp(ctk.CTk):
 
 
         self.title("Pro Screen Recorder")
-        self.geometry("400x550")
+        self.geometry("420x810")
         self.resizable(True, True)
 
         self.recorder = ScreenRecorder()
         self.is_recording = False
         self.start_time = 0
+        # Latest snapshot pushed by the recorder's stats thread; the UI only reads it
+        self.latest_stats = None
+        self.recorder.add_stats_listener(self._on_stats)
+        # Milliseconds from launch to the first captured frame, measured for the
+        # first recording after launch
+        self.launch_ms = None
+        # Set from the device watcher thread; the menus are rebuilt on the UI thread
+        self.devices_changed = False
+        self.recorder.devices.add_listener(self._on_devices_changed)
 
         self._setup_ui()
+        self.recorder.devices.start_watching()
+        self.after(2000, self._poll_devices)
 
     def _setup_ui(self):
         # Title
@@ -42,6 +56,15 @@ class ScreenRecorderApp(ctk.CTk):
         )
         self.status_label.pack(pady=5)
 
+        # Progress of recordings still being finalized in the background
+        self.finalize_label = ctk.CTkLabel(
+            self,
+            text="",
+            text_color="gray",
+            font=("Roboto", 11)
+        )
+        self.finalize_label.pack(pady=0)
+
         # Timer
         self.timer_label = ctk.CTkLabel(
             self, 
@@ -50,6 +73,16 @@ class ScreenRecorderApp(ctk.CTk):
         )
         self.timer_label.pack(pady=10)
 
+        # Live pipeline stats
+        self.stats_label = ctk.CTkLabel(
+            self,
+            text="",
+            font=("Roboto Mono", 11),
+            text_color="gray",
+            justify="left"
+        )
+        self.stats_label.pack(pady=(0, 5))
+
         # Settings Frame
         self.settings_frame = ctk.CTkFrame(self)
         self.settings_frame.pack(pady=20, padx=20, fill="x")
@@ -82,32 +115,7 @@ class ScreenRecorderApp(ctk.CTk):
         self.browse_button.grid(row=0, column=3, padx=(0, 10), pady=10)
 
         # Monitor Selection
-
-        # Monitor Selection
-        self.monitors = self.recorder.get_monitors()
-        self.monitor_values = []
-        
-        # Get real monitor names using screeninfo
-        try:
-            real_monitors = get_monitors()
-        except:
-            real_monitors = []
-
-        for i, m in enumerate(self.monitors):
-            if i == 0:
-                name = "All Monitors"
-            else:
-                # Try to find matching real monitor
-                # mss index 1 matches real_monitors[0] usually
-                name = f"Monitor {i}"
-                if i <= len(real_monitors):
-                     # Simple mapping attempt
-                     try:
-                         name = real_monitors[i-1].name.replace("\\.\\", "")
-                     except:
-                         pass
-            
-            self.monitor_values.append(f"{name} ({m['width']}x{m['height']})")
+        self._load_monitors()
 
         self.monitor_label = ctk.CTkLabel(self.settings_frame, text="Screen:")
         self.monitor_label.grid(row=1, column=0, padx=10, pady=10)
@@ -124,6 +132,23 @@ class ScreenRecorderApp(ctk.CTk):
             
         self.monitor_option.grid(row=1, column=1, padx=10, pady=10, columnspan=2, sticky="ew")
 
+        # Region and output scale
+        self.region_label = ctk.CTkLabel(self.settings_frame, text="Region:")
+        self.region_label.grid(row=2, column=0, padx=10, pady=10)
+
+        self.region_entry = ctk.CTkEntry(
+            self.settings_frame,
+            placeholder_text="x, y, w, h (full screen)"
+        )
+        self.region_entry.grid(row=2, column=1, padx=10, pady=10, sticky="ew")
+
+        self.scale_option = ctk.CTkOptionMenu(
+            self.settings_frame,
+            values=["100%", "75%", "50%", "25%"]
+        )
+        self.scale_option.set("100%")
+        self.scale_option.grid(row=2, column=2, padx=(10, 5), pady=10, sticky="ew")
+
         # Cursor Checkbox
         self.cursor_var = ctk.BooleanVar(value=False)
         self.cursor_checkbox = ctk.CTkCheckBox(
@@ -131,26 +156,54 @@ class ScreenRecorderApp(ctk.CTk):
             text="Record Cursor",
             variable=self.cursor_var
         )
-        self.cursor_checkbox.grid(row=2, column=1, padx=10, pady=10, sticky="w")
+        self.cursor_checkbox.grid(row=3, column=1, padx=10, pady=10, sticky="w")
+
+        # Lower the capture rate while the encoder can't keep up
+        self.adaptive_var = ctk.BooleanVar(value=False)
+        self.adaptive_checkbox = ctk.CTkCheckBox(
+            self.settings_frame,
+            text="Adaptive FPS",
+            variable=self.adaptive_var
+        )
+        self.adaptive_checkbox.grid(row=3, column=2, padx=10, pady=10, sticky="w")
 
         # Audio Selection
-        self.audio_devices = self.recorder.get_audio_devices()
-        self.audio_values = ["No Audio"]
-        for dev in self.audio_devices:
-            name = dev['name']
-            if dev['is_loopback']:
-                name += " (Loopback)"
-            self.audio_values.append(name)
+        self._load_audio_devices()
 
         self.audio_label = ctk.CTkLabel(self.settings_frame, text="Audio:")
-        self.audio_label.grid(row=3, column=0, padx=10, pady=10)
+        self.audio_label.grid(row=4, column=0, padx=10, pady=10)
 
         self.audio_option = ctk.CTkOptionMenu(
             self.settings_frame,
-            values=self.audio_values
+            values=self.audio_values,
+            command=self._prewarm_audio
         )
         self.audio_option.set("No Audio")
-        self.audio_option.grid(row=3, column=1, padx=10, pady=10, columnspan=2, sticky="ew")
+        self.audio_option.grid(row=4, column=1, padx=10, pady=10, columnspan=2, sticky="ew")
+
+        # Optional second device mixed in, e.g. microphone over system audio
+        self.audio2_label = ctk.CTkLabel(self.settings_frame, text="Mix with:")
+        self.audio2_label.grid(row=5, column=0, padx=10, pady=10)
+
+        self.audio2_option = ctk.CTkOptionMenu(
+            self.settings_frame,
+            values=["None"] + self.audio_values[1:],
+            command=self._prewarm_audio
+        )
+        self.audio2_option.set("None")
+        self.audio2_option.grid(row=5, column=1, padx=10, pady=10, columnspan=2, sticky="ew")
+
+        # How the file is written; the last two survive a crash
+        self.output_modes = {"MP4": "mp4", "Fragmented MP4": "fragmented", "Segments": "segments"}
+        self.output_label = ctk.CTkLabel(self.settings_frame, text="Output:")
+        self.output_label.grid(row=6, column=0, padx=10, pady=10)
+
+        self.output_option = ctk.CTkOptionMenu(
+            self.settings_frame,
+            values=list(self.output_modes)
+        )
+        self.output_option.set("MP4")
+        self.output_option.grid(row=6, column=1, padx=10, pady=10, columnspan=2, sticky="ew")
 
         # Buttons
         self.button_frame = ctk.CTkFrame(self, fg_color="transparent")
@@ -210,32 +263,40 @@ class ScreenRecorderApp(ctk.CTk):
         monitor_index = self.monitor_values.index(selected_str)
         record_cursor = self.cursor_var.get()
 
-        # Find selected audio device
-        audio_str = self.audio_option.get()
-        audio_device_id = None
-        if audio_str != "No Audio":
-            # Remove " (Loopback)" suffix if present for matching
-            clean_name = audio_str.replace(" (Loopback)", "")
-            for dev in self.audio_devices:
-                # We match by name and loopback status if possible, or just ID
-                # Construct the display name again to match exactly
-                dev_display_name = dev['name']
-                if dev['is_loopback']:
-                    dev_display_name += " (Loopback)"
-                
-                if dev_display_name == audio_str:
-                    audio_device_id = dev['id']
-                    break
-
-        self.recorder.start_recording(
-            filename=filename, 
-            fps=fps, 
-            monitor_index=monitor_index, 
-            record_cursor=record_cursor,
-            audio_device_id=audio_device_id
-        )
+        # Region is optional; blank records the whole screen
+        region = None
+        region_str = self.region_entry.get().strip()
+        if region_str:
+            try:
+                region = tuple(int(v) for v in region_str.replace(" ", "").split(","))
+                if len(region) != 4:
+                    raise ValueError
+            except ValueError:
+                self.status_label.configure(text="Region must be x, y, w, h", text_color="#FF4B4B")
+                return
+        output_scale = int(self.scale_option.get().rstrip("%")) / 100
+
+        audio_device_id = self._selected_audio_ids()
+
+        try:
+            self.recorder.start_recording(
+                filename=filename, 
+                fps=fps, 
+                monitor_index=monitor_index, 
+                record_cursor=record_cursor,
+                audio_device_id=audio_device_id,
+                region=region,
+                output_scale=output_scale,
+                adaptive_quality=self.adaptive_var.get(),
+                output_mode=self.output_modes[self.output_option.get()]
+            )
+        except ValueError as e:
+            self.status_label.configure(text=str(e), text_color="#FF4B4B")
+            return
         self.is_recording = True
         self.start_time = time.time()
+        self.latest_stats = None
+        self.stats_label.configure(text="")
         
         self.status_label.configure(text="Recording...", text_color="#FF4B4B")
         self.start_button.configure(state="disabled")
@@ -245,17 +306,25 @@ class ScreenRecorderApp(ctk.CTk):
 
         self.filename_entry.configure(state="disabled")
         self.monitor_option.configure(state="disabled")
+        self.region_entry.configure(state="disabled")
+        self.scale_option.configure(state="disabled")
         self.browse_button.configure(state="disabled")
         self.cursor_checkbox.configure(state="disabled")
+        self.adaptive_checkbox.configure(state="disabled")
         self.audio_option.configure(state="disabled")
+        self.audio2_option.configure(state="disabled")
+        self.output_option.configure(state="disabled")
 
         self._update_timer()
 
     def stop_recording(self):
-        self.recorder.stop_recording()
+        # Finalizing runs in the background so the window stays responsive and
+        # a new recording can be started right away
+        job = self.recorder.stop_recording_async()
         self.is_recording = False
         
-        self.status_label.configure(text="Saved to " + self.recorder.output_filename, text_color="#2CC985")
+        self.status_label.configure(text="Finalizing...", text_color="gray")
+        self._track_finalize(job)
         self.start_button.configure(state="normal")
         self.stop_button.configure(state="disabled")
         self.fps_option.configure(state="normal")
@@ -263,9 +332,103 @@ class ScreenRecorderApp(ctk.CTk):
 
         self.filename_entry.configure(state="normal")
         self.monitor_option.configure(state="normal")
+        self.region_entry.configure(state="normal")
+        self.scale_option.configure(state="normal")
         self.browse_button.configure(state="normal")
         self.cursor_checkbox.configure(state="normal")
+        self.adaptive_checkbox.configure(state="normal")
         self.audio_option.configure(state="normal")
+        self.audio2_option.configure(state="normal")
+        self.output_option.configure(state="normal")
+        # Ready for the next recording with the same devices
+        self._prewarm_audio()
+
+    def _load_monitors(self):
+        # Names and sizes from the recorder's device registry, which only asks
+        # the display again when something changed
+        self.monitors = self.recorder.get_monitors()
+        names = self.recorder.devices.monitor_names()
+        self.monitor_values = [
+            f"{name} ({m['width']}x{m['height']})" for name, m in zip(names, self.monitors)
+        ]
+
+    def _load_audio_devices(self):
+        self.audio_devices = self.recorder.get_audio_devices()
+        self.audio_values = ["No Audio"]
+        for dev in self.audio_devices:
+            name = dev['name']
+            if dev['is_loopback']:
+                name += " (Loopback)"
+            self.audio_values.append(name)
+
+    def _on_devices_changed(self, registry):
+        # Called from the registry's watcher thread
+        self.devices_changed = True
+
+    def _poll_devices(self):
+        if self.devices_changed and not self.is_recording:
+            self.devices_changed = False
+            self._load_monitors()
+            self._load_audio_devices()
+            self.monitor_option.configure(values=self.monitor_values)
+            if self.monitor_option.get() not in self.monitor_values:
+                self.monitor_option.set(self.monitor_values[min(1, len(self.monitor_values) - 1)])
+            self.audio_option.configure(values=self.audio_values)
+            self.audio2_option.configure(values=["None"] + self.audio_values[1:])
+            if self.audio_option.get() not in self.audio_values:
+                self.audio_option.set("No Audio")
+            if self.audio2_option.get() not in self.audio_values:
+                self.audio2_option.set("None")
+            self._prewarm_audio()
+        self.after(2000, self._poll_devices)
+
+    def _selected_audio_ids(self):
+        audio_ids = []
+        for audio_str in (self.audio_option.get(), self.audio2_option.get()):
+            device_id = self._find_audio_device(audio_str)
+            if device_id is not None and device_id not in audio_ids:
+                audio_ids.append(device_id)
+        return audio_ids or None
+
+    def _prewarm_audio(self, *_):
+        # Open the chosen devices now so Start doesn't wait for them
+        self.recorder.prewarm_audio(self._selected_audio_ids())
+
+    def _find_audio_device(self, audio_str):
+        for dev in self.audio_devices:
+            # Construct the display name again to match exactly
+            dev_display_name = dev['name']
+            if dev['is_loopback']:
+                dev_display_name += " (Loopback)"
+
+            if dev_display_name == audio_str:
+                return dev['id']
+        return None
+
+    def _track_finalize(self, job):
+        name = os.path.basename(job.output_filename)
+        progress = job.progress()
+        if not job.done():
+            if progress["state"] == "draining":
+                text = f"Finalizing {name}: {progress['frames_queued']} frames queued"
+            elif progress["percent"] is None:
+                text = f"Finalizing {name}: muxing audio"
+            else:
+                text = f"Finalizing {name}: {progress['percent']:.0f}%"
+            self.finalize_label.configure(text=text)
+            self.after(200, self._track_finalize, job)
+            return
+
+        if job.future.exception():
+            self.finalize_label.configure(text=f"Failed to save {name}")
+            if not self.is_recording:
+                self.status_label.configure(text="Recording failed", text_color="#FF4B4B")
+            return
+        size_mb = (progress["file_size"] or 0) / (1024 * 1024)
+        self.finalize_label.configure(text=f"{name}: {size_mb:.1f} MB")
+        if not self.is_recording:
+            self.status_label.configure(text="Saved to " + job.output_filename, text_color="#2CC985")
+            self._show_stats()
 
     def _update_timer(self):
         if self.is_recording:
@@ -274,8 +437,50 @@ class ScreenRecorderApp(ctk.CTk):
             m = (elapsed % 3600) // 60
             s = elapsed % 60
             self.timer_label.configure(text=f"{h:02}:{m:02}:{s:02}")
+            self._show_stats()
             self.after(1000, self._update_timer)
 
+    def _on_stats(self, snapshot):
+        # Called from the recorder's stats thread, so just keep the snapshot.
+        # Final numbers of an earlier recording can arrive after a new one started.
+        if snapshot["output"] != self.recorder.output_filename:
+            return
+        self.latest_stats = snapshot
+
+    def _show_stats(self):
+        stats = self.latest_stats
+        if not stats:
+            return
+        stages = stats["stages"]
+        elapsed = max(stats["elapsed"], 1e-6)
+        depth = stats["queue_depth"]
+        dropped = int(stats["late"] + stats["queue_oldest"] + stats["queue_newest"])
+        lines = [
+            f"capture {stats['captured'] / elapsed:5.1f} fps  unchanged {int(stats['unchanged'])}",
+            f"grab {stages['grab']['mean_ms']:5.1f} ms  convert {stages['convert']['mean_ms']:5.1f} ms",
+            f"queue {'?' if depth is None else depth}/{stats['queue_capacity']}  encode {stages['encode']['mean_ms']:5.1f} ms",
+            f"dropped {dropped}  duplicated {stats['encoder']['duplicated']}",
+        ]
+        if stats["audio"]["enabled"]:
+            audio = stats["audio"]
+            lines.append(f"audio sources {audio['sources']}  overruns {audio['overruns']}  "
+                         f"latency {audio['latency']['p95_ms']:.0f} ms")
+        if stats["quality"]["enabled"]:
+            quality = stats["quality"]
+            lines.append(f"adaptive {quality['effective_fps']:.0f} fps  changes {len(quality['log'])}")
+        startup = stats["startup"]
+        if startup["first_frame_ms"] is not None:
+            line = f"first frame {startup['first_frame_ms']:.0f} ms"
+            if startup["first_audio_ms"] is not None:
+                line += f"  audio {startup['first_audio_ms']:.0f} ms"
+            if self.launch_ms is None and self.recorder.first_capture_time:
+                self.launch_ms = (self.recorder.first_capture_time - LAUNCH_TIME) * 1000
+                print(f"Launch to first frame: {self.launch_ms:.0f} ms")
+            if self.launch_ms is not None:
+                line += f"  launch {self.launch_ms:.0f} ms"
+            lines.append(line)
+        self.stats_label.configure(text="\n".join(lines))
+
     def browse_file(self):
         filename = ctk.filedialog.asksaveasfilename(
             defaultextension=".mp4",
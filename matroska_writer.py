@@ -0,0 +1,78 @@
+import numpy as np
+
+def _ebml_size(n):
+    # Variable-length EBML size with the smallest width that fits
+    for length in range(1, 9):
+        if n < (1 << (7 * length)) - 1:
+            return ((1 << (7 * length)) | n).to_bytes(length, "big")
+    raise ValueError(f"EBML size too large: {n}")
+
+def _ebml_uint(n):
+    return n.to_bytes(max(1, (n.bit_length() + 7) // 8), "big")
+
+def _ebml(element_id, payload):
+    if isinstance(payload, int):
+        payload = _ebml_uint(payload)
+    elif isinstance(payload, str):
+        payload = payload.encode()
+    return element_id + _ebml_size(len(payload)) + payload
+
+# Minimal streaming Matroska writer for raw video. rawvideo on a pipe carries no
+# timestamps, so frames are wrapped one per cluster with their capture time in ms.
+# The frame bytes are written straight after the small block header, never copied.
+# Each (width, height) in sizes becomes its own video track.
+class MatroskaFrameWriter:
+    def __init__(self, stream, sizes, fourcc):
+        self.stream = stream
+        self.sizes = list(sizes)
+        self.fourcc = fourcc
+        self.last_timestamps = [-1] * len(self.sizes)
+
+    def write_header(self):
+        header = _ebml(b"\x1a\x45\xdf\xa3", b"".join([
+            _ebml(b"\x42\x86", 1),           # EBMLVersion
+            _ebml(b"\x42\xf7", 1),           # EBMLReadVersion
+            _ebml(b"\x42\xf2", 4),           # EBMLMaxIDLength
+            _ebml(b"\x42\xf3", 8),           # EBMLMaxSizeLength
+            _ebml(b"\x42\x82", "matroska"),  # DocType
+            _ebml(b"\x42\x87", 4),           # DocTypeVersion
+            _ebml(b"\x42\x85", 2),           # DocTypeReadVersion
+        ]))
+        info = _ebml(b"\x15\x49\xa9\x66", b"".join([
+            _ebml(b"\x2a\xd7\xb1", 1000000),  # TimestampScale: 1 ms
+            _ebml(b"\x4d\x80", "recorder.py"),  # MuxingApp
+            _ebml(b"\x57\x41", "recorder.py"),  # WritingApp
+        ]))
+        entries = []
+        for i, (width, height) in enumerate(self.sizes):
+            entries.append(_ebml(b"\xae", b"".join([
+                _ebml(b"\xd7", i + 1),              # TrackNumber
+                _ebml(b"\x73\xc5", i + 1),          # TrackUID
+                _ebml(b"\x83", 1),                  # TrackType: video
+                _ebml(b"\x86", "V_UNCOMPRESSED"),   # CodecID
+                _ebml(b"\xe0", b"".join([
+                    _ebml(b"\xb0", width),          # PixelWidth
+                    _ebml(b"\xba", height),         # PixelHeight
+                    _ebml(b"\x2e\xb5\x24", self.fourcc),  # ColourSpace
+                ])),
+            ])))
+        tracks = _ebml(b"\x16\x54\xae\x6b", b"".join(entries))
+        # Segment of unknown size, since we are streaming
+        segment = b"\x18\x53\x80\x67" + b"\x01\xff\xff\xff\xff\xff\xff\xff"
+        self.stream.write(header + segment + info + tracks)
+
+    def write_frame(self, frame, timestamp_ms, track=0):
+        # Timestamps must increase per track for the MP4 muxer
+        timestamp_ms = max(int(timestamp_ms), self.last_timestamps[track] + 1)
+        self.last_timestamps[track] = timestamp_ms
+
+        data = memoryview(np.ascontiguousarray(frame)).cast("B")
+        # SimpleBlock: track number, relative timestamp 0, keyframe flag
+        block_header = _ebml_size(track + 1) + b"\x00\x00\x80"
+        block_size = len(block_header) + len(data)
+        timestamp = _ebml(b"\xe7", timestamp_ms)
+        simple_block_head = b"\xa3" + _ebml_size(block_size) + block_header
+        cluster_size = len(timestamp) + len(simple_block_head) + len(data)
+
+        self.stream.write(b"\x1f\x43\xb6\x75" + _ebml_size(cluster_size) + timestamp + simple_block_head)
+        self.stream.write(data)
@@ -0,0 +1,89 @@
+# Adaptive capture rate. Samples the pipeline stats and, when the encoder falls
+# behind (backlog in the queue, rising capture-to-encoder latency, or frames
+# dropped), grabs only every n-th tick by raising the shared frame divisor. The
+# rate comes back one step at a time once the pipeline has been healthy for
+# raise_after seconds; that wait doubles each time a raise had to be undone, so a
+# machine on the edge settles instead of oscillating. Output size and x264 preset
+# stay fixed: the encoder can't change them without restarting mid-file.
+class QualityController:
+    DIVISORS = (1, 2, 3, 4)
+
+    def __init__(self, fps, frame_divisor, sample_interval=0.5, lower_cooldown=1.0,
+                 raise_after=3.0, max_raise_after=30.0):
+        self.fps = fps
+        self.frame_divisor = frame_divisor
+        self.sample_interval = sample_interval
+        self.lower_cooldown = lower_cooldown
+        self.raise_after = raise_after
+        self.max_raise_after = max_raise_after
+        # Capture to encoder latency above this counts as falling behind
+        self.latency_limit_ms = max(50.0, 3000.0 / fps)
+        self.level = 0
+        self.last_change = None
+        self.last_direction = 0
+        self.healthy_since = None
+        self.previous = None
+        # (seconds into the recording, effective fps, reason) per adjustment
+        self.log = []
+
+    @property
+    def effective_fps(self):
+        return self.fps / self.DIVISORS[self.level]
+
+    def update(self, snapshot, now):
+        # now is seconds into the recording. Returns the reason for an
+        # adjustment, or None if the level stays
+        previous, self.previous = self.previous, snapshot
+        if previous is None:
+            self.healthy_since = now
+            return None
+
+        latency = snapshot["stages"]["latency"]
+        last_latency = previous["stages"]["latency"]
+        frames = latency["count"] - last_latency["count"]
+        window_latency = 0.0
+        if frames > 0:
+            window_latency = (latency["count"] * latency["mean_ms"] -
+                              last_latency["count"] * last_latency["mean_ms"]) / frames
+        dropped = sum(snapshot[name] - previous[name] for name in ("late", "queue_oldest", "queue_newest"))
+        blocked = snapshot["queue_block_time"] - previous["queue_block_time"]
+        depth = snapshot["queue_depth"] or 0
+        fill = depth / max(1, snapshot["queue_capacity"])
+
+        reason = None
+        if fill >= 0.5:
+            reason = f"queue {depth}/{snapshot['queue_capacity']}"
+        elif window_latency > self.latency_limit_ms:
+            reason = f"latency {window_latency:.0f} ms"
+        elif dropped > 0:
+            reason = f"{int(dropped)} frames dropped"
+        elif blocked > 0.05:
+            reason = f"capture blocked {blocked * 1000:.0f} ms"
+
+        if reason:
+            self.healthy_since = None
+            if self.level + 1 < len(self.DIVISORS) and (
+                    self.last_change is None or now - self.last_change >= self.lower_cooldown):
+                if self.last_direction > 0:
+                    self.raise_after = min(self.max_raise_after, self.raise_after * 2)
+                return self._set_level(self.level + 1, now, "lower: " + reason)
+            return None
+
+        healthy = fill <= 0.25 and window_latency <= self.latency_limit_ms / 2
+        if not healthy:
+            self.healthy_since = None
+            return None
+        if self.healthy_since is None:
+            self.healthy_since = now
+        if self.level > 0 and now - self.healthy_since >= self.raise_after:
+            self.healthy_since = now
+            return self._set_level(self.level - 1, now, f"raise: healthy for {self.raise_after:.0f} s")
+        return None
+
+    def _set_level(self, level, now, reason):
+        self.last_direction = 1 if level < self.level else -1
+        self.level = level
+        self.last_change = now
+        self.frame_divisor.value = self.DIVISORS[level]
+        self.log.append((round(now, 2), round(self.effective_fps, 2), reason))
+        return reason
@@ -1,276 +1,1924 @@
-import mss
 import numpy as np
-import imageio
-import imageio_ffmpeg
 import threading
 import time
 import platform
-import ctypes
 import queue
-import soundcard as sc
+import ctypes
+import multiprocessing
 import wave
 import os
 import subprocess
-from PIL import Image, ImageDraw
-from screeninfo import get_monitors
+import tempfile
+import shutil
+import errno
+import glob
+import math
+from collections import deque
+from cursor import CursorOverlay
+from audio_mixer import AudioMixer, AudioSource
+from devices import DeviceRegistry, default_screen_source
+from frame_spool import FrameSpool
+from frame_ring import BLOCK, DROP_NEWEST, DROP_OLDEST, DROP_POLICIES, SharedFrameRing
+from frame_convert import YUV420Converter, downscale_half
+from matroska_writer import MatroskaFrameWriter
+from quality_controller import QualityController
+from finalize_job import FinalizeJob
+
+# Frame rate modes for the encoded video. Both send every captured frame to ffmpeg
+# once with its capture timestamp; "cfr" lets ffmpeg repeat frames to a constant rate,
+# "vfr" keeps the real capture times in the output.
+CFR = "cfr"
+VFR = "vfr"
+
+# How "All Monitors" (monitor_index 0) is recorded when there are several screens.
+# The first two capture each monitor in its own worker, in parallel.
+COMPOSITE = "composite"        # one video with the monitors packed next to each other
+STREAMS = "streams"            # one video track per monitor in the same file
+BOUNDING_BOX = "bounding_box"  # a single grab of the whole virtual screen
+MONITOR_LAYOUTS = (COMPOSITE, STREAMS, BOUNDING_BOX)
+
+# With several audio devices: mixed into one track, or one track per device
+AUDIO_MIX = "mix"
+AUDIO_SEPARATE = "separate"
+AUDIO_LAYOUTS = (AUDIO_MIX, AUDIO_SEPARATE)
+
+# ffmpeg arguments for each audio codec; both encode while recording
+AUDIO_CODECS = {
+    "aac": ["-c:a", "aac", "-b:a", "128k"],
+    "opus": ["-c:a", "libopus", "-b:a", "96k"],
+}
+
+# libx264 settings used unless start_recording gets others, or "auto" to use the
+# probed profile for this machine (see encoder_tuning.py). threads 0 lets x264
+# pick, tune None leaves it unset.
+DEFAULT_ENCODER_SETTINGS = {"preset": "ultrafast", "crf": 23, "threads": 0, "tune": None}
+AUTO_TUNE = "auto"
+# libx264's presets, fastest first
+X264_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium",
+                "slow", "slower", "veryslow", "placebo")
+
+# How the output is written. A plain MP4 only becomes playable when ffmpeg writes
+# its index at stop. "fragmented" writes self-contained fragments as it goes, and
+# "segments" starts a new file every segment_duration seconds, listed in an
+# ffconcat manifest; either way a crash loses at most the last fragment, and
+# stopping never rewrites the file.
+OUTPUT_MP4 = "mp4"
+OUTPUT_FRAGMENTED = "fragmented"
+OUTPUT_SEGMENTS = "segments"
+OUTPUT_MODES = (OUTPUT_MP4, OUTPUT_FRAGMENTED, OUTPUT_SEGMENTS)
+# Fragment length in seconds: the most a crash can lose
+FRAGMENT_SECONDS = 2.0
+FRAGMENT_MOVFLAGS = "+frag_keyframe+empty_moov+default_base_moof"
+
+# Optional disk spool between capture and encoder (see frame_spool.py). "live"
+# encodes from the spool as fast as the encoder can, so bursts the encoder can't
+# keep up with go to disk instead of being dropped. "deferred" only captures
+# while recording and encodes everything after stop, with slower, better
+# settings; audio then goes to WAVs that are muxed in at the end.
+SPOOL_LIVE = "live"
+SPOOL_DEFERRED = "deferred"
+SPOOL_MODES = (SPOOL_LIVE, SPOOL_DEFERRED)
+DEFERRED_ENCODER_SETTINGS = {"preset": "medium", "crf": 20}
+
+# What crosses the pipe to ffmpeg, as the Matroska fourcc: BGRA as captured,
+# converted by ffmpeg, or planar YUV 4:2:0 converted by YUV420Converter in the
+# writer, 1.5 instead of 4 bytes per pixel
+PIXEL_FORMATS = {"bgra": "BGRA", "yuv420p": "I420"}
+
+def ffmpeg_exe():
+    # imageio_ffmpeg takes a while to import and is only needed once ffmpeg runs
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+# Finds which tiles of a BGRA frame changed since the previous frame. Rows are
+# compared as packed 64-bit words (two pixels each) and reduced per tile, so static
+# content costs one vectorized pass and no encoder work. The previous frame is only
+# referenced, never copied, since mss allocates a new buffer for every grab.
+class ChangeDetector:
+    def __init__(self, tile_size=64):
+        self.tile_size = tile_size
+        self.prev = None
+
+    def reset(self):
+        self.prev = None
+
+    def changed_tiles(self, frame):
+        # Returns a (rows, cols) bool map of changed tiles; everything counts as
+        # changed for the first frame or after a size change
+        height, width = frame.shape[:2]
+        row_bytes = frame.reshape(height, -1)
+        if row_bytes.shape[1] % 8 == 0:
+            words, pixels_per_word = row_bytes.view(np.uint64), 2
+        else:
+            words, pixels_per_word = row_bytes.view(np.uint32), 1
+
+        prev = self.prev
+        self.prev = words
+        rows = -(-height // self.tile_size)
+        cols = -(-width // self.tile_size)
+        if prev is None or prev.shape != words.shape or prev.dtype != words.dtype:
+            return np.ones((rows, cols), dtype=bool)
+
+        diff = words != prev
+        # Collapse each band of tile rows first, which keeps the big pass contiguous;
+        # a partial band at the bottom edge is reduced on its own
+        full_rows = height // self.tile_size
+        bands = diff[:full_rows * self.tile_size].reshape(full_rows, self.tile_size, -1).any(axis=1)
+        if full_rows < rows:
+            bands = np.vstack([bands, diff[full_rows * self.tile_size:].any(axis=0)])
+
+        tile_words = self.tile_size // pixels_per_word
+        pad_cols = cols * tile_words - bands.shape[1]
+        if pad_cols:
+            bands = np.pad(bands, ((0, 0), (0, pad_cols)))
+        return bands.reshape(rows, cols, tile_words).any(axis=2)
+
+# Converts float32 chunks to int16 and appends them to a WAV file as they arrive,
+# so memory stays bounded and closing the file at stop is constant time.
+class WavAudioSink:
+    def __init__(self, filename, sample_rate):
+        self.filename = filename
+        self.sample_rate = sample_rate
+        self.wf = None
+        self.frames_written = 0
+
+    def write(self, data):
+        if self.wf is None:
+            # Channel count is only known once the first chunk arrives
+            self.wf = wave.open(self.filename, "wb")
+            self.wf.setnchannels(data.shape[1])
+            self.wf.setsampwidth(2) # 16 bit
+            self.wf.setframerate(self.sample_rate)
+
+        data_int16 = (np.clip(data, -1.0, 1.0) * 32767).astype(np.int16)
+        self.wf.writeframes(data_int16.tobytes())
+        self.frames_written += len(data)
+
+    def close(self):
+        if self.wf is not None:
+            self.wf.close()
+            self.wf = None
+
+# Streams int16 PCM into the encoder's audio FIFO. The FIFO can only be opened once
+# ffmpeg has opened its read end, so chunks recorded before that are held briefly
+# instead of blocking the audio thread.
+class FifoAudioSink:
+    def __init__(self, path, max_pending=256):
+        self.path = path
+        self.fd = None
+        self.pending = deque(maxlen=max_pending)
+        self.frames_written = 0
+
+    def _try_open(self):
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # No reader yet
+                return False
+            raise
+        os.set_blocking(fd, True)
+        self.fd = fd
+        return True
+
+    def write(self, data):
+        data_int16 = (np.clip(data, -1.0, 1.0) * 32767).astype(np.int16)
+        if self.fd is None:
+            self.pending.append(data_int16)
+            if not self._try_open():
+                return
+            chunks = list(self.pending)
+            self.pending.clear()
+        else:
+            chunks = [data_int16]
+
+        for chunk in chunks:
+            self._write_all(chunk.tobytes())
+            self.frames_written += len(chunk)
+
+    def _write_all(self, buf):
+        view = memoryview(buf)
+        while view:
+            n = os.write(self.fd, view)
+            view = view[n:]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+# Windows counterpart of FifoAudioSink: a named pipe ffmpeg opens as its audio
+# input. The pipe starts in non-blocking mode so the audio thread never waits for
+# ffmpeg to connect; chunks are held until it has.
+class NamedPipeAudioSink:
+    PIPE_ACCESS_OUTBOUND = 0x00000002
+    PIPE_TYPE_BYTE = 0x00000000
+    PIPE_WAIT = 0x00000000
+    PIPE_NOWAIT = 0x00000001
+    ERROR_PIPE_CONNECTED = 535
+    ERROR_PIPE_LISTENING = 536
+    INVALID_HANDLE_VALUE = -1
+
+    def __init__(self, name, max_pending=256, buffer_size=1 << 20):
+        import ctypes
+        import ctypes.wintypes
+        self.ctypes = ctypes
+        self.kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        self.kernel32.CreateNamedPipeW.restype = ctypes.wintypes.HANDLE
+        self.path = "\\\\.\\pipe\\" + name
+        self.handle = self.kernel32.CreateNamedPipeW(
+            self.path, self.PIPE_ACCESS_OUTBOUND, self.PIPE_TYPE_BYTE | self.PIPE_NOWAIT,
+            1, buffer_size, buffer_size, 0, None
+        )
+        if self.handle is None or self.handle == self.INVALID_HANDLE_VALUE:
+            raise ctypes.WinError(ctypes.get_last_error())
+        self.connected = False
+        self.pending = deque(maxlen=max_pending)
+        self.frames_written = 0
+
+    def _try_connect(self):
+        self.kernel32.ConnectNamedPipe(self.handle, None)
+        error = self.ctypes.get_last_error()
+        if error == self.ERROR_PIPE_LISTENING:
+            # No reader yet
+            return False
+        if error != self.ERROR_PIPE_CONNECTED:
+            raise self.ctypes.WinError(error)
+        mode = self.ctypes.wintypes.DWORD(self.PIPE_WAIT)
+        self.kernel32.SetNamedPipeHandleState(self.handle, self.ctypes.byref(mode), None, None)
+        self.connected = True
+        return True
+
+    def write(self, data):
+        if self.handle is None:
+            return
+        data_int16 = (np.clip(data, -1.0, 1.0) * 32767).astype(np.int16)
+        if not self.connected:
+            self.pending.append(data_int16)
+            if not self._try_connect():
+                return
+            chunks = list(self.pending)
+            self.pending.clear()
+        else:
+            chunks = [data_int16]
+
+        for chunk in chunks:
+            self._write_all(chunk.tobytes())
+            self.frames_written += len(chunk)
+
+    def _write_all(self, buf):
+        written = self.ctypes.wintypes.DWORD()
+        offset = 0
+        while offset < len(buf):
+            chunk = buf[offset:]
+            if not self.kernel32.WriteFile(self.handle, chunk, len(chunk), self.ctypes.byref(written), None):
+                raise self.ctypes.WinError(self.ctypes.get_last_error())
+            offset += written.value
+
+    def close(self):
+        # Also what gives ffmpeg its EOF if nothing was ever written
+        if self.handle is not None:
+            self.kernel32.CloseHandle(self.handle)
+            self.handle = None
+
+# One long-running ffmpeg process that takes raw frames on stdin and raw PCM on a
+# FIFO and writes the final MP4 directly, so there is no temp video and no mux pass.
+# Each encoder gets its own work directory so concurrent recordings never collide.
+class FFmpegEncoder:
+    def __init__(self, output_filename, tracks, fps, fourcc="BGRA",
+                 audio_rate=None, audio_channels=None, frame_rate_mode=CFR, layout=COMPOSITE,
+                 audio_tracks=1, audio_codec="aac", encoder_settings=None,
+                 keyframe_interval=None, packet_sink=None, output_mode=OUTPUT_MP4,
+                 segment_duration=60.0, stream_audio=True, convert_threads=None, temp_dir=None):
+        self.output_filename = output_filename
+        # One ((width, height), output_size) per input video track. Fractional
+        # scales the capture stage can't do are left to ffmpeg via output_size.
+        self.tracks = list(tracks)
+        # With several tracks: COMPOSITE stacks them into one video, STREAMS
+        # keeps one output stream each
+        self.layout = layout
+        self.fps = fps
+        self.fourcc = fourcc
+        # With I420, write_frame() takes BGRA and converts it on convert_threads
+        # threads (all CPUs if None)
+        self.convert_threads = convert_threads
+        self.converters = []
+        self.frame_rate_mode = frame_rate_mode
+        self.encoder_settings = dict(DEFAULT_ENCODER_SETTINGS, **(encoder_settings or {}))
+        self.audio_rate = audio_rate
+        self.audio_channels = audio_channels
+        self.has_audio = audio_rate is not None
+        self.audio_tracks = audio_tracks if self.has_audio else 0
+        if audio_codec not in AUDIO_CODECS:
+            raise ValueError(f"Unknown audio codec: {audio_codec}")
+        self.audio_codec = audio_codec
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode: {output_mode}")
+        self.output_mode = output_mode
+        self.segment_duration = segment_duration
+        # Segments are named after the output file (name_00000.mp4, ...) and
+        # listed in name.ffconcat, which `ffmpeg -f concat` plays as one video
+        self.manifest_path = None
+        if output_mode == OUTPUT_SEGMENTS and output_filename:
+            self.manifest_path = os.path.splitext(output_filename)[0] + ".ffconcat"
+        # Seconds between forced keyframes, or None for x264's own choice.
+        # Fragments and segments can only start on one, so segments get the
+        # longest spacing up to FRAGMENT_SECONDS that divides their duration.
+        if keyframe_interval is None and output_mode == OUTPUT_SEGMENTS:
+            keyframe_interval = segment_duration / math.ceil(segment_duration / FRAGMENT_SECONDS)
+        elif keyframe_interval is None and output_mode != OUTPUT_MP4:
+            keyframe_interval = FRAGMENT_SECONDS
+        self.keyframe_interval = keyframe_interval
+        # Callable taking the encoded output as streaming Matroska chunks
+        # (instant replay); nothing is written to output_filename then
+        self.packet_sink = packet_sink
+        # Audio is streamed to ffmpeg and encoded as it is recorded: through FIFOs,
+        # or named pipes on Windows. Only if neither works does it go to WAVs that
+        # are muxed at the end, the one case where stop time grows with length.
+        # stream_audio=False asks for the WAVs when the video is encoded later.
+        self.audio_is_fifo = stream_audio and hasattr(os, "mkfifo")
+        self.audio_is_pipe = stream_audio and not self.audio_is_fifo and platform.system() == "Windows"
+        # Intermediate files go in a fresh directory under temp_dir (the system
+        # temp dir if None)
+        self.temp_dir = temp_dir
+        self.work_dir = None
+        # One FIFO, pipe or WAV per audio track
+        self.audio_paths = []
+        self.pipe_sinks = []
+        self.video_target = output_filename
+        self.proc = None
+        self.frame_writer = None
+        # Latest values from ffmpeg's -progress output (frame, dup_frames, speed, ...)
+        self.progress = {}
+        self.progress_thread = None
+        self.packet_thread = None
+        # ffmpeg's error output when stderr also carries the progress lines
+        self.error_lines = []
+        # Set while close() runs the end-of-recording mux, and to ffmpeg's
+        # error output if it failed
+        self.muxing = False
+        self.error = None
+
+    def start(self):
+        self.work_dir = tempfile.mkdtemp(prefix="screenrec_", dir=self.temp_dir)
+        if self.has_audio and self.audio_is_pipe:
+            try:
+                # Created before ffmpeg starts, which opens them like files
+                name = os.path.basename(self.work_dir)
+                self.pipe_sinks = [
+                    NamedPipeAudioSink(f"{name}_audio{i}") for i in range(self.audio_tracks)
+                ]
+            except OSError as e:
+                print(f"Named pipes unavailable, muxing audio at the end: {e}")
+                for sink in self.pipe_sinks:
+                    sink.close()
+                self.pipe_sinks = []
+                self.audio_is_pipe = False
+        if self.has_audio:
+            for i in range(self.audio_tracks):
+                if self.audio_is_fifo:
+                    path = os.path.join(self.work_dir, f"audio{i}.pcm")
+                    os.mkfifo(path)
+                elif self.audio_is_pipe:
+                    path = self.pipe_sinks[i].path
+                else:
+                    path = os.path.join(self.work_dir, f"audio{i}.wav")
+                self.audio_paths.append(path)
+            if not self.audio_streamed:
+                self.video_target = os.path.join(self.work_dir, "video.mp4")
+
+        self.proc = subprocess.Popen(
+            self._build_cmd(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        # With a packet sink stdout carries the stream, so progress moves to stderr
+        progress_stream = self.proc.stderr if self.packet_sink else self.proc.stdout
+        self.progress_thread = threading.Thread(target=self._read_progress, args=(progress_stream,), daemon=True)
+        self.progress_thread.start()
+        if self.packet_sink:
+            self.packet_thread = threading.Thread(target=self._read_packets, daemon=True)
+            self.packet_thread.start()
+        sizes = [size for size, _ in self.tracks]
+        if self.fourcc == "I420":
+            self.converters = [YUV420Converter(w, h, self.convert_threads) for w, h in sizes]
+            sizes = [(c.width, c.height) for c in self.converters]
+        self.frame_writer = MatroskaFrameWriter(self.proc.stdin, sizes, self.fourcc)
+        self.frame_writer.write_header()
+
+    @property
+    def audio_streamed(self):
+        return self.audio_is_fifo or self.audio_is_pipe
+
+    def _build_cmd(self):
+        cmd = [
+            ffmpeg_exe(),
+            "-y", "-loglevel", "error", "-nostats",
+            "-progress", "pipe:2" if self.packet_sink else "pipe:1", "-stats_period", "0.5",
+            # Raw inputs need no probing; the default probe size would make ffmpeg
+            # sit on several seconds of audio before reading any video
+            "-probesize", "32", "-analyzeduration", "0",
+            "-f", "matroska",
+            "-i", "-"
+        ]
+        if self.has_audio and self.audio_streamed:
+            for path in self.audio_paths:
+                cmd += [
+                    "-thread_queue_size", "1024",
+                    "-probesize", "32", "-analyzeduration", "0",
+                    "-f", "s16le",
+                    "-ar", str(self.audio_rate),
+                    "-ac", str(self.audio_channels),
+                    "-i", path
+                ]
+        cmd += ["-filter_complex", self._build_filter_graph()]
+        if len(self.tracks) > 1 and self.layout == COMPOSITE:
+            cmd += ["-map", "[v]"]
+        else:
+            for i in range(len(self.tracks)):
+                cmd += ["-map", f"[v{i}]"]
+        if self.has_audio and self.audio_streamed:
+            for i in range(self.audio_tracks):
+                cmd += ["-map", f"{i + 1}:a"]
+        settings = self.encoder_settings
+        cmd += [
+            "-c:v", "libx264",
+            "-preset", settings["preset"],
+            "-crf", str(settings["crf"]),
+            "-pix_fmt", "yuv420p"
+        ]
+        if settings["tune"]:
+            cmd += ["-tune", settings["tune"]]
+        if settings["threads"]:
+            cmd += ["-threads:v", str(settings["threads"])]
+        if self.keyframe_interval:
+            cmd += ["-force_key_frames", f"expr:gte(t,n_forced*{self.keyframe_interval})"]
+        if self.frame_rate_mode == VFR:
+            # Keep the capture timestamps in the millisecond time base of the
+            # Matroska input; the default encoder time base would be derived from
+            # a guessed frame rate and merge close frames
+            cmd += ["-fps_mode", "vfr", "-enc_time_base:v", "1/1000"]
+        else:
+            # ffmpeg repeats frames itself, so duplicates never cross the pipe
+            cmd += ["-fps_mode", "cfr", "-r", str(self.fps)]
+        if self.has_audio and self.audio_streamed:
+            cmd += AUDIO_CODECS[self.audio_codec] + ["-shortest"]
+            if self.packet_sink:
+                # -shortest holds up to 10 s of audio while video is sparse (VFR,
+                # static screen); replay must see every GOP soon after it ends
+                cmd += ["-shortest_buf_duration", str(self.keyframe_interval or 1.0)]
+        if self.packet_sink:
+            # Clusters end at video keyframes, or after one keyframe interval
+            # when frames are too small to close them (a static screen), so a
+            # GOP is never held back in ffmpeg for long
+            cluster_ms = int((self.keyframe_interval or 1.0) * 1000)
+            cmd += [
+                "-f", "matroska", "-flush_packets", "1",
+                "-cluster_size_limit", str(1 << 30), "-cluster_time_limit", str(cluster_ms),
+                "pipe:1"
+            ]
+        elif self.video_target == self.output_filename:
+            cmd += self._output_args(self.output_filename)
+        else:
+            # Video only, muxed with the audio into the real output at the end
+            cmd.append(self.video_target)
+        return cmd
+
+    def _output_args(self, target):
+        # Fragments go to disk as each one is finished, not when ffmpeg's
+        # write buffer happens to fill
+        if self.output_mode == OUTPUT_FRAGMENTED:
+            return ["-movflags", FRAGMENT_MOVFLAGS, "-flush_packets", "1", target]
+        if self.output_mode == OUTPUT_SEGMENTS:
+            base, ext = os.path.splitext(target)
+            args = [
+                "-f", "segment",
+                "-segment_time", str(self.segment_duration),
+                "-reset_timestamps", "1",
+                "-segment_list", self.manifest_path,
+                "-segment_list_type", "ffconcat",
+                "-flush_packets", "1",
+            ]
+            if ext.lower() in (".mp4", ".mov", ".m4v"):
+                # The segment being written is fragmented too
+                args += ["-segment_format_options", f"movflags={FRAGMENT_MOVFLAGS}"]
+            return args + [f"{base}_%05d{ext}"]
+        return [target]
+
+    @property
+    def output_path(self):
+        # What a player should open: the manifest for segments, else the file
+        return self.manifest_path or self.output_filename
+
+    def segment_paths(self):
+        base, ext = os.path.splitext(self.output_filename)
+        return sorted(glob.glob(glob.escape(base) + "_" + "[0-9]" * 5 + glob.escape(ext)))
+
+    def output_size(self):
+        # Bytes written so far, over all segments
+        if self.output_mode == OUTPUT_SEGMENTS:
+            paths = self.segment_paths()
+        elif self.video_target:
+            # The video alone until audio is muxed into the real output
+            paths = [self.output_filename if self.muxing else self.video_target]
+        else:
+            return 0
+        size = 0
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def _track_output_size(self, track):
+        size, output_size = self.tracks[track]
+        width, height = output_size or size
+        return (width // 2 * 2, height // 2 * 2)
+
+    def _build_filter_graph(self):
+        chains = []
+        for i, (_, output_size) in enumerate(self.tracks):
+            filters = []
+            if output_size:
+                filters.append(f"scale={output_size[0]}:{output_size[1]}:flags=area,setsar=1")
+            # libx264 with yuv420p needs even dimensions
+            filters.append("crop=trunc(iw/2)*2:trunc(ih/2)*2")
+            chains.append(f"[0:v:{i}]{','.join(filters)}[v{i}]")
+
+        if len(self.tracks) > 1 and self.layout == COMPOSITE:
+            positions, _ = pack_tracks([self._track_output_size(i) for i in range(len(self.tracks))])
+            inputs = "".join(f"[v{i}]" for i in range(len(self.tracks)))
+            layout = "|".join(f"{x}_{y}" for x, y in positions)
+            chains.append(f"{inputs}xstack=inputs={len(self.tracks)}:layout={layout}:fill=black[v]")
+        return ";".join(chains)
+
+    def _read_progress(self, stream):
+        for line in stream:
+            text = line.decode(errors="replace").strip()
+            key, sep, value = text.partition("=")
+            if sep and key.replace("_", "").isalnum():
+                self.progress[key] = value
+            elif text and stream is self.proc.stderr:
+                self.error_lines.append(text)
+
+    def _read_packets(self):
+        while True:
+            data = self.proc.stdout.read1(1 << 16)
+            if not data:
+                break
+            try:
+                self.packet_sink(data)
+            except Exception as e:
+                print(f"Replay buffer error: {e}")
+
+    def make_audio_sinks(self):
+        if self.audio_is_fifo:
+            return [FifoAudioSink(path) for path in self.audio_paths]
+        if self.audio_is_pipe:
+            return list(self.pipe_sinks)
+        return [WavAudioSink(path, self.audio_rate) for path in self.audio_paths]
+
+    def finalize_percent(self):
+        # How much of the video sent so far ffmpeg has written out
+        if not self.frame_writer:
+            return 0.0
+        duration_ms = max(self.frame_writer.last_timestamps)
+        try:
+            out_ms = int(self.progress.get("out_time_us", 0)) / 1000
+        except ValueError:
+            # "N/A" until the first packet is written
+            out_ms = 0
+        if duration_ms <= 0:
+            return 0.0
+        return min(100.0, 100.0 * out_ms / duration_ms)
+
+    def convert_frame(self, frame, track=0):
+        # The frame as it goes down the pipe; BGRA stays as it is
+        if self.converters and frame.ndim == 3:
+            return self.converters[track].convert(frame)
+        return frame
+
+    def write_frame(self, frame, timestamp_ms, track=0):
+        self.frame_writer.write_frame(self.convert_frame(frame, track), timestamp_ms, track)
+
+    def abort(self):
+        # Stops ffmpeg without finishing a file, e.g. when the recording
+        # around it failed to start
+        if self.proc:
+            self.proc.kill()
+            self.close_video()
+            self.proc.wait()
+        for sink in self.pipe_sinks:
+            sink.close()
+        if self.work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def close_video(self):
+        if self.proc and not self.proc.stdin.closed:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+        for converter in self.converters:
+            converter.close()
+
+    def close(self):
+        if not self.proc:
+            return
+        self.close_video()
+        if self.has_audio and self.audio_is_fifo:
+            for path in self.audio_paths:
+                self._release_fifo_reader(path)
+        for sink in self.pipe_sinks:
+            sink.close()
+
+        if self.packet_sink:
+            self.proc.wait()
+            self.progress_thread.join()
+            self.packet_thread.join()
+            err = "\n".join(self.error_lines)
+        else:
+            err = self.proc.stderr.read().decode(errors="replace")
+            self.proc.wait()
+            self.progress_thread.join()
+        if self.proc.returncode != 0:
+            self.error = err
+            print(f"FFmpeg Error: {self.error}")
+        elif self.has_audio and not self.audio_streamed and not self.packet_sink:
+            self.muxing = True
+            self._mux_audio_video()
+
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _release_fifo_reader(self, path):
+        # If the audio sink never opened the FIFO (device error, no audio yet),
+        # ffmpeg would block in open() forever. Opening and closing the write end
+        # hands it an immediate EOF instead.
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            os.close(fd)
+        except OSError:
+            pass
+
+    def _mux_audio_video(self):
+        cmd = [ffmpeg_exe(), "-y", "-i", self.video_target]
+        for path in self.audio_paths:
+            cmd += ["-i", path]
+        cmd += ["-map", "0:v"]
+        for i in range(len(self.audio_paths)):
+            cmd += ["-map", f"{i + 1}:a"]
+        cmd += ["-c:v", "copy"] + AUDIO_CODECS[self.audio_codec] + ["-shortest"]
+        cmd += self._output_args(self.output_filename)
+        
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if result.returncode != 0:
+                self.error = result.stderr
+                print(f"FFmpeg Error: {result.stderr}")
+            else:
+                print("Muxing successful.")
+        except Exception as e:
+            self.error = str(e)
+            print(f"Muxing exception: {e}")
 
 class AudioRecorder:
-    def __init__(self):
+    def __init__(self, backend=None, devices=None, sample_rate=44100, block_size=1024):
+        # soundcard unless another backend is given (e.g. synthetic sources for
+        # benchmarks). Imported lazily since it needs a running sound server.
+        # Devices are looked up in the registry's cached list. sample_rate is
+        # the mix rate; each device is opened at the nearest rate it supports
+        # and read block_size frames at a time.
+        self.devices = devices or DeviceRegistry(audio_backend=backend)
         self.is_recording = False
-        self.thread = None
-        self.mic = None
+        self.mics = []
+        self.sources = []
+        # Sources opened ahead of start() by prewarm(), and their device ids
+        self.warm_sources = []
+        self.warm_ids = ()
+        self.mixer = None
         self.output_filename = "temp_audio.wav"
-        self.sample_rate = 44100
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        # Preferred rates for devices that shouldn't record at sample_rate, by
+        # device id; their audio is resampled before mixing
+        self.device_rates = {}
+        # Capture of a block's first sample to the sinks taking it
+        self.latency = Histogram([0.0] * Histogram.SIZE, 0)
+
+    @property
+    def backend(self):
+        return self.devices.audio_backend
+
+    @property
+    def chunks_recorded(self):
+        return sum(source.chunks_recorded for source in self.sources)
+
+    @property
+    def overruns(self):
+        return sum(source.overruns for source in self.sources)
+
+    @property
+    def underrun_frames(self):
+        return sum(source.underrun_frames for source in self.sources)
+
+    @property
+    def dropped_frames(self):
+        return sum(source.dropped_frames for source in self.sources)
+
+    @property
+    def first_chunk_time(self):
+        times = [source.first_chunk_time for source in self.sources if source.first_chunk_time]
+        return min(times) if times else None
+
+    def capture_stats(self, max_events=50):
+        # Negotiated device rates, device to sink latency, and the newest
+        # overrun, gap, drop and underrun events with their time into the
+        # recording
+        events = sorted(
+            (when, i, kind, frames, source.epoch)
+            for i, source in enumerate(self.sources)
+            for when, kind, frames in list(source.events)
+        )[-max_events:]
+        return {
+            "sample_rate": self.sample_rate,
+            "block_size": self.block_size,
+            "device_rates": [source.device_rate for source in self.sources],
+            "latency": self.latency.snapshot(),
+            "events": [
+                {"at": when - epoch if epoch else None, "source": i, "kind": kind, "frames": frames}
+                for when, i, kind, frames, epoch in events
+            ],
+        }
+
+    def sync_stats(self):
+        # How far the audio timeline is from the monotonic clock, worst source
+        # first, and the sample clock corrections keeping it there
+        to_ms = 1000 / self.sample_rate
+        return {
+            "audio_error_ms": max((abs(s.sync_error) * to_ms for s in self.sources), default=0.0),
+            "max_audio_error_ms": max((s.max_sync_error * to_ms for s in self.sources), default=0.0),
+            "drift_ppm": [round(s.correction * 1e6, 1) for s in self.sources],
+            "realigns": sum(s.realigns for s in self.sources),
+        }
 
     def get_devices(self):
         devices = []
-        try:
-            # Get all microphones including loopback
-            mics = sc.all_microphones(include_loopback=True)
-            for i, mic in enumerate(mics):
-                devices.append({
-                    "id": mic.id,
-                    "name": mic.name,
-                    "is_loopback": mic.isloopback
-                })
-        except Exception as e:
-            print(f"Error getting audio devices: {e}")
+        # All microphones including loopback
+        for mic in self.devices.microphones():
+            devices.append({
+                "id": mic.id,
+                "name": mic.name,
+                "is_loopback": mic.isloopback
+            })
         return devices
 
-    def start(self, device_id, filename="temp_audio.wav"):
+    def find_device(self, device_id):
+        return self.devices.find_microphone(device_id)
+
+    def find_devices(self, device_ids):
+        # Accepts one id or a list; unknown ids are reported and skipped
+        if not isinstance(device_ids, (list, tuple)):
+            device_ids = [device_ids]
+        mics = []
+        for device_id in device_ids:
+            mic = self.find_device(device_id)
+            if mic:
+                mics.append(mic)
+            else:
+                print(f"Audio device {device_id} not found!")
+        return mics
+
+    @staticmethod
+    def mix_channels(mics):
+        # Every source is recorded with this many channels; the device does the
+        # up- or downmix
+        return min(2, max(mic.channels for mic in mics))
+
+    @staticmethod
+    def _id_tuple(device_ids):
+        if device_ids is None:
+            return ()
+        return tuple(device_ids) if isinstance(device_ids, (list, tuple)) else (device_ids,)
+
+    def _make_sources(self, mics):
+        channels = self.mix_channels(mics)
+        return [
+            AudioSource(
+                mic, self.sample_rate, channels,
+                block_size=self.block_size,
+                device_rate=self.device_rates.get(mic.id)
+            )
+            for mic in mics
+        ]
+
+    def prewarm(self, device_ids):
+        # Opens the devices now and keeps them running, so a start() with the
+        # same devices gets audio from its first block instead of waiting for
+        # the sound server to set up the streams. None closes them again.
+        ids = self._id_tuple(device_ids)
+        if ids == self.warm_ids and all(self._reusable(source) for source in self.warm_sources):
+            return
+        self.release_prewarmed()
+        mics = self.find_devices(list(ids)) if ids else []
+        if not mics:
+            return
+        self.warm_sources = self._make_sources(mics)
+        self.warm_ids = ids
+        for source in self.warm_sources:
+            source.prewarm()
+
+    def _reusable(self, source):
+        # Still running, and opened with the current rate and block size
+        return (source.warm and source.sample_rate == self.sample_rate
+                and source.block_size == self.block_size)
+
+    def release_prewarmed(self):
+        for source in self.warm_sources:
+            source.stop()
+        self.warm_sources = []
+        self.warm_ids = ()
+
+    def start(self, device_ids, filename="temp_audio.wav", sinks=None, gains=None, layout=AUDIO_MIX,
+              epoch=None, wait_for_epoch=False):
+        # epoch: monotonic time of the first sample, now if None. With
+        # wait_for_epoch the audio waits in a short preroll until set_epoch() is
+        # called instead, e.g. with the first frame's capture time.
         self.output_filename = filename
         self.is_recording = True
-        
-        # Find mic by ID
-        mics = sc.all_microphones(include_loopback=True)
-        self.mic = None
-        for m in mics:
-            if m.id == device_id:
-                self.mic = m
-                break
-        
-        if not self.mic:
-            print(f"Audio device {device_id} not found!")
-            return
+        self.sources = []
+
+        ids = self._id_tuple(device_ids)
+        if ids and ids == self.warm_ids and all(self._reusable(source) for source in self.warm_sources):
+            # Already open and running
+            self.sources = self.warm_sources
+            self.mics = [source.mic for source in self.sources]
+            self.warm_sources = []
+            self.warm_ids = ()
+        else:
+            self.release_prewarmed()
+            self.mics = self.find_devices(list(ids))
+            if not self.mics:
+                return
+            self.sources = self._make_sources(self.mics)
+        for source, gain in zip(self.sources, gains or []):
+            source.gain = gain
+
+        tracks = len(self.sources) if layout == AUDIO_SEPARATE else 1
+        if sinks is None:
+            base, ext = os.path.splitext(filename)
+            names = [filename] if tracks == 1 else [f"{base}_{i}{ext}" for i in range(tracks)]
+            sinks = [WavAudioSink(name, self.sample_rate) for name in names]
 
-        self.thread = threading.Thread(target=self._record)
-        self.thread.start()
+        # Each device is read on its own thread; the mixer streams straight to
+        # the sinks, so there is nothing left to mix or convert at stop
+        self.latency = Histogram([0.0] * Histogram.SIZE, 0)
+        self.mixer = AudioMixer(self.sources, sinks, self.sample_rate, self.block_size,
+                                on_latency=self.latency.observe)
+        self.mixer.start(epoch, wait=wait_for_epoch)
 
-    def stop(self):
+    def set_epoch(self, epoch):
+        if self.mixer:
+            self.mixer.set_epoch(epoch)
+
+    def stop(self, wait=True):
+        # Without wait the mixer writes out what was recorded on its own thread
+        # and is returned for the caller to join(), e.g. once whatever reads
+        # the sinks is sure to take it all
         self.is_recording = False
-        if self.thread:
-            self.thread.join()
+        mixer, self.mixer = self.mixer, None
+        if mixer:
+            mixer.stop(wait)
+        return mixer
 
-    def _record(self):
-        try:
-            print(f"Recording audio from: {self.mic.name}")
-            with self.mic.recorder(samplerate=self.sample_rate) as recorder:
-                all_data = []
-                while self.is_recording:
-                    # Record in small chunks
-                    data = recorder.record(numframes=1024)
-                    all_data.append(data)
+# Where and how to capture: the absolute mss rectangle, how many 2x2 halvings the
+# capture stage applies, and any remaining fractional scale left to ffmpeg.
+def plan_capture(monitor, region=None, output_scale=1.0):
+    if not 0 < output_scale <= 1:
+        raise ValueError(f"Output scale must be in (0, 1]: {output_scale}")
+
+    area = dict(monitor)
+    if region:
+        # Region is relative to the monitor and clipped to it
+        x, y, w, h = region
+        left = max(0, min(x, monitor["width"]))
+        top = max(0, min(y, monitor["height"]))
+        right = max(left, min(x + w, monitor["width"]))
+        bottom = max(top, min(y + h, monitor["height"]))
+        if right - left < 2 or bottom - top < 2:
+            raise ValueError(f"Region {region} is outside the selected screen")
+        area = {
+            "left": monitor["left"] + left,
+            "top": monitor["top"] + top,
+            "width": right - left,
+            "height": bottom - top,
+        }
+
+    halvings = 0
+    remaining = output_scale
+    width, height = area["width"], area["height"]
+    while remaining <= 0.5 + 1e-6 and width >= 4 and height >= 4:
+        halvings += 1
+        remaining *= 2
+        width, height = width // 2, height // 2
+
+    output_size = None
+    if abs(remaining - 1) > 1e-6:
+        output_size = (max(2, int(width * remaining) // 2 * 2), max(2, int(height * remaining) // 2 * 2))
+    return area, halvings, (width, height), output_size
+
+def pack_tracks(sizes):
+    # Lay the monitor images out in a row or a column, whichever gives the smaller
+    # canvas, so the dead space of the virtual screen is never encoded.
+    # Returns the top-left of each image and the canvas size.
+    row_size = (sum(w for w, _ in sizes), max(h for _, h in sizes))
+    column_size = (max(w for w, _ in sizes), sum(h for _, h in sizes))
+    positions = []
+    offset = 0
+    if row_size[0] * row_size[1] <= column_size[0] * column_size[1]:
+        for width, _ in sizes:
+            positions.append((offset, 0))
+            offset += width
+        return positions, row_size
+    for _, height in sizes:
+        positions.append((0, offset))
+        offset += height
+    return positions, column_size
+
+# Per-stage timing with fixed buckets (milliseconds) over a slice of a flat
+# backing array, so it can live in shared memory next to the counters.
+class Histogram:
+    BOUNDS_MS = (0.25, 0.5, 1, 2, 4, 8, 16, 33, 66, 133, 266, 533, 1066, float("inf"))
+    # count, total, max, then one slot per bucket
+    SIZE = 3 + len(BOUNDS_MS)
+
+    def __init__(self, values, offset):
+        self.values = values
+        self.offset = offset
+
+    def observe(self, ms):
+        v, o = self.values, self.offset
+        v[o] += 1
+        v[o + 1] += ms
+        if ms > v[o + 2]:
+            v[o + 2] = ms
+        for i, bound in enumerate(self.BOUNDS_MS):
+            if ms <= bound:
+                v[o + 3 + i] += 1
+                break
+
+    def snapshot(self):
+        v, o = self.values, self.offset
+        count = int(v[o])
+        buckets = [v[o + 3 + i] for i in range(len(self.BOUNDS_MS))]
+        return {
+            "count": count,
+            "mean_ms": v[o + 1] / count if count else 0.0,
+            "p50_ms": self._percentile(buckets, count, 0.50, v[o + 2]),
+            "p95_ms": self._percentile(buckets, count, 0.95, v[o + 2]),
+            "max_ms": v[o + 2],
+        }
+
+    def _percentile(self, buckets, count, q, maximum):
+        # Upper bound of the bucket holding the q-th sample, capped by the max seen
+        if not count:
+            return 0.0
+        seen = 0
+        for bound, n in zip(self.BOUNDS_MS, buckets):
+            seen += n
+            if seen >= q * count:
+                return min(bound, maximum)
+        return maximum
+
+# Pipeline counters and stage histograms. Kept in a plain list for in-process
+# capture, or in shared memory when the capture loop runs in its own process, so
+# both sides see live values. Each field has a single writer: every capture
+# worker gets its own instance and readers combine() them.
+class PipelineStats:
+    COUNTERS = (
+        "captured",           # frames grabbed
+        "unchanged",          # frames skipped because no tile changed
+        "late",               # ticks missed because a grab was slower than fps
+        "queue_oldest",       # evicted from a full queue (drop_oldest)
+        "queue_newest",       # discarded because the queue was full (drop_newest)
+        "queue_block_time",   # seconds spent waiting on a full queue (block)
+        "written",            # frames handed to the encoder
+        "queue_depth_max",    # deepest backlog the writer has seen
+        "quality_changes",    # capture rate changes made by the QualityController
+    )
+    HISTOGRAMS = (
+        "grab",      # sct.grab
+        "convert",   # cursor overlay and change detection
+        "yuv",       # BGRA to YUV 4:2:0 in the writer (pixel_format "yuv420p")
+        "encode",    # writing the frame into the encoder pipe
+        "latency",   # capture to encoder, including time queued
+    )
+
+    def __init__(self, ctx=None):
+        size = len(self.COUNTERS) + Histogram.SIZE * len(self.HISTOGRAMS)
+        if ctx is None:
+            self.values = [0.0] * size
+        else:
+            self.values = ctx.Array("d", size, lock=False)
+        self._build_histograms()
+
+    def _build_histograms(self):
+        self.histograms = {
+            name: Histogram(self.values, len(self.COUNTERS) + i * Histogram.SIZE)
+            for i, name in enumerate(self.HISTOGRAMS)
+        }
+
+    def __getstate__(self):
+        # The histograms are rebuilt over the same backing array after pickling
+        return {"values": self.values}
+
+    def __setstate__(self, state):
+        self.values = state["values"]
+        self._build_histograms()
+
+    def add(self, name, amount=1):
+        self.values[self.COUNTERS.index(name)] += amount
+
+    def set_max(self, name, value):
+        index = self.COUNTERS.index(name)
+        if value > self.values[index]:
+            self.values[index] = value
+
+    def observe(self, stage, ms):
+        self.histograms[stage].observe(ms)
+
+    def __getitem__(self, name):
+        return self.values[self.COUNTERS.index(name)]
+
+    @classmethod
+    def combine(cls, parts):
+        # Totals over per-worker stats; maxima stay maxima rather than adding up
+        total = cls()
+        max_indices = {cls.COUNTERS.index("queue_depth_max")}
+        max_indices.update(h.offset + 2 for h in total.histograms.values())
+        for part in parts:
+            for i, value in enumerate(part.values[:]):
+                if i in max_indices:
+                    total.values[i] = max(total.values[i], value)
+                else:
+                    total.values[i] += value
+        return total
+
+    def snapshot(self):
+        snapshot = {name: self[name] for name in self.COUNTERS}
+        snapshot["stages"] = {name: h.snapshot() for name, h in self.histograms.items()}
+        return snapshot
+
+# Paced capture shared by the thread and process modes. Grabs at fps on a monotonic
+# clock, draws the cursor, skips unchanged frames and hands the rest to emit().
+# Returns the last frame held back as unchanged so the caller can flush it at stop.
+# Items are (frame, capture time, changed tiles, track), track being the index of
+# the monitor when several are captured in parallel. frame_divisor, if given, is a
+# shared int (anything with .value) set by the QualityController: only every n-th
+# tick is grabbed while the encoder is behind.
+def capture_frames(monitor, fps, stop_event, emit, stats, record_cursor=False,
+                   skip_unchanged=True, static_refresh_interval=1.0, screen_source=None,
+                   halvings=0, track=0, frame_divisor=None):
+    base_interval = 1.0 / fps
+    interval = base_interval
+    detector = ChangeDetector()
+    with (screen_source or default_screen_source)() as sct:
+        next_tick = time.monotonic()
+        last_sent_time = None
+        # Last frame skipped as unchanged, flushed at stop so the video
+        # covers the full duration
+        held_item = None
+        # Opened here since the X11 connection belongs to this thread; on the
+        # screen source's display, if it names one
+        cursor = CursorOverlay(getattr(screen_source, "display", None)) if record_cursor else None
+        
+        while not stop_event.is_set():
+            # Pace grabs on a monotonic clock instead of grabbing flat out
+            delay = next_tick - time.monotonic()
+            if delay > 0 and stop_event.wait(delay):
+                break
+            if frame_divisor is not None:
+                interval = base_interval * max(1, frame_divisor.value)
+            next_tick += interval
+
+            try:
+                capture_time = time.monotonic()
+                img = sct.grab(monitor)
+                grabbed_time = time.monotonic()
+                stats.observe("grab", (grabbed_time - capture_time) * 1000)
+                # Zero-copy view of the BGRA buffer mss already allocated;
+                # ffmpeg does the pixel format conversion
+                frame = np.frombuffer(img.raw, dtype=np.uint8).reshape(img.height, img.width, 4)
                 
-                # Save after recording stops
-                if all_data:
-                    full_data = np.concatenate(all_data)
-                    # Normalize and convert to int16
-                    data_int16 = (full_data * 32767).astype(np.int16)
-                    
-                    with wave.open(self.output_filename, "wb") as wf:
-                        wf.setnchannels(full_data.shape[1])
-                        wf.setsampwidth(2) # 16 bit
-                        wf.setframerate(self.sample_rate)
-                        wf.writeframes(data_int16.tobytes())
-                        
-        except Exception as e:
-            print(f"Audio recording error: {e}")
+                if cursor:
+                    cursor.draw(frame, monitor)
+                # Downscale before anything is queued so less crosses the pipeline
+                for _ in range(halvings):
+                    frame = downscale_half(frame)
+
+                stats.add("captured")
+                changed_tiles = None
+                unchanged = False
+                if skip_unchanged:
+                    changed_tiles = detector.changed_tiles(frame)
+                    refresh_due = (last_sent_time is None or
+                                   capture_time - last_sent_time >= static_refresh_interval)
+                    unchanged = not changed_tiles.any() and not refresh_due
+                stats.observe("convert", (time.monotonic() - grabbed_time) * 1000)
+
+                if unchanged:
+                    stats.add("unchanged")
+                    held_item = (frame, capture_time, changed_tiles, track)
+                else:
+                    held_item = None
+                    last_sent_time = capture_time
+                    emit((frame, capture_time, changed_tiles, track))
+            except Exception as e:
+                print(f"Capture error: {e}")
+
+            # Skip ticks we are already too late for rather than bursting
+            behind = time.monotonic() - next_tick
+            if behind > 0:
+                missed = int(behind / interval) + 1
+                stats.add("late", missed)
+                next_tick += missed * interval
+
+        if cursor:
+            cursor.close()
+    return held_item
+
+def _capture_process_main(ring, track, monitor, fps, stop_event, stats, drop_policy,
+                          record_cursor, skip_unchanged, static_refresh_interval, screen_source,
+                          halvings, frame_divisor=None):
+    def emit(item):
+        slot = ring.acquire(track, drop_policy, stop_event, stats)
+        if slot is not None:
+            ring.put(slot, *item)
+
+    try:
+        held_item = capture_frames(
+            monitor, fps, stop_event, emit, stats,
+            record_cursor=record_cursor,
+            skip_unchanged=skip_unchanged,
+            static_refresh_interval=static_refresh_interval,
+            screen_source=screen_source,
+            halvings=halvings,
+            track=track,
+            frame_divisor=frame_divisor
+        )
+        if held_item is not None:
+            slot = ring.free[track].get()
+            ring.put(slot, *held_item)
+    except Exception as e:
+        print(f"Capture process error: {e}")
+    finally:
+        ring.ready.put(None)
+        ring.shm.close()
+
+# One recording's frames as the writer (or spool thread) takes them: from the
+# capture queue, or from the shared ring and its capture processes. Bound when
+# the recording starts, so a writer still draining after stop never reads the
+# next recording's frames. on_first_frame gets the first frame's capture time.
+class FrameSource:
+    def __init__(self, frame_queue=None, ring=None, processes=(), on_first_frame=None):
+        self.frame_queue = frame_queue
+        self.ring = ring
+        self.processes = processes
+        self.on_first_frame = on_first_frame
+        # Monotonic time the video timestamps count from: the capture time of
+        # the first frame
+        self.timebase = None
+
+    def get(self):
+        if self.ring:
+            item = self.ring.get(lambda: any(process.is_alive() for process in self.processes))
+        else:
+            item = self.frame_queue.get()
+        if item is not None and self.timebase is None:
+            self.timebase = item[1]
+            if self.on_first_frame:
+                self.on_first_frame(self.timebase)
+        return item
+
+    def done(self):
+        if self.ring:
+            self.ring.release()
+        else:
+            self.frame_queue.task_done()
+
+    def depth(self):
+        return self.ring.ready.qsize() if self.ring else self.frame_queue.qsize()
 
 class ScreenRecorder:
-    def __init__(self):
+    def __init__(self, screen_source=None, audio_backend=None, devices=None):
+        # Callable returning an mss-like grabber; must be picklable for the
+        # capture process mode
+        self.screen_source = screen_source or default_screen_source
+        # Cached monitor and audio device lists, shared with the GUI
+        self.devices = devices or DeviceRegistry(self.screen_source, audio_backend)
         self.is_recording = False
         self.output_filename = "output.mp4"
         self.fps = 60
         self.monitor_index = 1
+        self.monitor = None
+        # Optional (x, y, w, h) inside the monitor, and the output size factor
+        self.region = None
+        self.output_scale = 1.0
+        self.monitor_layout = COMPOSITE
+        self.output_mode = OUTPUT_MP4
+        # ReplayBuffer of the current or last instant replay, for save_replay()
+        self.replay_buffer = None
+        # libx264 settings of the current recording (after auto-tuning)
+        self.encoder_settings = dict(DEFAULT_ENCODER_SETTINGS)
+        # (area, halvings, frame size, output size) for each monitor captured
+        self.capture_plans = []
         self.record_cursor = False
-        self.audio_recorder = AudioRecorder()
+        self.frame_rate_mode = CFR
+        self.skip_unchanged = True
+        # Even a static screen is re-sent this often so the video keeps moving
+        self.static_refresh_interval = 1.0
+        # Run capture in its own process, handing frames over through shared memory
+        self.use_capture_process = False
+        self.audio_recorder = AudioRecorder(devices=self.devices)
+        self.audio_enabled = False
+        self.encoder = None
         
         self._stop_event = threading.Event()
-        self.capture_thread = None
+        # Makes the is_recording check and clear in stop_recording_async() one
+        # step, so concurrent stops share a single FinalizeJob
+        self._stop_lock = threading.Lock()
+        # One capture worker per plan, all feeding the single writer
+        self.capture_threads = []
+        self.capture_processes = []
+        self._capture_lock = threading.Lock()
+        self._capture_running = 0
+        self.frame_ring = None
+        # Optional FrameSpool the writer reads from instead, filled by spool_thread
+        self.spool = None
+        self.spool_thread = None
         self.write_thread = None
-        self.frame_queue = queue.Queue()
-        self.start_time = 0
+        self.queue_size = 8
+        self.drop_policy = DROP_OLDEST
+        self.frame_queue = queue.Queue(maxsize=self.queue_size)
+        # What the writer reads this recording's frames from
+        self.frame_source = None
+        # Monotonic, like every other clock in the pipeline, so a wall-clock
+        # step never makes elapsed (and adaptive quality) jump
+        self.start_time = None
+        # Writer-side stats; each capture worker has its own in capture_stats
+        self.stats = PipelineStats()
+        self.capture_stats = []
+        # Optional callback(capture_time, written_time) after each frame reaches the encoder
+        self.on_frame_written = None
+        # Callbacks receiving a get_stats() snapshot every stats_interval seconds,
+        # called from a reporter thread so readers never touch the worker threads
+        self.stats_listeners = []
+        self.stats_interval = 1.0
+        self.stats_thread = None
+        # Most recent stop_recording_async() job
+        self.finalize_job = None
+        # Adaptive capture rate: the divisor the capture workers read, and the
+        # controller setting it (None unless adaptive_quality is on)
+        self.adaptive_quality = False
+        self.frame_divisor = ctypes.c_int(1)
+        self.quality_controller = None
+        self.quality_thread = None
+        # Monotonic times for start latency: start_recording() called, first
+        # frame captured and first frame handed to the encoder
+        self.start_requested = None
+        self.first_capture_time = None
+        self.first_written_time = None
+
+    @property
+    def frames_captured(self):
+        return int(self._combined_stats()["captured"])
+
+    @property
+    def frames_unchanged(self):
+        return int(self._combined_stats()["unchanged"])
+
+    @property
+    def frames_dropped(self):
+        # Dropped frames by reason
+        stats = self._combined_stats()
+        return {name: int(stats[name]) for name in ("late", "queue_oldest", "queue_newest")}
+
+    @property
+    def queue_block_time(self):
+        return self._combined_stats()["queue_block_time"]
+
+    def _combined_stats(self):
+        return PipelineStats.combine([self.stats] + self.capture_stats)
+
+    def add_stats_listener(self, callback):
+        self.stats_listeners.append(callback)
+
+    def remove_stats_listener(self, callback):
+        if callback in self.stats_listeners:
+            self.stats_listeners.remove(callback)
+
+    def get_stats(self):
+        snapshot = self._combined_stats().snapshot()
+        snapshot["output"] = self.output_filename
+        snapshot["recording"] = self.is_recording
+        snapshot["monitors"] = len(self.capture_plans)
+        snapshot["elapsed"] = time.monotonic() - self.start_time if self.start_time is not None else 0.0
+        snapshot["queue_depth"] = self._queue_depth(self.frame_source, self.spool)
+        snapshot["queue_capacity"] = self.queue_size * max(1, len(self.capture_plans))
+        snapshot["encoder"] = self._encoder_stats(self.encoder)
+        snapshot["audio"] = {
+            "enabled": self.audio_enabled,
+            "sources": len(self.audio_recorder.sources),
+            "chunks": self.audio_recorder.chunks_recorded,
+            "overruns": self.audio_recorder.overruns,
+            "underrun_frames": self.audio_recorder.underrun_frames,
+            "dropped_frames": self.audio_recorder.dropped_frames,
+            **self.audio_recorder.capture_stats(),
+        }
+        controller = self.quality_controller
+        snapshot["quality"] = {
+            "enabled": controller is not None,
+            "effective_fps": controller.effective_fps if controller else self.fps,
+            "level": controller.level if controller else 0,
+            "log": list(controller.log) if controller else [],
+        }
+        if self.replay_buffer:
+            snapshot["replay"] = self.replay_buffer.stats()
+        if self.spool:
+            snapshot["spool"] = self.spool.stats()
+        snapshot["startup"] = self._startup_stats()
+        snapshot["sync"] = self._sync_stats()
+        return snapshot
+
+    def _sync_stats(self):
+        return self.audio_recorder.sync_stats() if self.audio_enabled else {}
+
+    def _startup_stats(self):
+        # Milliseconds from start_recording() to the first frame and audio
+        def since_start(t):
+            if t is None or self.start_requested is None:
+                return None
+            return (t - self.start_requested) * 1000
+        return {
+            "first_frame_ms": since_start(self.first_capture_time),
+            "first_written_ms": since_start(self.first_written_time),
+            "first_audio_ms": since_start(self.audio_recorder.first_chunk_time),
+        }
+
+    @staticmethod
+    def _encoder_stats(encoder):
+        progress = dict(encoder.progress) if encoder else {}
+        return {
+            "frames": int(progress.get("frame", 0) or 0),
+            "duplicated": int(progress.get("dup_frames", 0) or 0),
+            "dropped": int(progress.get("drop_frames", 0) or 0),
+            "speed": progress.get("speed", "").strip(),
+            "settings": dict(encoder.encoder_settings) if encoder else {},
+        }
+
+    @staticmethod
+    def _queue_depth(source, spool):
+        try:
+            depth = source.depth() if source else 0
+        except NotImplementedError:
+            # multiprocessing queues can't report their size on macOS
+            return None
+        # Frames still in the spool are waiting for the encoder too
+        if spool:
+            depth += spool.depth()
+        return depth
+
+    def _publish_stats(self, snapshot=None):
+        snapshot = snapshot or self.get_stats()
+        for callback in list(self.stats_listeners):
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"Stats listener error: {e}")
+
+    def _stats_loop(self, stop_event):
+        while not stop_event.wait(self.stats_interval):
+            self._publish_stats()
+
+    def _quality_loop(self, stop_event, controller):
+        while not stop_event.wait(controller.sample_interval):
+            snapshot = self.get_stats()
+            reason = controller.update(snapshot, snapshot["elapsed"])
+            if reason:
+                self.stats.add("quality_changes")
+                print(f"Adaptive quality: {controller.effective_fps:.1f} fps ({reason})")
+                # Listeners see every adjustment, not just the next periodic snapshot
+                self._publish_stats()
 
     def get_monitors(self):
-        with mss.mss() as sct:
-            return sct.monitors
+        return self.devices.monitors()
 
     def get_audio_devices(self):
         return self.audio_recorder.get_devices()
 
-    def start_recording(self, filename="output.mp4", fps=60, monitor_index=1, record_cursor=False, audio_device_id=None):
+    def prewarm_audio(self, audio_device_id):
+        # Opens the given devices (one id or a list, None for none) ahead of
+        # start_recording() with the same ones
+        self.audio_recorder.prewarm(audio_device_id)
+
+    def start_recording(self, filename="output.mp4", fps=60, monitor_index=1, record_cursor=False, audio_device_id=None,
+                        drop_policy=DROP_OLDEST, queue_size=8, frame_rate_mode=CFR, skip_unchanged=True,
+                        use_capture_process=False, region=None, output_scale=1.0,
+                        monitor_layout=COMPOSITE, audio_gains=None, audio_layout=AUDIO_MIX,
+                        audio_codec="aac", encoder_settings=None, adaptive_quality=False,
+                        replay_buffer=None, output_mode=OUTPUT_MP4, segment_duration=60.0,
+                        spool=None, spool_size=2 * 1024 ** 3, spool_dir=None,
+                        pixel_format="bgra", convert_threads=None, work_dir=None):
+        # With a ReplayBuffer the encoded stream goes there instead of to
+        # filename; see start_replay(). spool is one of SPOOL_MODES, with a
+        # spool file of spool_size bytes in spool_dir (work_dir if None).
+        # pixel_format is a key of PIXEL_FORMATS. work_dir holds this
+        # recording's intermediate files (the system temp dir if None).
         if self.is_recording:
             return
+        # The previous recording may still be finishing in the background; only
+        # its short drain has to be over before the pipeline is set up again
+        if self.finalize_job:
+            self.finalize_job.drained.wait()
+        self.start_requested = time.monotonic()
+        self.first_capture_time = self.first_written_time = None
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        if monitor_layout not in MONITOR_LAYOUTS:
+            raise ValueError(f"Unknown monitor layout: {monitor_layout}")
+        if audio_layout not in AUDIO_LAYOUTS:
+            raise ValueError(f"Unknown audio layout: {audio_layout}")
+        if audio_codec not in AUDIO_CODECS:
+            raise ValueError(f"Unknown audio codec: {audio_codec}")
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode: {output_mode}")
+        if output_mode == OUTPUT_SEGMENTS and not segment_duration > 0:
+            raise ValueError(f"Segment duration must be positive: {segment_duration}")
+        if spool is not None and spool not in SPOOL_MODES:
+            raise ValueError(f"Unknown spool mode: {spool}")
+        if spool == SPOOL_DEFERRED and replay_buffer:
+            raise ValueError("Instant replay can't defer encoding")
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError(f"Unknown pixel format: {pixel_format}")
 
         self.output_filename = filename
         self.fps = fps
         self.monitor_index = monitor_index
         self.record_cursor = record_cursor
-        self.is_recording = True
-        self._stop_event.clear()
-        
-        # Clear queue
-        with self.frame_queue.mutex:
-            self.frame_queue.queue.clear()
+        self.drop_policy = drop_policy
+        self.queue_size = queue_size
+        self.frame_rate_mode = frame_rate_mode
+        self.skip_unchanged = skip_unchanged
+        self.use_capture_process = use_capture_process
+        self.region = region
+        self.output_scale = output_scale
+        self.monitor_layout = monitor_layout
+        self.adaptive_quality = adaptive_quality
+        self.replay_buffer = replay_buffer
+        self.output_mode = output_mode
 
-        # Start Audio
-        self.audio_enabled = audio_device_id is not None
-        if self.audio_enabled:
-            self.audio_recorder.start(audio_device_id, "temp_audio.wav")
+        monitors = self.get_monitors()
+        if self.monitor_index >= len(monitors):
+            self.monitor_index = 1
+        self.monitor = monitors[self.monitor_index]
+        # "All Monitors" is grabbed one physical screen at a time, in parallel,
+        # instead of as one bounding box full of dead space
+        if (self.monitor_index == 0 and len(monitors) > 2 and not self.region
+                and self.monitor_layout != BOUNDING_BOX):
+            areas = monitors[1:]
+        else:
+            areas = [self.monitor]
+        self.capture_plans = [plan_capture(area, self.region, self.output_scale) for area in areas]
+        tracks = [(frame_size, output_size) for _, _, frame_size, output_size in self.capture_plans]
 
-        self.start_time = time.time()
+        if encoder_settings == AUTO_TUNE:
+            # Probes once per machine, resolution and fps; cached after that
+            import encoder_tuning
+            sizes = [output_size or frame_size for frame_size, output_size in tracks]
+            _, canvas = pack_tracks(sizes)
+            encoder_settings = encoder_tuning.get_profile(canvas[0], canvas[1], self.fps)
+        elif encoder_settings is None and spool == SPOOL_DEFERRED:
+            # Nothing has to keep up in real time any more
+            encoder_settings = DEFERRED_ENCODER_SETTINGS
+        self.encoder_settings = dict(DEFAULT_ENCODER_SETTINGS, **(encoder_settings or {}))
+        # Built and started below, and torn down again if any of it fails
+        self.spool = None
+        self.encoder = None
+        self.frame_ring = None
+        self.frame_source = None
+        self.audio_enabled = False
+        self.capture_threads = []
+        self.capture_processes = []
+        self.spool_thread = self.write_thread = None
+        self.stats_thread = self.quality_thread = None
+        try:
+            if self.use_capture_process:
+                # Spawn rather than fork: the parent already runs threads
+                ctx = multiprocessing.get_context("spawn")
+                self._stop_event = ctx.Event()
+                self.frame_divisor = ctx.Value("i", 1, lock=False)
+                self.capture_stats = [PipelineStats(ctx) for _ in self.capture_plans]
+                self.frame_ring = SharedFrameRing(
+                    ctx, self.queue_size,
+                    [(height, width, 4) for _, _, (width, height), _ in self.capture_plans]
+                )
+                self.capture_processes = [
+                    ctx.Process(
+                        target=_capture_process_main,
+                        args=(self.frame_ring, track, area, self.fps, self._stop_event,
+                              self.capture_stats[track], self.drop_policy, self.record_cursor,
+                              self.skip_unchanged, self.static_refresh_interval, self.screen_source,
+                              halvings, self.frame_divisor),
+                        daemon=True
+                    )
+                    for track, (area, halvings, _, _) in enumerate(self.capture_plans)
+                ]
+            else:
+                self._stop_event = threading.Event()
+                self.frame_divisor = ctypes.c_int(1)
+                self.capture_stats = [PipelineStats() for _ in self.capture_plans]
+                # Fresh bounded queue so a slow encoder can't grow memory without limit
+                self.frame_queue = queue.Queue(maxsize=self.queue_size * len(self.capture_plans))
+            self.stats = PipelineStats()
+            if spool:
+                self.spool = FrameSpool(
+                    [(height, width, 4) for _, _, (width, height), _ in self.capture_plans],
+                    spool_size, spool_dir or work_dir, defer=spool == SPOOL_DEFERRED
+                )
 
-        # Start Threads
-        self.capture_thread = threading.Thread(target=self._capture_loop)
-        self.write_thread = threading.Thread(target=self._write_loop)
-        
-        self.capture_thread.start()
-        self.write_thread.start()
+            # audio_device_id may be a list, e.g. a microphone plus a loopback device
+            mics = []
+            if audio_device_id is not None:
+                mics = self.audio_recorder.find_devices(audio_device_id)
+            self.audio_enabled = bool(mics)
+            audio_tracks = len(mics) if audio_layout == AUDIO_SEPARATE else 1
 
-    def stop_recording(self):
-        if not self.is_recording:
-            return
-            
-        self.is_recording = False
+            self.encoder = FFmpegEncoder(
+                self.output_filename,
+                tracks,
+                self.fps,
+                fourcc=PIXEL_FORMATS[pixel_format],
+                audio_rate=self.audio_recorder.sample_rate if self.audio_enabled else None,
+                audio_channels=self.audio_recorder.mix_channels(mics) if self.audio_enabled else None,
+                frame_rate_mode=self.frame_rate_mode,
+                layout=self.monitor_layout,
+                audio_tracks=audio_tracks,
+                audio_codec=audio_codec,
+                encoder_settings=self.encoder_settings,
+                keyframe_interval=replay_buffer.keyframe_interval if replay_buffer else None,
+                packet_sink=replay_buffer.feed if replay_buffer else None,
+                output_mode=output_mode,
+                segment_duration=segment_duration,
+                stream_audio=spool != SPOOL_DEFERRED,
+                convert_threads=convert_threads,
+                temp_dir=work_dir
+            )
+            self.encoder.start()
+
+            # Start Audio
+            mixer = None
+            if self.audio_enabled:
+                self.audio_recorder.start(
+                    [mic.id for mic in mics],
+                    sinks=self.encoder.make_audio_sinks(),
+                    gains=audio_gains,
+                    layout=audio_layout,
+                    wait_for_epoch=True
+                )
+                mixer = self.audio_recorder.mixer
+
+            # ffmpeg starts the video input at its first timestamp, so the audio
+            # clock starts at that frame's capture time too rather than at
+            # whatever instant the audio happened to open; audio recorded before
+            # it is trimmed
+            self.frame_source = FrameSource(
+                self.frame_queue if not self.use_capture_process else None,
+                self.frame_ring, self.capture_processes,
+                on_first_frame=mixer.set_epoch if mixer else None
+            )
+
+            self.start_time = time.monotonic()
+
+            # Start Threads. Capture processes go first: the writer takes the
+            # ring's producers for finished if none is alive yet. Capture threads
+            # go last, so their end marker always has a reader.
+            self.write_thread = threading.Thread(
+                target=self._write_loop, args=(self.frame_source, self.spool, self.encoder, self.stats)
+            )
+            if self.spool:
+                self.spool_thread = threading.Thread(
+                    target=self._spool_loop,
+                    args=(self.frame_source, self.spool, self.stats, self.drop_policy == BLOCK)
+                )
+            for process in self.capture_processes:
+                process.start()
+            if self.spool_thread:
+                self.spool_thread.start()
+            self.write_thread.start()
+            if not self.use_capture_process:
+                self._capture_running = len(self.capture_plans)
+                self.capture_threads = [
+                    threading.Thread(target=self._capture_loop, args=(track,))
+                    for track in range(len(self.capture_plans))
+                ]
+                for thread in self.capture_threads:
+                    thread.start()
+
+            self.stats_thread = threading.Thread(target=self._stats_loop, args=(self._stop_event,), daemon=True)
+            self.stats_thread.start()
+
+            self.quality_controller = None
+            if self.adaptive_quality:
+                self.quality_controller = QualityController(self.fps, self.frame_divisor)
+                self.quality_thread = threading.Thread(
+                    target=self._quality_loop, args=(self._stop_event, self.quality_controller), daemon=True
+                )
+                self.quality_thread.start()
+        except Exception:
+            self._abort_start()
+            raise
+        self.is_recording = True
+
+    def _abort_start(self):
+        # Undoes what a failed start_recording() had set up so far. Workers that
+        # already run see the stop event; if not every capture thread started,
+        # no end marker comes, so the writer (or spool thread) gets one here.
         self._stop_event.set()
-        
+        for thread in self.capture_threads:
+            if thread.is_alive():
+                thread.join()
+        for process in self.capture_processes:
+            if process.pid is not None:
+                process.join()
+        if not self.use_capture_process:
+            try:
+                self.frame_queue.put_nowait(None)
+            except queue.Full:
+                pass
+        for thread in (self.spool_thread, self.write_thread, self.stats_thread, self.quality_thread):
+            if thread and thread.is_alive():
+                thread.join()
+        self.capture_threads = []
+        self.capture_processes = []
+        self.spool_thread = self.write_thread = None
+        self.stats_thread = self.quality_thread = None
         if self.audio_enabled:
             self.audio_recorder.stop()
+        if self.encoder:
+            self.encoder.abort()
+            self.encoder = None
+        if self.spool:
+            self.spool.close()
+            self.spool = None
+        if self.frame_ring:
+            self.frame_ring.close()
+            self.frame_ring = None
+        self.frame_source = None
+        self.replay_buffer = None
 
-        if self.capture_thread:
-            self.capture_thread.join()
-        if self.write_thread:
-            self.write_thread.join()
+    def start_replay(self, max_bytes=256 * 1024 * 1024, keyframe_interval=1.0, **options):
+        # Instant replay: records like start_recording (same options) but keeps
+        # only the newest max_bytes of encoded video and audio in memory, for
+        # save_replay() to write out. Stop it with stop_recording().
+        from replay_buffer import ReplayBuffer
+        self.start_recording(
+            filename=None,
+            replay_buffer=ReplayBuffer(max_bytes, keyframe_interval),
+            **options
+        )
 
-        if self.audio_enabled:
-            self._mux_audio_video()
-            # Cleanup temp files
-            if os.path.exists("temp_video.mp4"):
-                try: os.remove("temp_video.mp4")
-                except: pass
-            if os.path.exists("temp_audio.wav"):
-                try: os.remove("temp_audio.wav")
-                except: pass
-
-    def _capture_loop(self):
-        with mss.mss() as sct:
-            if self.monitor_index >= len(sct.monitors):
-                self.monitor_index = 1
-            monitor = sct.monitors[self.monitor_index]
-            
+    def save_replay(self, filename, seconds=None):
+        # Writes the last `seconds` (everything buffered if None) to filename,
+        # starting on a keyframe. Works while replay runs and after it stopped.
+        if not self.replay_buffer:
+            raise RuntimeError("Instant replay is not running")
+        return self.replay_buffer.save(filename, seconds)
+
+    def stop_recording(self):
+        job = self.stop_recording_async()
+        if job:
+            job.wait()
+
+    def stop_recording_async(self):
+        # Returns at once with a FinalizeJob; the caller (e.g. a GUI thread)
+        # never waits on the encoder
+        with self._stop_lock:
+            if not self.is_recording:
+                return self.finalize_job
+
+            self.is_recording = False
+            self._stop_event.set()
+            source, spool = self.frame_source, self.spool
+            job = FinalizeJob(self.encoder.output_path, self.encoder, lambda: self._queue_depth(source, spool))
+            self.finalize_job = job
+            # Not a daemon, so the file is completed even if the app exits first
+            threading.Thread(target=self._finalize, args=(job,)).start()
+            return job
+
+    def _finalize(self, job):
+        # Until drained is set no new recording can start, so self still holds
+        # this one; whatever is needed after that is taken along first
+        spool, frame_ring = self.spool, self.frame_ring
+        spool_thread, write_thread = self.spool_thread, self.write_thread
+        stats = [self.stats] + self.capture_stats
+        mixer = None
+        error = None
+        try:
+            mixer = self._stop_capture()
+            job.stats = self.get_stats()
+            if self.audio_enabled:
+                sync = job.stats["sync"]
+                print(f"A/V sync: audio {sync['audio_error_ms']:.1f} ms off the video clock "
+                      f"(worst {sync['max_audio_error_ms']:.1f} ms), drift correction "
+                      f"{sync['drift_ppm']} ppm, {sync['realigns']} realignments")
+        except Exception as e:
+            error = e
+        finally:
+            job.drained.set()
+
+        # From here on only the job's own objects are touched
+        if error is None:
+            try:
+                if spool_thread:
+                    spool_thread.join()
+                write_thread.join()
+                if frame_ring:
+                    frame_ring.close()
+                if spool:
+                    spool.close()
+                # The writer has closed the video input by now. Only then can
+                # streamed audio be waited for: ffmpeg may not read the rest of
+                # it until it has the video up to the same point.
+                if mixer:
+                    mixer.join()
+                job.state = job.ENCODING
+                job.encoder.close()
+                if job.encoder.error:
+                    error = RuntimeError(job.encoder.error)
+                elif job.output_filename:
+                    job.file_size = job.encoder.output_size()
+                # The writer-side numbers as they ended up
+                job.stats.update(PipelineStats.combine(stats).snapshot())
+                job.stats["queue_depth"] = 0
+                if spool:
+                    job.stats["spool"] = spool.stats()
+                job.stats["recording"] = False
+                job.stats["encoder"] = self._encoder_stats(job.encoder)
+            except Exception as e:
+                error = e
+        job._finish(error)
+
+        # Final numbers for listeners
+        if job.stats:
+            self._publish_stats(job.stats)
+
+    def _stop_capture(self):
+        # Ends what runs while recording: capture, audio, stats and quality
+        # threads. The audio sources stop with capture so the audio never runs
+        # past the video; their mixer, still writing out what they recorded, is
+        # returned for the caller to join.
+        for thread in self.capture_threads:
+            thread.join()
+        for process in self.capture_processes:
+            process.join()
+        mixer = self.audio_recorder.stop(wait=False) if self.audio_enabled else None
+        for thread in (self.stats_thread, self.quality_thread):
+            if thread:
+                thread.join()
+        return mixer
+
+    def _capture_loop(self, track):
+        area, halvings, _, _ = self.capture_plans[track]
+        stats = self.capture_stats[track]
+        try:
+            held_item = capture_frames(
+                area, self.fps, self._stop_event,
+                lambda item: self._enqueue_frame(item, stats), stats,
+                record_cursor=self.record_cursor,
+                skip_unchanged=self.skip_unchanged,
+                static_refresh_interval=self.static_refresh_interval,
+                screen_source=self.screen_source,
+                halvings=halvings,
+                track=track,
+                frame_divisor=self.frame_divisor
+            )
+            if held_item is not None:
+                self.frame_queue.put(held_item)
+        except Exception as e:
+            print(f"Capture error: {e}")
+        finally:
+            # The end marker must never be dropped, so it is sent by the last
+            # worker to finish, once nothing else can evict it. Even a worker
+            # that failed counts, or the writer would wait for it forever.
+            with self._capture_lock:
+                self._capture_running -= 1
+                last = self._capture_running == 0
+            if last:
+                self.frame_queue.put(None)
+
+    def _enqueue_frame(self, item, stats):
+        if self.drop_policy == BLOCK:
+            start = time.monotonic()
             while not self._stop_event.is_set():
                 try:
-                    capture_time = time.time()
-                    img = sct.grab(monitor)
-                    frame = np.array(img)
-                    
-                    if self.record_cursor:
-                        self._draw_cursor_on_frame(frame, monitor)
-
-                    # Convert BGRA to RGB
-                    frame = frame[:, :, :3]
-                    frame = frame[:, :, ::-1]
-
-                    self.frame_queue.put((frame, capture_time))
-                    time.sleep(0.001) 
-                except Exception as e:
-                    print(f"Capture error: {e}")
-
-            self.frame_queue.put(None)
-
-    def _write_loop(self):
-        target_file = "temp_video.mp4" if self.audio_enabled else self.output_filename
-        
-        writer = imageio.get_writer(
-            target_file, 
-            fps=self.fps, 
-            codec='libx264', 
-            quality=None, 
-            pixelformat='yuv420p',
-            macro_block_size=16,
-            ffmpeg_params=['-preset', 'ultrafast', '-crf', '23']
-        )
+                    self.frame_queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            else:
+                # Stopped while the queue stayed full: the frame never got in
+                stats.add("queue_newest")
+            stats.add("queue_block_time", time.monotonic() - start)
+            return
 
-        frame_duration = 1.0 / self.fps
-        video_time_covered = 0.0
-        first_frame_time = None
+        try:
+            self.frame_queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+
+        if self.drop_policy == DROP_NEWEST:
+            stats.add("queue_newest")
+            return
 
+        # DROP_OLDEST: another capture worker can refill the queue between the
+        # eviction and the put, so keep evicting until the frame fits
         while True:
-            item = self.frame_queue.get()
+            try:
+                self.frame_queue.get_nowait()
+                self.frame_queue.task_done()
+                stats.add("queue_oldest")
+            except queue.Empty:
+                pass
+            try:
+                self.frame_queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+
+    def _spool_loop(self, source, spool, stats, block):
+        # Moves frames from the capture queue (or ring) into the spool as soon as
+        # they arrive, so capture only ever waits for a memory copy. A full spool
+        # blocks under BLOCK and drops the new frame otherwise: the frames already
+        # on disk are the ones worth keeping.
+        while True:
+            item = source.get()
+            if item is None:
+                spool.close_input()
+                break
+            frame, capture_time, _, track = item
+            start = time.monotonic()
+            if not spool.put(frame, capture_time, track, block=block):
+                stats.add("queue_newest")
+            if block:
+                stats.add("queue_block_time", time.monotonic() - start)
+            source.done()
+
+    def _write_loop(self, source, spool, encoder, stats):
+        # Everything it touches is this recording's, passed in, since it may
+        # still be draining once the next recording has started
+        first = True
+        while True:
+            # With a spool, the encoder drains it at its own pace
+            item = spool.get() if spool else source.get()
             if item is None:
                 break
             
-            frame, capture_time = item
+            frame, capture_time, changed_tiles, track = item
+            depth = self._queue_depth(source, spool)
+            if depth is not None:
+                stats.set_max("queue_depth_max", depth)
             
-            if first_frame_time is None:
-                first_frame_time = capture_time
+            if first:
+                self.first_capture_time = capture_time
             
-            elapsed_real_time = capture_time - first_frame_time
+            # On the timebase the audio clock starts from, so both line up
+            elapsed_real_time = capture_time - source.timebase
             
-            while video_time_covered < elapsed_real_time:
-                writer.append_data(frame)
-                video_time_covered += frame_duration
+            try:
+                # Each frame is sent once; ffmpeg handles pacing from the timestamp
+                if encoder.converters:
+                    convert_start = time.monotonic()
+                    frame = encoder.convert_frame(frame, track)
+                    stats.observe("yuv", (time.monotonic() - convert_start) * 1000)
+                write_start = time.monotonic()
+                encoder.write_frame(frame, elapsed_real_time * 1000, track)
+                written_time = time.monotonic()
+                if first:
+                    self.first_written_time = written_time
+                stats.add("written")
+                stats.observe("encode", (written_time - write_start) * 1000)
+                stats.observe("latency", (written_time - capture_time) * 1000)
+                if self.on_frame_written:
+                    self.on_frame_written(capture_time, written_time)
+            except (BrokenPipeError, OSError) as e:
+                print(f"Encoder error: {e}")
+            first = False
             
-            self.frame_queue.task_done()
-        
-        writer.close()
-
-    def _draw_cursor_on_frame(self, frame, monitor):
-        try:
-            cursor_pos = self._get_cursor_pos()
-            rel_x = cursor_pos[0] - monitor["left"]
-            rel_y = cursor_pos[1] - monitor["top"]
-            
-            if 0 <= rel_x < monitor["width"] and 0 <= rel_y < monitor["height"]:
-                radius = 5
-                pil_img = Image.fromarray(frame)
-                draw = ImageDraw.Draw(pil_img)
-                draw.ellipse((rel_x - radius, rel_y - radius, rel_x + radius, rel_y + radius), fill='red', outline='white')
-                np.copyto(frame, np.array(pil_img))
-        except:
-            pass
-
-    def _get_cursor_pos(self):
-        point = ctypes.wintypes.POINT()
-        ctypes.windll.user32.GetCursorPos(ctypes.byref(point))
-        return (point.x, point.y)
-
-    def _mux_audio_video(self):
-        ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
-        print(f"Muxing using ffmpeg at: {ffmpeg_exe}")
-        
-        if os.path.exists("temp_video.mp4"):
-            print(f"Temp video size: {os.path.getsize('temp_video.mp4')} bytes")
-        
-        if os.path.exists("temp_audio.wav"):
-            print(f"Temp audio size: {os.path.getsize('temp_audio.wav')} bytes")
-
-        cmd = [
-            ffmpeg_exe,
-            "-y",
-            "-i", "temp_video.mp4",
-            "-i", "temp_audio.wav",
-            "-c:v", "copy",
-            "-c:a", "aac",
-            "-shortest", 
-            self.output_filename
-        ]
-        
-        try:
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            if result.returncode != 0:
-                print(f"FFmpeg Error: {result.stderr}")
+            if spool:
+                spool.release()
             else:
-                print("Muxing successful.")
-        except Exception as e:
-            print(f"Muxing exception: {e}")
+                source.done()
+        
+        encoder.close_video()
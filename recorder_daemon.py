@@ -0,0 +1,475 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+
+from devices import DisplayScreenSource
+from finalize_job import FinalizeJob
+from recorder import (
+    AUDIO_CODECS, AUDIO_LAYOUTS, AUTO_TUNE, CFR, DROP_POLICIES, MONITOR_LAYOUTS, OUTPUT_MODES,
+    PIXEL_FORMATS, SPOOL_MODES, VFR, X264_PRESETS, ScreenRecorder
+)
+
+# Headless recording without the GUI (customtkinter is never imported), for CI
+# and kiosk machines. A daemon listens on a Unix socket for one JSON request
+# per connection and answers with one JSON line. Each session is its own
+# ScreenRecorder with its own work directory, so several can record at once,
+# e.g. one per Xvfb display:
+#
+#   python recorder_daemon.py serve --work-root /var/tmp/screenrec &
+#   python recorder_daemon.py start --display :99 --fps 30 --max-duration 600
+#   python recorder_daemon.py status
+#   python recorder_daemon.py stop <session>
+
+# Limits a session is held to unless the start request sets its own; None is
+# no limit. Exceeding max_duration or max_size_mb stops the recording.
+DEFAULT_LIMITS = {
+    "max_duration": None,      # seconds of recording
+    "max_size_mb": None,       # encoded output so far
+    "encoder_threads": None,   # libx264 threads
+    "nice": None,              # niceness added to the session's ffmpeg
+}
+# start_recording() options that only make sense in-process, or that would let
+# a client put files outside the session directory
+REJECTED_OPTIONS = ("replay_buffer", "work_dir", "spool_dir")
+
+# What a client may pass: accepted types and, for numbers, the allowed range
+# (None is unbounded). Checked before a recorder is made, so a bad value is an
+# error response instead of a capture thread dying mid-recording.
+NUMBER = (int, float)
+NONE = type(None)
+OPTION_TYPES = {
+    "filename": ((str,), None, None),
+    "fps": ((int,), 1, 240),
+    "monitor_index": ((int,), 0, None),
+    "record_cursor": ((bool,), None, None),
+    "audio_device_id": ((str, list, NONE), None, None),
+    "drop_policy": ((str,), None, None),
+    "queue_size": ((int,), 1, 256),
+    "frame_rate_mode": ((str,), None, None),
+    "skip_unchanged": ((bool,), None, None),
+    "use_capture_process": ((bool,), None, None),
+    "region": ((list, NONE), None, None),
+    "output_scale": (NUMBER, 0.05, 1.0),
+    "monitor_layout": ((str,), None, None),
+    "audio_gains": ((list, NONE), None, None),
+    "audio_layout": ((str,), None, None),
+    "audio_codec": ((str,), None, None),
+    "encoder_settings": ((dict, str, NONE), None, None),
+    "adaptive_quality": ((bool,), None, None),
+    "output_mode": ((str,), None, None),
+    "segment_duration": (NUMBER, 1.0, None),
+    "spool": ((str, NONE), None, None),
+    "spool_size": ((int,), 16 * 1024 ** 2, None),
+    "pixel_format": ((str,), None, None),
+    "convert_threads": ((int, NONE), 1, 64),
+}
+OPTION_CHOICES = {
+    "drop_policy": DROP_POLICIES,
+    "frame_rate_mode": (CFR, VFR),
+    "monitor_layout": MONITOR_LAYOUTS,
+    "audio_layout": AUDIO_LAYOUTS,
+    "audio_codec": AUDIO_CODECS,
+    "encoder_settings": (AUTO_TUNE,),
+    "output_mode": OUTPUT_MODES,
+    "spool": SPOOL_MODES,
+    "pixel_format": PIXEL_FORMATS,
+}
+ENCODER_SETTING_TYPES = {
+    "preset": ((str,), None, None),
+    "crf": ((int,), 0, 51),
+    "threads": ((int,), 0, 64),
+    "tune": ((str, NONE), None, None),
+}
+LIMIT_TYPES = {
+    "max_duration": (NUMBER, 1.0, None),
+    "max_size_mb": (NUMBER, 1.0, None),
+    "encoder_threads": ((int,), 1, 64),
+    "nice": ((int,), 0, 19),
+}
+WATCH_INTERVAL = 0.5
+
+def check_value(name, value, types, low=None, high=None):
+    # bool is an int to isinstance, but never a number here
+    if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+        expected = " or ".join("null" if t is NONE else t.__name__ for t in types)
+        raise ValueError(f"{name} must be {expected}, not {json.dumps(value)}")
+    if isinstance(value, NUMBER) and not isinstance(value, bool):
+        if (low is not None and value < low) or (high is not None and value > high):
+            raise ValueError(f"{name} must be in [{low}, {high if high is not None else '...'}]: {value}")
+
+def check_options(options):
+    for name, value in options.items():
+        if name in REJECTED_OPTIONS:
+            raise ValueError(f"Option {name} can't be set remotely")
+        if name not in OPTION_TYPES:
+            raise ValueError(f"Unknown option: {name}")
+        check_value(name, value, *OPTION_TYPES[name])
+        if isinstance(value, str) and name in OPTION_CHOICES and value not in OPTION_CHOICES[name]:
+            raise ValueError(f"Unknown {name}: {value}")
+    filename = options.get("filename")
+    if filename is not None and (os.path.basename(filename) != filename
+                                 or filename in ("", ".", "..") or "\\" in filename):
+        raise ValueError(f"filename must be a plain file name: {filename}")
+    if options.get("region") is not None:
+        region = options["region"]
+        if len(region) != 4:
+            raise ValueError(f"region must be [x, y, width, height]: {region}")
+        for value in region:
+            check_value("region", value, (int,), 0, None)
+    for gain in options.get("audio_gains") or []:
+        check_value("audio_gains", gain, NUMBER, 0.0, 16.0)
+    devices = options.get("audio_device_id")
+    for device in devices if isinstance(devices, list) else []:
+        check_value("audio_device_id", device, (str,))
+    settings = options.get("encoder_settings")
+    if isinstance(settings, dict):
+        for name, value in settings.items():
+            if name not in ENCODER_SETTING_TYPES:
+                raise ValueError(f"Unknown encoder setting: {name}")
+            check_value(name, value, *ENCODER_SETTING_TYPES[name])
+        if "preset" in settings and settings["preset"] not in X264_PRESETS:
+            raise ValueError(f"Unknown preset: {settings['preset']}")
+
+def check_limits(limits):
+    for name, value in limits.items():
+        if name not in LIMIT_TYPES:
+            raise ValueError(f"Unknown limit: {name}")
+        if value is not None:
+            check_value(name, value, *LIMIT_TYPES[name])
+
+def default_socket_path():
+    base = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(base, f"screenrec-{os.getuid()}.sock")
+
+class Session:
+    def __init__(self, session_id, work_dir, display=None, options=None, limits=None):
+        self.id = session_id
+        self.work_dir = work_dir
+        self.display = display
+        self.options = dict(options or {})
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        screen_source = DisplayScreenSource(display) if display else None
+        self.recorder = ScreenRecorder(screen_source=screen_source)
+        self.output = None
+        self.job = None
+        self.started = None
+        # Why the recording stopped: "requested", a limit name, or "shutdown"
+        self.stop_reason = None
+        # A client's stop and the watch thread's can race; the first one wins
+        self.stop_lock = threading.Lock()
+
+    def start(self):
+        options = dict(self.options)
+        filename = options.pop("filename", None) or "output.mp4"
+        self.output = os.path.join(self.work_dir, filename)
+        if self.limits["encoder_threads"]:
+            settings = dict(options.get("encoder_settings") or {})
+            settings["threads"] = self.limits["encoder_threads"]
+            options["encoder_settings"] = settings
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.recorder.start_recording(filename=self.output, work_dir=self.work_dir, **options)
+        self.started = time.monotonic()
+        if self.limits["nice"] and self.recorder.encoder.proc:
+            try:
+                os.setpriority(os.PRIO_PROCESS, self.recorder.encoder.proc.pid, self.limits["nice"])
+            except (AttributeError, OSError) as e:
+                print(f"Session {self.id}: can't renice ffmpeg: {e}")
+
+    def stop(self, reason="requested"):
+        with self.stop_lock:
+            if self.recorder.is_recording:
+                self.stop_reason = reason
+                self.job = self.recorder.stop_recording_async()
+            return self.job
+
+    def check_limits(self):
+        # The limit that was exceeded, or None
+        if not self.recorder.is_recording or self.started is None:
+            return None
+        max_duration = self.limits["max_duration"]
+        if max_duration and time.monotonic() - self.started >= max_duration:
+            return "max_duration"
+        max_size = self.limits["max_size_mb"]
+        if max_size:
+            if (self.recorder.encoder.output_size() or 0) >= max_size * 1024 * 1024:
+                return "max_size_mb"
+        return None
+
+    @property
+    def state(self):
+        if self.recorder.is_recording:
+            return "recording"
+        if self.job:
+            return self.job.progress()["state"]
+        return "starting"
+
+    @property
+    def finished(self):
+        return self.state in (FinalizeJob.DONE, FinalizeJob.FAILED)
+
+    def status(self):
+        status = {
+            "session": self.id,
+            "state": self.state,
+            "display": self.display,
+            "output": self.output,
+            "work_dir": self.work_dir,
+            "limits": self.limits,
+            "stop_reason": self.stop_reason,
+            "error": None,
+        }
+        if self.job and self.job.stats:
+            stats = self.job.stats
+        elif self.recorder.is_recording:
+            stats = self.recorder.get_stats()
+        else:
+            stats = None
+        if stats:
+            status.update({
+                "elapsed": stats["elapsed"],
+                "captured": stats["captured"],
+                "written": stats["written"],
+                "dropped": stats["late"] + stats["queue_oldest"] + stats["queue_newest"],
+                "queue_depth": stats["queue_depth"],
+            })
+        if self.recorder.is_recording:
+            status["file_size"] = self.recorder.encoder.output_size()
+        elif self.job:
+            progress = self.job.progress()
+            status.update(file_size=progress["file_size"], percent=progress["percent"])
+            if self.job.done() and self.job.future.exception():
+                status["error"] = str(self.job.future.exception())
+        return status
+
+class RecorderDaemon:
+    def __init__(self, socket_path=None, work_root=None, max_sessions=8, limits=None):
+        self.socket_path = socket_path or default_socket_path()
+        self.work_root = os.path.abspath(work_root or os.path.join(os.getcwd(), "recordings"))
+        self.max_sessions = max_sessions
+        # Applied to every session; a start request can only tighten them
+        check_limits(limits or {})
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.stopping = threading.Event()
+        self.watch_thread = None
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            # A socket file left behind by a daemon that is gone
+            try:
+                send_command({"command": "list"}, self.socket_path, timeout=1.0)
+            except OSError:
+                os.remove(self.socket_path)
+            else:
+                raise RuntimeError(f"A daemon is already listening on {self.socket_path}")
+        os.makedirs(self.work_root, exist_ok=True)
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                try:
+                    response = daemon.handle(json.loads(line))
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+                self.wfile.write(json.dumps(response, default=str).encode() + b"\n")
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        os.chmod(self.socket_path, 0o600)
+        self.watch_thread = threading.Thread(target=self._watch, daemon=True)
+        self.watch_thread.start()
+        print(f"Listening on {self.socket_path}, sessions in {self.work_root}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+            self._stop_all()
+
+    def handle(self, request):
+        command = request.get("command")
+        if command == "start":
+            return self._start(request)
+        if command == "stop":
+            job = self._session(request).stop()
+            if job and request.get("wait"):
+                job.wait()
+            return {"ok": True, "session": self._session(request).status()}
+        if command == "status":
+            if request.get("session"):
+                return {"ok": True, "session": self._session(request).status()}
+            return self._list()
+        if command == "list":
+            return self._list()
+        if command == "forget":
+            # Drops a finished session from the list; its files stay
+            session = self._session(request)
+            if not session.finished:
+                raise RuntimeError(f"Session {session.id} is still {session.state}")
+            with self.lock:
+                del self.sessions[session.id]
+            return {"ok": True}
+        if command == "shutdown":
+            self.stopping.set()
+            # serve_forever() has to be told from another thread
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return {"ok": True}
+        raise ValueError(f"Unknown command: {command}")
+
+    def _session(self, request):
+        with self.lock:
+            session = self.sessions.get(request.get("session"))
+        if session is None:
+            raise KeyError(f"No session {request.get('session')}")
+        return session
+
+    def _list(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return {"ok": True, "sessions": [session.status() for session in sessions]}
+
+    def _start(self, request):
+        options = dict(request.get("options") or {})
+        check_options(options)
+        check_limits(request.get("limits") or {})
+        limits = dict(self.limits)
+        for name, value in (request.get("limits") or {}).items():
+            if value is not None:
+                limits[name] = value if limits[name] is None else min(limits[name], value)
+        session_id = request.get("session") or uuid.uuid4().hex[:8]
+        if os.path.basename(session_id) != session_id or session_id.startswith("."):
+            raise ValueError(f"Bad session name: {session_id}")
+
+        with self.lock:
+            active = sum(1 for session in self.sessions.values() if not session.finished)
+            if active >= self.max_sessions:
+                raise RuntimeError(f"Already running {active} sessions")
+            if session_id in self.sessions:
+                raise RuntimeError(f"Session {session_id} exists")
+            session = Session(
+                session_id, os.path.join(self.work_root, session_id),
+                display=request.get("display"), options=options, limits=limits
+            )
+            self.sessions[session_id] = session
+        try:
+            session.start()
+        except Exception:
+            # Nothing was recorded; the name is free to try again
+            with self.lock:
+                del self.sessions[session_id]
+            raise
+        return {"ok": True, "session": session.status()}
+
+    def _watch(self):
+        while not self.stopping.wait(WATCH_INTERVAL):
+            with self.lock:
+                sessions = list(self.sessions.values())
+            for session in sessions:
+                try:
+                    reason = session.check_limits()
+                    if reason:
+                        print(f"Session {session.id}: {reason} reached, stopping")
+                        session.stop(reason)
+                except Exception as e:
+                    print(f"Session {session.id}: limit check error: {e}")
+
+    def _stop_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        jobs = [session.stop("shutdown") for session in sessions]
+        for job in jobs:
+            if job:
+                job.wait()
+
+def send_command(request, socket_path=None, timeout=None):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path or default_socket_path())
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
+
+def parse_value(text):
+    # --set values are JSON where they parse as JSON, strings otherwise
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless screen recording daemon")
+    parser.add_argument("--socket", help=f"control socket (default {default_socket_path()})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the daemon")
+    serve.add_argument("--work-root", help="a directory per session is made here (default ./recordings)")
+    serve.add_argument("--max-sessions", type=int, default=8)
+    serve.add_argument("--max-duration", type=float, help="seconds, for every session")
+    serve.add_argument("--max-size-mb", type=float, help="output size, for every session")
+    serve.add_argument("--encoder-threads", type=int)
+    serve.add_argument("--nice", type=int, help="niceness added to each session's ffmpeg")
+
+    start = commands.add_parser("start", help="start a recording session")
+    start.add_argument("--session", help="session name (random if not given)")
+    start.add_argument("--display", help="X display to record, e.g. :99")
+    start.add_argument("--output", help="file name inside the session directory")
+    start.add_argument("--fps", type=int, default=30)
+    start.add_argument("--monitor", type=int, default=1)
+    start.add_argument("--cursor", action="store_true")
+    start.add_argument("--audio-device", action="append", help="audio device id; repeat for several")
+    start.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                       help="any other start_recording option, e.g. --set pixel_format=yuv420p")
+    start.add_argument("--max-duration", type=float)
+    start.add_argument("--max-size-mb", type=float)
+    start.add_argument("--encoder-threads", type=int)
+    start.add_argument("--nice", type=int)
+
+    stop = commands.add_parser("stop", help="stop a session")
+    stop.add_argument("session")
+    stop.add_argument("--wait", action="store_true", help="return once the file is finished")
+    status = commands.add_parser("status", help="show one session, or all")
+    status.add_argument("session", nargs="?")
+    commands.add_parser("list", help="show all sessions")
+    forget = commands.add_parser("forget", help="drop a finished session from the list")
+    forget.add_argument("session")
+    commands.add_parser("shutdown", help="stop every session and exit")
+    args = parser.parse_args()
+
+    limit_args = {name: getattr(args, name, None) for name in DEFAULT_LIMITS}
+    if args.command == "serve":
+        RecorderDaemon(args.socket, args.work_root, args.max_sessions, limit_args).serve_forever()
+        return
+
+    request = {"command": args.command}
+    if args.command == "start":
+        options = {"fps": args.fps, "monitor_index": args.monitor, "record_cursor": args.cursor}
+        if args.output:
+            options["filename"] = args.output
+        if args.audio_device:
+            options["audio_device_id"] = args.audio_device
+        for item in args.set:
+            key, _, value = item.partition("=")
+            options[key] = parse_value(value)
+        request.update(session=args.session, display=args.display, options=options,
+                       limits={k: v for k, v in limit_args.items() if v is not None})
+    elif args.command in ("stop", "status", "forget"):
+        request["session"] = args.session
+        if args.command == "stop":
+            request["wait"] = args.wait
+    response = send_command(request, args.socket)
+    print(json.dumps(response, indent=2, default=str))
+    if not response.get("ok"):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
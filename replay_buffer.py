@@ -0,0 +1,288 @@
+import subprocess
+import threading
+import time
+from collections import deque
+
+from matroska_writer import _ebml
+from recorder import ffmpeg_exe
+
+# Instant replay: ffmpeg streams the encoded recording as Matroska into memory
+# instead of a file. The stream is cut into GOPs at the video keyframes and only
+# the newest max_bytes are kept. Saving writes the stream header and the kept
+# GOPs out as they are (stream copy into another container if needed), so it
+# costs a memory copy, never an encode.
+
+SEGMENT_ID = 0x18538067
+CLUSTER_ID = 0x1F43B675
+TRACKS_ID = 0x1654AE6B
+TRACK_ENTRY_ID = 0xAE
+TRACK_NUMBER_ID = 0xD7
+TRACK_TYPE_ID = 0x83
+TIMESTAMP_ID = 0xE7
+SIMPLE_BLOCK_ID = 0xA3
+BLOCK_GROUP_ID = 0xA0
+BLOCK_ID = 0xA1
+REFERENCE_BLOCK_ID = 0xFB
+VIDEO_TRACK_TYPE = 1
+UNKNOWN_SIZE = (1 << 56) - 1
+
+def _read_id(data, pos):
+    # Element IDs keep their length marker bits
+    length = 1
+    while length <= 4 and not data[pos] & (0x80 >> (length - 1)):
+        length += 1
+    if pos + length > len(data):
+        return None, 0
+    return int.from_bytes(data[pos:pos + length], "big"), length
+
+def _read_size(data, pos):
+    if pos >= len(data):
+        return None, 0
+    first = data[pos]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if pos + length > len(data):
+        return None, 0
+    value = first & ((0x80 >> (length - 1)) - 1)
+    for b in data[pos + 1:pos + length]:
+        value = value << 8 | b
+    if value == (1 << (7 * length)) - 1:
+        value = UNKNOWN_SIZE
+    return value, length
+
+def _children(data, start=0, end=None):
+    # (id, payload start, payload end, element start) of each child element
+    end = len(data) if end is None else end
+    pos = start
+    while pos < end:
+        element_id, id_len = _read_id(data, pos)
+        size, size_len = _read_size(data, pos + id_len)
+        payload = pos + id_len + size_len
+        yield element_id, payload, payload + size, pos
+        pos = payload + size
+
+def _block_info(data, payload, end, element_id):
+    # (track number, timecode relative to the cluster, keyframe) of a
+    # SimpleBlock or BlockGroup
+    keyframe = True
+    if element_id == BLOCK_GROUP_ID:
+        block = None
+        for child_id, child_start, _, _ in _children(data, payload, end):
+            if child_id == BLOCK_ID:
+                block = child_start
+            elif child_id == REFERENCE_BLOCK_ID:
+                keyframe = False
+        if block is None:
+            return None, 0, False
+        payload = block
+    track, track_len = _read_size(data, payload)
+    timecode = int.from_bytes(data[payload + track_len:payload + track_len + 2], "big", signed=True)
+    if element_id == SIMPLE_BLOCK_ID:
+        keyframe = bool(data[payload + track_len + 2] & 0x80)
+    return track, timecode, keyframe
+
+# One video keyframe and everything after it up to the next one, audio included:
+# usually a single cluster, as the muxer starts a new one at each keyframe.
+class Gop:
+    __slots__ = ("start_ms", "end_ms", "chunks", "size")
+
+    def __init__(self, start_ms):
+        self.start_ms = start_ms
+        self.end_ms = start_ms
+        self.chunks = []
+        self.size = 0
+
+    def append(self, chunk, end_ms):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self.end_ms = max(self.end_ms, end_ms)
+
+class ReplayBuffer:
+    def __init__(self, max_bytes=256 * 1024 * 1024, keyframe_interval=1.0):
+        self.max_bytes = max_bytes
+        # Seconds between forced keyframes: the granularity of a save
+        self.keyframe_interval = keyframe_interval
+        self.lock = threading.Lock()
+        self.pending = bytearray()
+        # EBML header, Segment start, Info and Tracks: written ahead of every save
+        self.header = bytearray()
+        self.header_done = False
+        self.video_track = None
+        self.gops = deque()
+        self.buffered = 0
+
+        self.evicted_bytes = 0
+        self.evicted_gops = 0
+        self.saves = 0
+        self.last_save_time = None
+
+    def feed(self, data):
+        # Called by the encoder's reader thread with raw ffmpeg output. Only
+        # whole top-level elements are consumed; ffmpeg writes each cluster in
+        # one piece once the next keyframe starts a new one.
+        self.pending += data
+        pos = 0
+        while pos < len(self.pending):
+            element_id, id_len = _read_id(self.pending, pos)
+            if element_id is None:
+                break
+            size, size_len = _read_size(self.pending, pos + id_len)
+            if size is None:
+                break
+            payload = pos + id_len + size_len
+            if element_id == SEGMENT_ID:
+                # Written with an unknown size; its children follow at top level
+                self.header += self.pending[pos:payload]
+                pos = payload
+                continue
+            if size == UNKNOWN_SIZE or payload + size > len(self.pending):
+                break
+            element = bytes(self.pending[pos:payload + size])
+            pos = payload + size
+
+            if element_id == CLUSTER_ID:
+                self.header_done = True
+                self._add_cluster(element, id_len + size_len)
+            elif not self.header_done:
+                if element_id == TRACKS_ID:
+                    self._read_tracks(element, id_len + size_len)
+                self.header += element
+            # Cues and tags written at the very end are not needed
+        del self.pending[:pos]
+
+    def _read_tracks(self, element, payload):
+        for entry_id, start, end, _ in _children(element, payload):
+            if entry_id != TRACK_ENTRY_ID:
+                continue
+            number = track_type = None
+            for child_id, child_start, child_end, _ in _children(element, start, end):
+                if child_id == TRACK_NUMBER_ID:
+                    number = int.from_bytes(element[child_start:child_end], "big")
+                elif child_id == TRACK_TYPE_ID:
+                    track_type = int.from_bytes(element[child_start:child_end], "big")
+            # The first video track is the one GOPs are cut on
+            if track_type == VIDEO_TRACK_TYPE and self.video_track is None:
+                self.video_track = number
+
+    def _add_cluster(self, cluster, payload):
+        timestamp = 0
+        # (element start, element end, is video, keyframe) per block
+        blocks = []
+        end_ms = None
+        for element_id, start, end, element_start in _children(cluster, payload):
+            if element_id == TIMESTAMP_ID:
+                timestamp = int.from_bytes(cluster[start:end], "big")
+            elif element_id in (SIMPLE_BLOCK_ID, BLOCK_GROUP_ID):
+                track, timecode, keyframe = _block_info(cluster, start, end, element_id)
+                is_video = track == self.video_track
+                blocks.append((element_start, end, is_video, keyframe))
+                if is_video:
+                    end_ms = timecode if end_ms is None else max(end_ms, timecode)
+        end_ms = timestamp + (end_ms or 0)
+
+        # Blocks where a video keyframe starts a GOP. Audio ahead of the first
+        # video block stays with the keyframe that follows it.
+        cuts = []
+        seen_video = False
+        for i, (_, _, is_video, keyframe) in enumerate(blocks):
+            if is_video:
+                if keyframe:
+                    cuts.append(i if seen_video else 0)
+                seen_video = True
+
+        with self.lock:
+            if cuts in ([], [0]):
+                # The common case: the cluster is one whole GOP, or continues one
+                if cuts:
+                    self.gops.append(Gop(timestamp))
+                if self.gops:
+                    self.gops[-1].append(cluster, end_ms)
+                    self.buffered += len(cluster)
+            else:
+                # A keyframe mid-cluster (the cluster was too small to close at
+                # it): split so each GOP starts a cluster of its own
+                bounds = sorted(set([0] + cuts + [len(blocks)]))
+                for first, last in zip(bounds, bounds[1:]):
+                    chunk = _ebml(
+                        CLUSTER_ID.to_bytes(4, "big"),
+                        _ebml(TIMESTAMP_ID.to_bytes(1, "big"), timestamp) +
+                        cluster[blocks[first][0]:blocks[last - 1][1]]
+                    )
+                    if first in cuts:
+                        self.gops.append(Gop(timestamp))
+                    if self.gops:
+                        self.gops[-1].append(chunk, end_ms)
+                        self.buffered += len(chunk)
+            self._evict()
+
+    def _evict(self):
+        # Oldest whole GOPs go first, so what remains always starts on a keyframe
+        while len(self.gops) > 1 and self.buffered > self.max_bytes:
+            gop = self.gops.popleft()
+            self.buffered -= gop.size
+            self.evicted_bytes += gop.size
+            self.evicted_gops += 1
+
+    def buffered_seconds(self):
+        with self.lock:
+            if not self.gops:
+                return 0.0
+            return (self.gops[-1].end_ms - self.gops[0].start_ms) / 1000
+
+    def stats(self):
+        return {
+            "buffered_bytes": self.buffered,
+            "buffered_seconds": self.buffered_seconds(),
+            "gops": len(self.gops),
+            "evicted_bytes": self.evicted_bytes,
+            "evicted_gops": self.evicted_gops,
+            "saves": self.saves,
+            "last_save_time": self.last_save_time,
+        }
+
+    def snapshot(self, seconds=None):
+        # The chunks to save: the header, then whole GOPs from the newest
+        # keyframe at least `seconds` back (everything buffered if None)
+        with self.lock:
+            gops = list(self.gops)
+            header = bytes(self.header)
+        if seconds is not None and gops:
+            newest = gops[-1].end_ms
+            first = 0
+            for i, gop in enumerate(gops):
+                if newest - gop.start_ms >= seconds * 1000:
+                    first = i
+            gops = gops[first:]
+        return [header] + [chunk for gop in gops for chunk in gop.chunks] if gops else []
+
+    def save(self, filename, seconds=None):
+        start = time.monotonic()
+        chunks = self.snapshot(seconds)
+        if not chunks:
+            raise RuntimeError("Nothing buffered yet")
+
+        if filename.lower().endswith(".mkv"):
+            with open(filename, "wb") as f:
+                f.writelines(chunks)
+        else:
+            # Into the container of the file name, without touching the streams
+            cmd = [
+                ffmpeg_exe(), "-y", "-loglevel", "error",
+                "-f", "matroska", "-i", "-",
+                "-map", "0", "-c", "copy", filename
+            ]
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                proc.stdin.writelines(chunks)
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            err = proc.stderr.read()
+            proc.wait()
+            if proc.returncode != 0:
+                raise RuntimeError(err.decode(errors="replace"))
+
+        self.saves += 1
+        self.last_save_time = time.monotonic() - start
+        return filename
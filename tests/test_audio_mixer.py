@@ -0,0 +1,168 @@
+import numpy as np
+import pytest
+
+from audio_mixer import AudioRing, AudioSource
+
+def frames(values):
+    return np.asarray(values, dtype=np.float32).reshape(-1, 1)
+
+def read_all(ring):
+    out = np.zeros((ring.size, ring.buffer.shape[1]), dtype=np.float32)
+    ring.read_into(out)
+    return out[:, 0].tolist()
+
+def test_ring_wraps_around():
+    ring = AudioRing(8, 1)
+    ring.write(frames(range(6)))
+    out = np.zeros((4, 1), dtype=np.float32)
+    assert ring.read_into(out) == 4
+    ring.write(frames(range(6, 12)))
+    assert ring.size == 8
+    assert read_all(ring) == list(range(4, 12))
+
+def test_ring_overwrites_oldest_when_full():
+    ring = AudioRing(4, 1)
+    ring.write(frames([1, 2, 3]))
+    assert ring.write(frames([4, 5, 6])) == 2
+    assert read_all(ring) == [3, 4, 5, 6]
+    # Longer than the ring: only its newest frames fit
+    assert ring.write(frames(range(10))) == 6
+    assert read_all(ring) == [6, 7, 8, 9]
+
+def test_ring_write_silence():
+    ring = AudioRing(4, 1)
+    ring.write(frames([1, 2, 3]))
+    ring.write_silence(2)
+    assert read_all(ring) == [2, 3, 0, 0]
+
+def test_discard_newest():
+    ring = AudioRing(8, 1)
+    ring.write(frames(range(6)))
+    assert ring.discard_newest(2) == 2
+    assert read_all(ring) == [0, 1, 2, 3]
+    # Across the wrap point, and more than is buffered
+    ring.write(frames(range(10, 16)))
+    assert ring.discard_newest(3) == 3
+    assert ring.discard_newest(5) == 3
+    assert ring.size == 0
+
+def test_discard_newest_then_write_keeps_order():
+    ring = AudioRing(6, 1)
+    ring.write(frames(range(5)))
+    ring.read_into(np.zeros((3, 1), dtype=np.float32))
+    ring.discard_newest(1)
+    ring.write(frames([7, 8, 9]))
+    assert read_all(ring) == [3, 7, 8, 9]
+
+def make_source():
+    # 1 kHz so capture times in ms are frame positions; realigns beyond 50 frames
+    source = AudioSource(None, 1000, 1, block_size=20, max_latency=1.0,
+                         realign_threshold=0.05, drift_correction=False)
+    source.set_epoch(0.0)
+    return source
+
+def test_place_pads_gap_with_silence():
+    source = make_source()
+    source._place(frames([1] * 10), 0.0)
+    source._place(frames([2] * 10), 0.1)
+    out = source.read(source.buffered)[:, 0]
+    assert out[:10].tolist() == [1] * 10
+    assert out[10:100].tolist() == [0] * 90
+    assert out[100:].tolist() == [2] * 10
+    assert source.realigns == 1
+
+def test_place_overlap_discards_newest_buffered_first():
+    source = make_source()
+    source._place(frames([1] * 100), 0.0)
+    # Starts where the buffered chunk does: the buffer gives way entirely
+    source._place(frames(range(200)), 0.0)
+    assert source.ring.size == 200
+    assert source.dropped_frames == 100
+    assert read_all(source.ring) == list(range(200))
+
+def test_place_overlap_beyond_buffer_trims_chunk():
+    source = make_source()
+    source._place(frames([1] * 100), 0.0)
+    # 150 frames early: 100 buffered frames go, then 50 from the chunk
+    source._place(frames(range(200)), -0.05)
+    assert read_all(source.ring) == list(range(50, 200))
+    assert source.dropped_frames == 150
+
+def test_place_before_timeline_is_ignored():
+    source = make_source()
+    source._place(frames([1] * 100), 0.0)
+    source._place(frames([2] * 50), -0.2)
+    assert read_all(source.ring) == [1] * 100
+    assert source.dropped_frames == 0
+
+RATE = 48000
+BLOCK = 480
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+class FakeMic:
+    # Each block takes `speed` times its length on the clock to arrive (above 1:
+    # the device clock runs slow); stalls maps a block index to extra seconds
+    # before it, as when samples were lost while the thread was starved
+    name = "fake"
+
+    def __init__(self, clock, source, blocks, speed=1.0, stalls=None):
+        self.clock = clock
+        self.source = source
+        self.blocks = blocks
+        self.speed = speed
+        self.stalls = stalls or {}
+        self.count = 0
+
+    def recorder(self, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def record(self, numframes):
+        self.clock.now += numframes / RATE * self.speed + self.stalls.get(self.count, 0.0)
+        self.count += 1
+        if self.count == self.blocks:
+            self.source.stop_event.set()
+        return np.zeros((numframes, 1), dtype=np.float32)
+
+def record_source(monkeypatch, blocks, speed=1.0, stalls=None, **options):
+    clock = FakeClock()
+    monkeypatch.setattr("audio_mixer.time", clock)
+    # Nothing reads it out, so room for the whole run
+    source = AudioSource(None, RATE, 1, block_size=BLOCK, max_latency=10.0, **options)
+    source.mic = FakeMic(clock, source, blocks, speed, stalls)
+    source.epoch = clock.now
+    source.on_data = lambda: None
+    source._record()
+    return source, clock
+
+@pytest.mark.parametrize("speed", [1.001, 0.999])
+def test_drift_is_steered_out_by_resampling(monkeypatch, speed):
+    corrected, _ = record_source(monkeypatch, 500, speed, correction_horizon=1.0)
+    uncorrected, _ = record_source(monkeypatch, 500, speed, drift_correction=False)
+    assert corrected.realigns == uncorrected.realigns == 0
+    # Slow device: the audio lands late, so the resampler stretches it
+    direction = 1 if speed > 1 else -1
+    assert corrected.correction * direction > 0
+    assert (corrected.base_step - corrected.resampler.step) * direction > 0
+    assert abs(corrected.sync_error) < abs(uncorrected.sync_error) / 2
+
+def test_stall_counts_an_overrun_and_realigns(monkeypatch):
+    source, clock = record_source(monkeypatch, 200, stalls={100: 0.3}, drift_correction=False)
+    assert source.overruns == 1
+    assert source.realigns == 1
+    # The lost 0.3 s is padded with silence, keeping the timeline on the clock
+    expected = (clock.now - source.epoch) * RATE
+    assert abs(source.consumed + source.buffered - expected) <= BLOCK
+    # One event for the lost samples, one for the realignment that filled them
+    assert [(kind, frames) for _, kind, frames in source.events] == [("overrun", 14400), ("gap", 14400)]
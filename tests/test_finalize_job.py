@@ -0,0 +1,47 @@
+import pytest
+
+from finalize_job import FinalizeJob
+
+class FakeEncoder:
+    def __init__(self, size):
+        self.size = size
+        self.muxing = False
+
+    def finalize_percent(self):
+        return 40.0
+
+    def output_size(self):
+        return self.size
+
+def test_finalize_job_progress_through_its_states():
+    encoder = FakeEncoder(1000)
+    job = FinalizeJob("out.mp4", encoder, lambda: 5)
+    progress = job.progress()
+    assert (progress["state"], progress["frames_queued"], progress["percent"], progress["file_size"]) == (
+        "draining", 5, 40.0, 1000)
+
+    job.state = FinalizeJob.ENCODING
+    assert job.progress()["frames_queued"] == 0
+    encoder.muxing = True
+    progress = job.progress()
+    assert (progress["state"], progress["percent"]) == ("muxing", None)
+
+    job.file_size = 2000
+    job._finish()
+    progress = job.progress()
+    assert (progress["state"], progress["percent"], progress["file_size"]) == ("done", 100.0, 2000)
+    assert job.done() and job.wait(0)
+    assert job.result() == "out.mp4"
+
+def test_finalize_job_failure_reaches_callbacks():
+    job = FinalizeJob("out.mp4", FakeEncoder(0), lambda: None)
+    finished = []
+    job.add_done_callback(finished.append)
+    assert not job.wait(0.01)
+    assert job.progress()["file_size"] == 0
+
+    job._finish(RuntimeError("ffmpeg exited with 1"))
+    assert finished == [job]
+    assert job.state == FinalizeJob.FAILED
+    with pytest.raises(RuntimeError):
+        job.result()
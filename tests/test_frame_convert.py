@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from frame_convert import YUV420Converter, downscale_half
+
+def random_frame(height, width, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 4), dtype=np.uint8)
+
+def test_downscale_half_matches_pairwise_averages():
+    frame = random_frame(6, 10)
+    pixels = frame.astype(np.int32)
+    rows = (pixels[0::2] + pixels[1::2]) >> 1
+    expected = (rows[:, 0::2] + rows[:, 1::2]) >> 1
+    assert np.array_equal(downscale_half(frame), expected.astype(np.uint8))
+
+def test_downscale_half_crops_odd_edges():
+    frame = random_frame(7, 9)
+    out = downscale_half(frame)
+    assert out.shape == (3, 4, 4)
+    assert np.array_equal(out, downscale_half(frame[:6, :8]))
+
+def reference_i420(frame):
+    # BT.601 limited range from the 8-bit formulas, chroma from 2x2 averages
+    b, g, r = (frame[:, :, i].astype(np.float64) for i in range(3))
+    y = (66 * r + 129 * g + 25 * b + 128) / 256 + 16
+    average = [(c[0::2, 0::2] + c[0::2, 1::2] + c[1::2, 0::2] + c[1::2, 1::2]) / 4 for c in (b, g, r)]
+    ab, ag, ar = average
+    u = (-38 * ar - 74 * ag + 112 * ab + 128) / 256 + 128
+    v = (112 * ar - 94 * ag - 18 * ab + 128) / 256 + 128
+    return [np.floor(plane).astype(np.int32) for plane in (y, u, v)]
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_yuv420_matches_reference(threads):
+    frame = random_frame(48, 64, seed=threads)
+    converter = YUV420Converter(64, 48, threads=threads, min_band_rows=8)
+    try:
+        out = converter.convert(frame).astype(np.int32)
+    finally:
+        converter.close()
+    y, u, v = reference_i420(frame)
+    assert np.array_equal(out[:64 * 48].reshape(48, 64), y)
+    # The 2x2 sum is folded into the shift, so chroma may round one step apart
+    assert np.abs(out[64 * 48:64 * 48 * 5 // 4].reshape(24, 32) - u).max() <= 1
+    assert np.abs(out[64 * 48 * 5 // 4:].reshape(24, 32) - v).max() <= 1
+
+def test_yuv420_threads_agree_and_crop_odd_sizes():
+    frame = random_frame(31, 45)
+    single = YUV420Converter(45, 31, threads=1)
+    pooled = YUV420Converter(45, 31, threads=4, min_band_rows=4)
+    try:
+        assert (single.width, single.height) == (44, 30)
+        assert len(single.out) == 44 * 30 * 3 // 2
+        assert np.array_equal(single.convert(frame), pooled.convert(frame))
+    finally:
+        single.close()
+        pooled.close()
+
+def test_yuv420_flat_colours():
+    frame = np.zeros((16, 16, 4), dtype=np.uint8)
+    converter = YUV420Converter(16, 16, threads=1)
+    out = converter.convert(frame)
+    assert set(out[:256]) == {16}
+    assert set(out[256:]) == {128}
+    frame[:, :, :3] = 255
+    out = converter.convert(frame)
+    assert set(out[:256]) == {235}
+    assert set(out[256:]) == {128}
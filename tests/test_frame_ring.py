@@ -0,0 +1,27 @@
+import multiprocessing
+import threading
+
+import pytest
+
+from frame_ring import BLOCK, DROP_NEWEST, SharedFrameRing
+from recorder import PipelineStats
+
+@pytest.fixture
+def ring():
+    # One slot, already taken by the writer
+    ring = SharedFrameRing(multiprocessing.get_context("spawn"), 1, [(4, 4, 4)])
+    ring.free[0].get(timeout=5)
+    yield ring
+    ring.close()
+
+def test_full_ring_drops_the_newest_frame(ring):
+    stats = PipelineStats()
+    assert ring.acquire(0, DROP_NEWEST, threading.Event(), stats) is None
+    assert stats["queue_newest"] == 1
+
+def test_block_policy_counts_the_frame_lost_at_stop(ring):
+    stats = PipelineStats()
+    stop = threading.Event()
+    stop.set()
+    assert ring.acquire(0, BLOCK, stop, stats) is None
+    assert stats["queue_newest"] == 1
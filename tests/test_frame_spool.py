@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+
+from frame_spool import FrameSpool
+
+SHAPE = (10, 10, 4)
+FRAME_BYTES = 400
+
+def frame(value):
+    return np.full(SHAPE, value, dtype=np.uint8)
+
+def take(spool):
+    view, capture_time, _, track = spool.get()
+    item = (int(view[0, 0, 0]), capture_time, track)
+    del view
+    spool.release()
+    return item
+
+@pytest.fixture
+def spool(tmp_path):
+    # Room for two and a half frames
+    spool = FrameSpool([SHAPE], FRAME_BYTES * 5 // 2, directory=str(tmp_path))
+    yield spool
+    spool.close()
+
+def test_rejects_a_spool_smaller_than_one_frame(tmp_path):
+    with pytest.raises(ValueError):
+        FrameSpool([SHAPE], FRAME_BYTES - 1, directory=str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+def test_full_spool_refuses_frames(spool):
+    assert spool.put(frame(1), 0.1, 0)
+    assert spool.put(frame(2), 0.2, 0)
+    assert not spool.put(frame(3), 0.3, 0)
+    assert spool.frames_full == 1
+    assert take(spool) == (1, 0.1, 0)
+    assert take(spool) == (2, 0.2, 0)
+
+def test_frames_wrap_around_the_end(spool):
+    spool.put(frame(1), 0.1, 0)
+    spool.put(frame(2), 0.2, 0)
+    assert take(spool) == (1, 0.1, 0)
+    # No room after frame 2, but frame 1's space at the start is free again
+    assert spool.put(frame(3), 0.3, 0)
+    assert spool.head == FRAME_BYTES
+    assert not spool.put(frame(4), 0.4, 0)
+    assert take(spool) == (2, 0.2, 0)
+    assert spool.put(frame(4), 0.4, 0)
+    assert take(spool) == (3, 0.3, 0)
+    assert take(spool) == (4, 0.4, 0)
+    assert spool.used == 0
+    assert spool.peak_used == 2 * FRAME_BYTES
+
+def test_tracks_of_different_sizes(tmp_path):
+    spool = FrameSpool([SHAPE, (4, 4, 4)], 1000, directory=str(tmp_path))
+    try:
+        spool.put(frame(5), 1.0, 0)
+        spool.put(np.full((4, 4, 4), 6, dtype=np.uint8), 2.0, 1)
+        view, _, _, track = spool.get()
+        assert view.shape == SHAPE and track == 0
+        del view
+        spool.release()
+        view, _, _, track = spool.get()
+        assert view.shape == (4, 4, 4) and track == 1 and view[3, 3, 3] == 6
+        del view
+        spool.release()
+    finally:
+        spool.close()
+
+def test_deferred_spool_holds_frames_until_input_ends(tmp_path):
+    spool = FrameSpool([SHAPE], FRAME_BYTES * 10, directory=str(tmp_path), defer=True)
+    try:
+        spool.put(frame(1), 0.1, 0)
+        assert not spool.draining
+        spool.close_input()
+        assert take(spool) == (1, 0.1, 0)
+        assert spool.get() is None
+    finally:
+        spool.close()
+
+def test_deferred_spool_drains_at_high_water(tmp_path):
+    spool = FrameSpool([SHAPE], FRAME_BYTES * 4, directory=str(tmp_path), defer=True, high_water=0.5)
+    try:
+        spool.put(frame(1), 0.1, 0)
+        assert not spool.draining
+        spool.put(frame(2), 0.2, 0)
+        assert spool.draining
+    finally:
+        spool.close()
+
+def test_close_removes_the_file(tmp_path):
+    spool = FrameSpool([SHAPE], FRAME_BYTES, directory=str(tmp_path))
+    path = spool.path
+    spool.close()
+    assert not os.path.exists(path)
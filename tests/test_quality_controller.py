@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+from quality_controller import QualityController
+
+def sample(depth=0, frames=0, latency_ms=0.0, late=0, blocked=0.0):
+    # A get_stats() snapshot with just what the controller reads; counters are
+    # totals since the start, like the real ones
+    return {
+        "stages": {"latency": {"count": frames, "mean_ms": latency_ms}},
+        "late": late, "queue_oldest": 0, "queue_newest": 0, "queue_block_time": blocked,
+        "queue_depth": depth, "queue_capacity": 8,
+    }
+
+def make_controller():
+    divisor = SimpleNamespace(value=1)
+    return QualityController(60, divisor, lower_cooldown=1.0, raise_after=3.0), divisor
+
+def test_quality_first_sample_is_only_a_baseline():
+    controller, divisor = make_controller()
+    assert controller.update(sample(depth=8), 0.0) is None
+    assert divisor.value == 1
+
+def test_quality_lowers_one_divisor_step_per_cooldown():
+    controller, divisor = make_controller()
+    controller.update(sample(), 0.0)
+    assert controller.update(sample(depth=6), 0.5) == "lower: queue 6/8"
+    assert divisor.value == 2 and controller.effective_fps == 30
+    # Still backed up, but the last step was too recent
+    assert controller.update(sample(depth=6), 1.0) is None
+    controller.update(sample(depth=6), 1.5)
+    controller.update(sample(depth=6), 2.5)
+    # Already at the lowest rate
+    assert controller.update(sample(depth=6), 3.5) is None
+    assert divisor.value == 4
+    assert [fps for _, fps, _ in controller.log] == [30, 20, 15]
+
+def test_quality_reasons():
+    controller, _ = make_controller()
+    controller.update(sample(frames=30, latency_ms=10.0), 0.0)
+    # 30 new frames at 200 ms lift the running mean to 105 ms
+    assert controller.update(sample(frames=60, latency_ms=105.0), 1.0) == "lower: latency 200 ms"
+    controller.update(sample(frames=60, latency_ms=105.0, late=3), 2.0)
+    controller.update(sample(frames=60, latency_ms=105.0, late=3, blocked=0.2), 3.0)
+    assert [reason for _, _, reason in controller.log] == [
+        "lower: latency 200 ms", "lower: 3 frames dropped", "lower: capture blocked 200 ms",
+    ]
+
+def test_quality_raises_back_after_a_healthy_stretch():
+    controller, divisor = make_controller()
+    controller.update(sample(), 0.0)
+    controller.update(sample(depth=6), 0.5)
+    # Healthy from 1 s on: back up one step 3 s later
+    assert controller.update(sample(), 1.0) is None
+    assert controller.update(sample(), 3.5) is None
+    assert controller.update(sample(), 4.0) == "raise: healthy for 3 s"
+    assert divisor.value == 1
+
+def test_quality_undone_raise_doubles_the_wait():
+    controller, divisor = make_controller()
+    controller.update(sample(), 0.0)
+    controller.update(sample(depth=6), 0.5)
+    controller.update(sample(), 1.0)
+    controller.update(sample(), 4.0)
+    # Falling behind right after a raise: the next raise waits twice as long
+    controller.update(sample(depth=6), 5.0)
+    assert controller.raise_after == 6.0
+    controller.update(sample(), 5.5)
+    assert controller.update(sample(), 8.5) is None
+    assert controller.update(sample(), 11.5) == "raise: healthy for 6 s"
+    assert divisor.value == 1
@@ -0,0 +1,113 @@
+import queue
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from recorder import (
+    BLOCK, OUTPUT_SEGMENTS, ChangeDetector, FFmpegEncoder, FrameSource, PipelineStats, ScreenRecorder, pack_tracks,
+    plan_capture
+)
+
+def blank(height, width):
+    return np.zeros((height, width, 4), dtype=np.uint8)
+
+def test_change_detector_first_frame_is_all_changed():
+    detector = ChangeDetector(tile_size=64)
+    tiles = detector.changed_tiles(blank(130, 200))
+    assert tiles.shape == (3, 4)
+    assert tiles.all()
+
+def test_change_detector_finds_the_changed_tile():
+    detector = ChangeDetector(tile_size=64)
+    frame = blank(130, 200)
+    detector.changed_tiles(frame)
+    assert not detector.changed_tiles(frame.copy()).any()
+
+    changed = frame.copy()
+    changed[70, 130, 1] = 255
+    tiles = detector.changed_tiles(changed)
+    assert tiles.sum() == 1
+    assert tiles[1, 2]
+
+def test_change_detector_edge_tiles_and_odd_widths():
+    # 33 pixels a row is not a whole number of 64-bit words
+    detector = ChangeDetector(tile_size=16)
+    frame = blank(20, 33)
+    detector.changed_tiles(frame)
+    changed = frame.copy()
+    changed[19, 32, 0] = 1
+    tiles = detector.changed_tiles(changed)
+    assert tiles.shape == (2, 3)
+    assert tiles.sum() == 1
+    assert tiles[1, 2]
+
+def test_change_detector_size_change_is_all_changed():
+    detector = ChangeDetector(tile_size=64)
+    detector.changed_tiles(blank(128, 128))
+    assert detector.changed_tiles(blank(64, 128)).all()
+
+MONITOR = {"left": 100, "top": 50, "width": 640, "height": 480}
+
+def test_plan_capture_whole_monitor():
+    area, halvings, frame_size, output_size = plan_capture(MONITOR)
+    assert area == MONITOR
+    assert (halvings, frame_size, output_size) == (0, (640, 480), None)
+
+def test_plan_capture_region_is_relative_and_clipped():
+    area, _, frame_size, _ = plan_capture(MONITOR, region=(600, 400, 100, 100))
+    assert area == {"left": 700, "top": 450, "width": 40, "height": 80}
+    assert frame_size == (40, 80)
+
+def test_plan_capture_region_outside_the_screen():
+    with pytest.raises(ValueError):
+        plan_capture(MONITOR, region=(1000, 1000, 50, 50))
+
+def test_plan_capture_halves_then_leaves_the_rest_to_ffmpeg():
+    _, halvings, frame_size, output_size = plan_capture(MONITOR, output_scale=0.5)
+    assert (halvings, frame_size, output_size) == (1, (320, 240), None)
+    _, halvings, frame_size, output_size = plan_capture(MONITOR, output_scale=0.3)
+    assert (halvings, frame_size) == (1, (320, 240))
+    # 0.3 of 640x480, rounded down to even sizes
+    assert output_size == (192, 144)
+
+@pytest.mark.parametrize("scale", [0, -1, 1.5])
+def test_plan_capture_rejects_bad_scales(scale):
+    with pytest.raises(ValueError):
+        plan_capture(MONITOR, output_scale=scale)
+
+def test_pack_tracks_picks_the_smaller_canvas():
+    # Side by side: 3200x1080 beats 1920x2104 stacked
+    assert pack_tracks([(1920, 1080), (1280, 1024)]) == ([(0, 0), (1920, 0)], (3200, 1080))
+    # Stacked: 1920x1280 beats 3840x1080 side by side
+    assert pack_tracks([(1920, 1080), (1920, 200)]) == ([(0, 0), (0, 1080)], (1920, 1280))
+
+def test_block_policy_counts_the_frame_lost_at_stop():
+    stop = threading.Event()
+    stop.set()
+    frame_queue = queue.Queue(maxsize=1)
+    frame_queue.put("queued")
+    recorder = SimpleNamespace(drop_policy=BLOCK, _stop_event=stop, frame_queue=frame_queue)
+    stats = PipelineStats()
+    ScreenRecorder._enqueue_frame(recorder, "late", stats)
+    assert stats["queue_newest"] == 1
+    assert frame_queue.get_nowait() == "queued"
+
+@pytest.mark.parametrize("duration, interval", [(1.0, 1.0), (0.5, 0.5), (3.0, 1.5), (60.0, 2.0)])
+def test_segment_keyframes_divide_the_segment_duration(duration, interval):
+    encoder = FFmpegEncoder("out.mp4", [((64, 48), None)], 30, output_mode=OUTPUT_SEGMENTS,
+                            segment_duration=duration)
+    assert encoder.keyframe_interval == interval
+
+def test_frame_source_starts_the_clock_on_the_first_frame_only():
+    frame_queue = queue.Queue()
+    for capture_time in (5.0, 6.0):
+        frame_queue.put((None, capture_time, None, 0))
+    epochs = []
+    source = FrameSource(frame_queue, on_first_frame=epochs.append)
+    source.get()
+    source.done()
+    source.get()
+    assert source.timebase == 5.0
+    assert epochs == [5.0]
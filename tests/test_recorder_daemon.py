@@ -0,0 +1,53 @@
+import pytest
+
+from recorder_daemon import check_limits, check_options, parse_value
+
+def test_valid_options_pass():
+    check_options({
+        "filename": "demo.mp4", "fps": 30, "record_cursor": True, "output_scale": 0.5,
+        "region": [0, 0, 640, 480], "audio_device_id": ["mic", "loopback"],
+        "encoder_settings": {"preset": "veryfast", "crf": 20}, "spool": None,
+    })
+    check_options({"encoder_settings": "auto", "audio_gains": [1, 0.5]})
+
+@pytest.mark.parametrize("options", [
+    {"fps": "abc"},
+    {"fps": 0},
+    {"fps": True},
+    {"record_cursor": 1},
+    {"output_scale": 2},
+    {"queue_size": 1.5},
+    {"drop_policy": "sometimes"},
+    {"encoder_settings": "fast"},
+    {"encoder_settings": {"preset": "bogus"}},
+    {"encoder_settings": {"crf": 60}},
+    {"encoder_settings": {"bitrate": "1M"}},
+    {"region": [0, 0, 100]},
+    {"audio_device_id": [1]},
+    {"no_such_option": 1},
+])
+def test_bad_options_are_rejected(options):
+    with pytest.raises(ValueError):
+        check_options(options)
+
+@pytest.mark.parametrize("filename", ["../out.mp4", "/tmp/out.mp4", "sub/out.mp4", "..", "", "a\\b.mp4"])
+def test_filename_must_stay_in_the_session_directory(filename):
+    with pytest.raises(ValueError):
+        check_options({"filename": filename})
+
+@pytest.mark.parametrize("name", ["work_dir", "spool_dir", "replay_buffer"])
+def test_in_process_options_are_rejected(name):
+    with pytest.raises(ValueError):
+        check_options({name: "/tmp"})
+
+def test_limits():
+    check_limits({"max_duration": 60, "max_size_mb": 1.5, "nice": 10, "encoder_threads": None})
+    for limits in ({"nice": -5}, {"max_duration": "1h"}, {"timeout": 5}):
+        with pytest.raises(ValueError):
+            check_limits(limits)
+
+def test_parse_value():
+    assert parse_value("30") == 30
+    assert parse_value("true") is True
+    assert parse_value('{"crf": 20}') == {"crf": 20}
+    assert parse_value("yuv420p") == "yuv420p"
@@ -0,0 +1,103 @@
+from matroska_writer import _ebml, _ebml_size
+from replay_buffer import ReplayBuffer
+
+# A hand-built stream shaped like ffmpeg's: EBML header, an unknown-size
+# Segment, Tracks (1 video, 2 audio), then clusters of SimpleBlocks
+VIDEO, AUDIO = 1, 2
+
+def track_entry(number, track_type):
+    return _ebml(b"\xae", _ebml(b"\xd7", number) + _ebml(b"\x83", track_type))
+
+HEADER = (
+    _ebml(b"\x1a\x45\xdf\xa3", _ebml(b"\x42\x82", "matroska")) +
+    b"\x18\x53\x80\x67\x01\xff\xff\xff\xff\xff\xff\xff" +
+    _ebml(b"\x16\x54\xae\x6b", track_entry(VIDEO, 1) + track_entry(AUDIO, 2))
+)
+
+def block(track, timecode, keyframe, size=100):
+    flags = b"\x80" if keyframe else b"\x00"
+    return _ebml(b"\xa3", _ebml_size(track) + timecode.to_bytes(2, "big", signed=True) + flags + bytes(size))
+
+def cluster(timestamp, *blocks):
+    return _ebml(b"\x1f\x43\xb6\x75", _ebml(b"\xe7", timestamp) + b"".join(blocks))
+
+def gop_cluster(timestamp):
+    # Audio ahead of the keyframe, then a second of video and audio
+    return cluster(
+        timestamp,
+        block(AUDIO, 0, True),
+        block(VIDEO, 0, True),
+        block(VIDEO, 500, False),
+        block(AUDIO, 500, True),
+        block(VIDEO, 1000, False),
+    )
+
+def feed_in_pieces(buffer, data, piece=37):
+    for i in range(0, len(data), piece):
+        buffer.feed(data[i:i + piece])
+
+def test_header_and_gops_from_a_split_stream():
+    buffer = ReplayBuffer(max_bytes=1 << 20)
+    feed_in_pieces(buffer, HEADER + gop_cluster(0) + gop_cluster(1000) + gop_cluster(2000))
+    assert buffer.video_track == VIDEO
+    assert bytes(buffer.header) == HEADER
+    assert [gop.start_ms for gop in buffer.gops] == [0, 1000, 2000]
+    assert buffer.gops[-1].end_ms == 3000
+    assert buffer.buffered_seconds() == 3.0
+    assert not buffer.pending
+
+def test_clusters_without_a_keyframe_continue_the_gop():
+    buffer = ReplayBuffer()
+    buffer.feed(HEADER + gop_cluster(0) + cluster(1100, block(VIDEO, 0, False), block(AUDIO, 0, True)))
+    assert len(buffer.gops) == 1
+    assert len(buffer.gops[0].chunks) == 2
+    assert buffer.gops[0].end_ms == 1100
+
+def test_keyframe_mid_cluster_is_split_into_its_own_cluster():
+    buffer = ReplayBuffer()
+    buffer.feed(HEADER + cluster(
+        0,
+        block(VIDEO, 0, True),
+        block(AUDIO, 10, True),
+        block(VIDEO, 500, True),
+        block(AUDIO, 510, True),
+    ))
+    assert len(buffer.gops) == 2
+    second = buffer.gops[1].chunks[0]
+    # A cluster of its own, starting with the keyframe block
+    assert second.startswith(b"\x1f\x43\xb6\x75")
+    check = ReplayBuffer()
+    check.feed(HEADER + second)
+    assert len(check.gops) == 1
+
+def test_oldest_gops_are_evicted_whole():
+    size = len(gop_cluster(1000))
+    buffer = ReplayBuffer(max_bytes=2 * size)
+    buffer.feed(HEADER + b"".join(gop_cluster(t) for t in range(0, 5000, 1000)))
+    assert [gop.start_ms for gop in buffer.gops] == [3000, 4000]
+    assert buffer.buffered == 2 * size
+    # The cluster at 0 ms has a one byte shorter timestamp
+    assert (buffer.evicted_gops, buffer.evicted_bytes) == (3, 3 * size - 1)
+
+def test_newest_gop_is_kept_even_over_the_limit():
+    buffer = ReplayBuffer(max_bytes=10)
+    buffer.feed(HEADER + gop_cluster(0) + gop_cluster(1000))
+    assert [gop.start_ms for gop in buffer.gops] == [1000]
+
+def test_snapshot_starts_on_a_keyframe_far_enough_back():
+    buffer = ReplayBuffer()
+    clusters = [gop_cluster(t) for t in range(0, 5000, 1000)]
+    buffer.feed(HEADER + b"".join(clusters))
+    # Newest data ends at 5 s: 2.5 s back needs the GOP from 2 s on
+    assert buffer.snapshot(2.5) == [HEADER] + clusters[2:]
+    assert buffer.snapshot() == [HEADER] + clusters
+    assert ReplayBuffer().snapshot() == []
+
+def test_save_mkv_writes_header_and_gops(tmp_path):
+    buffer = ReplayBuffer()
+    clusters = [gop_cluster(t) for t in range(0, 3000, 1000)]
+    buffer.feed(HEADER + b"".join(clusters))
+    path = tmp_path / "replay.mkv"
+    buffer.save(str(path), seconds=1.5)
+    assert path.read_bytes() == HEADER + b"".join(clusters[1:])
+    assert buffer.saves == 1